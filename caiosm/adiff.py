@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:32:08 2026
+
+@author: lucadelu
+"""
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+OSM_TYPES = ["node", "way", "relation"]
+
+
+class AdiffReader:
+    """Class to read incrementally an Overpass augmented diff, every action
+    is returned as soon as it is complete and removed from memory"""
+
+    def __init__(self):
+        """Inizialize"""
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root = None
+        self.depth = 0
+        self.changesets = OrderedDict()
+        self.relations = OrderedDict()
+        self.ways = OrderedDict()
+        self.members = {}
+
+    def _change(self, action):
+        """Return a dictionary with the information of an action
+
+        :param obj action: the action element
+        """
+        typ = action.get("type")
+        elem = None
+        for child in action:
+            if child.tag == "new" and typ in ["modify", "delete"]:
+                elem = next(iter(child), None)
+            elif child.tag in OSM_TYPES and typ == "create":
+                elem = child
+            # store the members of old and new version of relations
+            for rel in child.iter("relation"):
+                for mem in rel.iter("member"):
+                    if mem.get("type") == "way":
+                        self.members.setdefault(int(mem.get("ref")), set()).add(
+                            int(rel.get("id"))
+                        )
+        if elem is None or elem.tag not in OSM_TYPES:
+            return None
+        return {
+            "action": typ,
+            "type": elem.tag,
+            "id": int(elem.get("id")),
+            "changeset": elem.get("changeset"),
+            "timestamp": elem.get("timestamp"),
+        }
+
+    def feed(self, data):
+        """Parse a chunk of data and yield the completed actions as
+        dictionary with action, type, id, changeset and timestamp keys
+
+        :param str data: a chunk of the augmented diff
+        """
+        self.parser.feed(data)
+        for event, elem in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+                self.depth += 1
+                continue
+            self.depth -= 1
+            # only the direct children of root are processed and removed
+            if self.depth != 1:
+                continue
+            if elem.tag == "action":
+                change = self._change(elem)
+                if change:
+                    yield change
+            elem.clear()
+            self.root.remove(elem)
+
+    def iter_changes(self, chunks):
+        """Parse the augmented diff and yield the actions, see feed
+
+        :param obj chunks: an iterable of strings with the augmented diff
+        """
+        for chunk in chunks:
+            for change in self.feed(chunk):
+                yield change
+        self.parser.close()
+
+    def add_change(self, change):
+        """Register a change, its changeset and the changed element are
+        added once keeping the order
+
+        :param dict change: the change returned by feed
+        """
+        self.changesets[change["changeset"]] = True
+        if change["type"] == "relation":
+            self.relations[change["id"]] = True
+        elif change["type"] == "way":
+            self.ways[change["id"]] = True
+        return True
+
+    @property
+    def routes(self):
+        """The ids of the routes changed directly or with one of their ways"""
+        routes = OrderedDict(self.relations)
+        for way in self.ways.keys():
+            for rel in sorted(self.members.get(way, [])):
+                routes[rel] = True
+        return list(routes.keys())
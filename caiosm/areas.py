@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:10:52 2026
+
+@author: lucadelu
+"""
+import os
+import json
+import tempfile
+import threading
+from .cache import CACHE_DIR
+
+# default file where the Overpass area ids are stored
+AREAS_FILE = os.path.join(CACHE_DIR, "areas.json")
+
+
+class AreaIds:
+    """Class to store the Overpass area ids of area names, the name is looked
+    up only once and the next queries select the area by id"""
+
+    def __init__(self, path=AREAS_FILE, debug=False):
+        """Inizialize
+
+        :param str path: the path to the JSON file with the area ids
+        :param bool debug: print debug information
+        """
+        self.path = os.path.expanduser(path)
+        self.debug = debug
+        self.lock = threading.Lock()
+        self.ids = {}
+        # names not found are looked up only once for each instance
+        self.notfound = set()
+        if os.path.exists(self.path):
+            with open(self.path) as fil:
+                self.ids = json.load(fil)
+
+    def get(self, name):
+        """Return the list of area ids of a name or None if it is unknown
+
+        :param str name: the name of the area
+        """
+        return self.ids.get(name)
+
+    def set(self, name, ids):
+        """Store the area ids of a name, the area id of a relation is its id
+        plus 3600000000
+
+        :param str name: the name of the area
+        :param list ids: the Overpass area ids
+        """
+        with self.lock:
+            self.ids[name] = sorted(int(i) for i in ids)
+            self._save()
+        return True
+
+    def _save(self):
+        """Private function to write the ids, the file is replaced at once so
+        concurrent processes never read partial files"""
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = tempfile.NamedTemporaryFile(
+            mode="w", dir=dirname or None, suffix=".tmp", delete=False
+        )
+        with tmp:
+            json.dump(self.ids, tmp, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp.name, self.path)
+        return True
+
+    def resolve(self, names, base):
+        """Look up with a single Overpass query the unknown names, like the
+        selector area["name"=...] all the areas with the name are used. Names
+        not found are not stored and they are still selected by name
+
+        :param list names: the names of the areas
+        :param obj base: a CaiOsmBase instance used to send the query
+        """
+        missing = [
+            name
+            for name in names
+            if self.get(name) is None and name not in self.notfound
+        ]
+        if not missing:
+            return True
+        selectors = "".join(
+            'area["name"="{}"];'.format(name.replace('"', '\\"')) for name in missing
+        )
+        instr = "[timeout:{time}][out:json];({sel});out tags;".format(
+            time=base.timeout, sel=selectors
+        )
+        found = {}
+        for elem in json.loads(base._get_data(instr))["elements"]:
+            name = elem.get("tags", {}).get("name")
+            if name in missing:
+                found.setdefault(name, []).append(elem["id"])
+        with self.lock:
+            for name, ids in found.items():
+                self.ids[name] = sorted(ids)
+            self.notfound.update(set(missing) - set(found.keys()))
+            self._save()
+        if self.debug:
+            for name in missing:
+                print("Area {}: {}".format(name, self.ids.get(name, "not found")))
+        return True
+
+    def selector(self, name, base=None, setname="a"):
+        """Return the Overpass statement storing the areas of a name in a set,
+        using their ids when known. With base the unknown names are resolved
+
+        :param str name: the name of the area
+        :param obj base: a CaiOsmBase instance used to resolve the name
+        :param str setname: the name of the Overpass set
+        """
+        if self.get(name) is None and base is not None:
+            self.resolve([name], base)
+        ids = self.get(name)
+        if ids:
+            return "area(id:{})->.{};".format(",".join(str(i) for i in ids), setname)
+        return 'area["name"="{}"]->.{};'.format(name, setname)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:40 2026
+
+@author: lucadelu
+"""
+import os
+import re
+import gzip
+import time
+import shutil
+import hashlib
+import tempfile
+
+# default directory where Overpass responses are stored
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "caiosm")
+# default maximum size of the cache in bytes (compressed data)
+CACHE_MAXSIZE = 1024 * 1024 * 1024
+# seconds a response is considered valid for each kind of query, queries on
+# a fixed date or between two fixed dates don't change so they live longer
+CACHE_TTL = {
+    "csv": 6 * 3600,
+    "json": 6 * 3600,
+    "xml": 6 * 3600,
+    "date": 30 * 86400,
+    "adiff": 30 * 86400,
+}
+
+
+def query_kind(instr):
+    """Return the kind of an Overpass query, used to choose the TTL
+
+    :param str instr: the string with the overpass syntax
+    """
+    if "[adiff:" in instr:
+        return "adiff"
+    if "[date:" in instr:
+        return "date"
+    out = re.search(r"\[out:(\w+)", instr)
+    if out:
+        return out.group(1)
+    return "xml"
+
+
+def normalize_query(instr):
+    """Return a normalized version of an Overpass query, the timeout and the
+    white spaces don't change the result so they are removed
+
+    :param str instr: the string with the overpass syntax
+    """
+    instr = re.sub(r"\[timeout:\d+\]", "", instr)
+    return " ".join(instr.split())
+
+
+class OverpassCache:
+    """Class to store Overpass API responses compressed on disk"""
+
+    def __init__(
+        self,
+        path=CACHE_DIR,
+        maxsize=CACHE_MAXSIZE,
+        ttl=None,
+        refresh=False,
+        debug=False,
+    ):
+        """Inizialize
+
+        :param str path: the directory where to store the cached responses
+        :param int maxsize: the maximum size in bytes of the cache, the least
+                            recently used responses are removed over it
+        :param dict ttl: seconds of validity for each query kind, it updates
+                         the CACHE_TTL values
+        :param bool refresh: never read from the cache but store the new
+                             responses
+        :param bool debug: print debug information
+        """
+        self.path = os.path.expanduser(path)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.maxsize = maxsize
+        self.ttl = dict(CACHE_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+        self.refresh = refresh
+        self.debug = debug
+
+    def key(self, instr, url):
+        """Return the key of a query, it is the hash of the normalized query
+        plus the endpoint url
+
+        :param str instr: the string with the overpass syntax
+        :param str url: the url of the Overpass endpoint
+        """
+        text = "{}\n{}".format(url, normalize_query(instr))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        """Return the path of the file for a key
+
+        :param str key: the key of a query
+        """
+        return os.path.join(self.path, "{}.gz".format(key))
+
+    def lookup(self, instr, url):
+        """Return the path to the valid cached file for the query or None
+
+        :param str instr: the string with the overpass syntax
+        :param str url: the url of the Overpass endpoint
+        """
+        if self.refresh:
+            return None
+        path = self._file(self.key(instr, url))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        ttl = self.ttl.get(query_kind(instr), CACHE_TTL["xml"])
+        if now - stat.st_mtime > ttl:
+            if self.debug:
+                print("Cache expired for {}".format(path))
+            self._remove(path)
+            return None
+        # access time is used to remove the least recently used files
+        os.utime(path, (now, stat.st_mtime))
+        if self.debug:
+            print("Cache hit {}".format(path))
+        return path
+
+    def get(self, instr, url):
+        """Return the cached response as bytes or None
+
+        :param str instr: the string with the overpass syntax
+        :param str url: the url of the Overpass endpoint
+        """
+        path = self.lookup(instr, url)
+        if path is None:
+            return None
+        try:
+            with gzip.open(path, "rb") as fi:
+                return fi.read()
+        except (OSError, EOFError):
+            self._remove(path)
+            return None
+
+    def set(self, instr, url, data):
+        """Store a response in the cache
+
+        :param str instr: the string with the overpass syntax
+        :param str url: the url of the Overpass endpoint
+        :param bytes data: the response of the server
+        """
+        tmp = tempfile.NamedTemporaryFile(dir=self.path, suffix=".tmp", delete=False)
+        with gzip.GzipFile(fileobj=tmp, mode="wb") as fi:
+            fi.write(data)
+        tmp.close()
+        return self._store(instr, url, tmp.name)
+
+    def set_file(self, instr, url, inpath):
+        """Store a response already saved into a file in the cache
+
+        :param str instr: the string with the overpass syntax
+        :param str url: the url of the Overpass endpoint
+        :param str inpath: the path to the file with the server response
+        """
+        tmp = tempfile.NamedTemporaryFile(dir=self.path, suffix=".tmp", delete=False)
+        with open(inpath, "rb") as infile:
+            with gzip.GzipFile(fileobj=tmp, mode="wb") as fi:
+                shutil.copyfileobj(infile, fi)
+        tmp.close()
+        return self._store(instr, url, tmp.name)
+
+    def _store(self, instr, url, tmpname):
+        """Move a temporary compressed file to its final position
+
+        :param str instr: the string with the overpass syntax
+        :param str url: the url of the Overpass endpoint
+        :param str tmpname: the path to the temporary compressed file
+        """
+        path = self._file(self.key(instr, url))
+        # replace is atomic so concurrent processes never read partial files
+        os.replace(tmpname, path)
+        self.evict()
+        return path
+
+    def _remove(self, path):
+        """Remove a file from the cache, ignore already removed files
+
+        :param str path: the path to remove
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        """Return the size in bytes of the cache"""
+        return sum(os.path.getsize(p) for p, _ in self._entries())
+
+    def _entries(self):
+        """Return a list of tuple with path and last access time of the
+        cached files"""
+        output = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".gz"):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                output.append((path, os.stat(path).st_atime))
+            except FileNotFoundError:
+                continue
+        return output
+
+    def evict(self):
+        """Remove the least recently used files until the cache size is
+        lower than maxsize"""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        sizes = {}
+        for path, _ in entries:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except FileNotFoundError:
+                sizes[path] = 0
+        total = sum(sizes.values())
+        for path, _ in entries:
+            if total <= self.maxsize:
+                break
+            if self.debug:
+                print("Cache remove {}".format(path))
+            self._remove(path)
+            total -= sizes[path]
+        return total
+
+    def clear(self):
+        """Remove all the files from the cache"""
+        for path, _ in self._entries():
+            self._remove(path)
+        return True
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:05:12 2026
+
+@author: lucadelu
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# headers sent with every request, compressed transfer reduces a lot the
+# size of Overpass XML and JSON data
+HEADERS = {
+    "Referer": "http://www.cai.it",
+    "Accept-Encoding": "gzip, deflate",
+}
+# seconds to wait for the connection to the server
+CONNECT_TIMEOUT = 30
+# seconds to wait for data from the server, None to wait forever
+READ_TIMEOUT = None
+# number of connections kept alive for each host
+POOL_SIZE = 10
+# size of the chunks used to read the responses
+CHUNK_SIZE = 1024 * 1024
+
+_LOCAL = threading.local()
+
+
+def configure(connect_timeout=None, read_timeout=None, pool_size=None):
+    """Set the default values for all the sessions created after the call
+
+    :param int connect_timeout: seconds to wait for the connection
+    :param int read_timeout: seconds to wait for data from the server
+    :param int pool_size: number of connections kept alive for each host
+    """
+    global CONNECT_TIMEOUT, READ_TIMEOUT, POOL_SIZE
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+        close_session()
+    return True
+
+
+def get_session():
+    """Return the session of the current thread, the connections are kept
+    alive and reused by all the requests"""
+    session = getattr(_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(HEADERS)
+        _LOCAL.session = session
+    return session
+
+
+def close_session():
+    """Close the session of the current thread and its connections"""
+    session = getattr(_LOCAL, "session", None)
+    if session is not None:
+        session.close()
+        _LOCAL.session = None
+    return True
+
+
+def request(url, data=None, connect_timeout=None, read_timeout=None):
+    """Send a request and return the response object, the body is not
+    downloaded until it is read. It raises requests.HTTPError for error
+    status codes
+
+    :param str url: the url to request
+    :param dict data: the values to send in the body with a POST request,
+                      with None a GET request is sent
+    :param int connect_timeout: seconds to wait for the connection
+    :param int read_timeout: seconds to wait for data from the server
+    """
+    if connect_timeout is None:
+        connect_timeout = CONNECT_TIMEOUT
+    if read_timeout is None:
+        read_timeout = READ_TIMEOUT
+    session = get_session()
+    timeout = (connect_timeout, read_timeout)
+    if data is None:
+        resp = session.get(url, stream=True, timeout=timeout)
+    else:
+        resp = session.post(url, data=data, stream=True, timeout=timeout)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError:
+        resp.close()
+        raise
+    return resp
+
+
+def write_response(resp, fileobj, chunk=CHUNK_SIZE):
+    """Write the body of a response into a file object, the compressed data
+    are decompressed chunk by chunk
+
+    :param obj resp: the response object
+    :param obj fileobj: a file object opened in binary mode
+    :param int chunk: the size of the chunks
+    """
+    size = 0
+    try:
+        for data in resp.iter_content(chunk_size=chunk):
+            fileobj.write(data)
+            size += len(data)
+    finally:
+        resp.close()
+    return size
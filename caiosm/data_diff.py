@@ -21,20 +21,32 @@ class ManageChanges:
         enddate=None,
         daydiff=1,
         path=None,
+        cache=None,
+        scheduler=None,
+        pool=None,
+        areas=None,
     ):
         """
         params str area: area to query
         params str sourceref: sezione code
+        params obj cache: an OverpassCache instance to store the responses
+        params obj scheduler: an OverpassScheduler instance to wait for slots
+        params obj pool: an OverpassPool instance with several endpoints
+        params obj areas: an AreaIds instance to select the area by its id
         """
         if sourceref and area:
             raise ValueError("Please select only 'area' or 'sourceref'")
         if sourceref:
             self.cord = CaiOsmRouteDiff(
-                sourceref=sourceref, enddate=enddate, startdate=startdate
+                sourceref=sourceref, enddate=enddate, startdate=startdate,
+                cache=cache, scheduler=scheduler, pool=pool
             )
             self.title = "Aggiornamento dati per la sezione {}\n\n".format()
         elif area:
-            self.cord = CaiOsmRouteDiff(area=area, startdate=startdate, enddate=enddate)
+            self.cord = CaiOsmRouteDiff(
+                area=area, startdate=startdate, enddate=enddate, cache=cache,
+                scheduler=scheduler, pool=pool, areas=areas
+            )
             self.title = "Aggiornamento dati per {}\n\n".format(area)
         else:
             raise ValueError("Please select one between 'area' or 'sourceref'")
@@ -5,23 +5,56 @@ Created on Thu Dec 13 07:28:20 2018
 
 @author: lucadelu
 """
+import io
 import os
+import gzip
 import json
+import shutil
+import time
 import geojson
-import urllib.request
 import tempfile
-import time
+import warnings
+import codecs
 import collections
+import csv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from datetime import timedelta
 import dateutil.parser
-import xmltodict
 import osmium
+import requests
 from .functions import invert_bbox
+from .functions import split_bbox
+from .functions import bisect_bbox
+from .functions import overpass_error
 from .functions import check_network
+from .functions import osm_format
+from .functions import sort_osm_xml
+from .functions import iter_json_elements
+from .adiff import AdiffReader
+from . import connection
 from .osmium_handler import CaiRoutesHandler
+from .osmium_handler import infomont_handler
+from .connection import request
+from .pool import OverpassPool
+from .planner import QueryPlan
+from .planner import ID_COLUMN
+from .planner import parse_columns
 
 DIRFILE = os.path.dirname(os.path.realpath(__file__))
+# size of the chunks used to write the downloaded data
+CHUNK_SIZE = 1024 * 1024
+# seconds added to the overpass timeout to get the default read timeout
+READ_MARGIN = 60
+# bytes at the end of the data where Overpass writes the runtime errors
+ERROR_SIZE = 4096
+# the fields used by the outputs
+CSV_FIELDS = [ID_COLUMN, "name", "ref"]
+WIKI_FIELDS = ["ref", "name", ID_COLUMN]
+# separator used to download the local tags in csv format, escaped for
+# the Overpass query
+LOCAL_SEPARATOR = "\t"
+LOCAL_SEPARATOR_QUERY = "\\t"
 
 QUERY_HIKING = """
 relation
@@ -63,6 +96,16 @@ class CaiOsmBase:
         timeout=2500,
         url="http://overpass-api.de/api/interpreter?",
         querytype="caiscale",
+        cache=None,
+        connect_timeout=None,
+        read_timeout=None,
+        scheduler=None,
+        pool=None,
+        outgeom=False,
+        tilesize=None,
+        maxsplit=4,
+        idx="flex_mem",
+        areas=None,
     ):
         """Inizialize
 
@@ -74,18 +117,48 @@ class CaiOsmBase:
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
-        :param str url: the url to use
+        :param str url: the url to use, or a list of urls to use as a pool
         :param str querytype: the type to query to use:
             - hiking: download all hiking routes
             - caiscale: use the presence of cai_scale tag to filter routes
             - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param obj cache: an OverpassCache instance to store the responses,
+                          None to disable it
+        :param int connect_timeout: seconds to wait for the connection to
+                                    the server
+        :param int read_timeout: seconds to wait for data from the server, by
+                                 default the value set with
+                                 connection.configure or, if it is not set,
+                                 the overpass timeout plus a margin
+        :param obj scheduler: an OverpassScheduler instance to wait for free
+                              slots, it could be shared between instances
+        :param obj pool: an OverpassPool instance with several endpoints, it
+                         replaces url and scheduler
+        :param bool outgeom: download the geometry of ways with 'out geom'
+                             instead of their nodes, it is faster and uses
+                             less memory but data could not be saved in OSM
+                             format
+        :param float tilesize: the maximum size in degrees of the tiles used
+                               to split the bbox queries, by default a single
+                               query is sent
+        :param int maxsplit: the number of times a tile is split in two
+                             halves when its query fails
+        :param str idx: the osmium index type to store node locations, with
+                        file based types, like dense_file_array,/path/file,
+                        the index is stored in the file
+        :param obj areas: an AreaIds instance to select the area by its
+                          Overpass id instead of its name
         """
         self.area = area
         if bbox_inverted:
             self.bbox = invert_bbox(bbox)
         else:
             self.bbox = bbox
-        self.url = url
+        if pool is None:
+            pool = OverpassPool(urls=url, scheduler=scheduler, debug=debug)
+        self.pool = pool
+        # the first url identifies the data in the cache
+        self.url = self.pool.url
         self.csvheader = False
         self.separator = separator
         self.debug = debug
@@ -94,31 +167,288 @@ class CaiOsmBase:
         if querytype not in ["hiking", "caiscale", "source"]:
             raise ValueError("Only hiking, caiscale, source values are supported")
         self.querytype = querytype
+        self.cache = cache
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.outgeom = outgeom
+        self.tilesize = tilesize
+        self.maxsplit = maxsplit
+        self.idx = idx
+        self.areas = areas
+
+    def _area(self, setname="a"):
+        """Private function to return the Overpass statement selecting the
+        area into a set, by id when the areas ids are available
+
+        :param str setname: the name of the Overpass set
+        """
+        if self.areas is None:
+            return 'area["name"="{}"]->.{};'.format(self.area, setname)
+        return self.areas.selector(self.area, base=self, setname=setname)
+
+    def _timeouts(self):
+        """Private function to return the connect and read timeouts of the
+        queries as keyword arguments of the pool"""
+        read_timeout = self.read_timeout
+        if read_timeout is None and connection.READ_TIMEOUT is None:
+            read_timeout = self.timeout + READ_MARGIN
+        return {"connect_timeout": self.connect_timeout, "read_timeout": read_timeout}
+
+    def _open(self, instr):
+        """Private function to send the query to overpass api and return the
+        response object
+
+        :param str instr: the string with the overpass syntax
+        """
+        return self.pool.open(instr, **self._timeouts())
+
+    def _download(self, instr, fileobj):
+        """Private function to write the data of a query into a file object,
+        if the download fails the query is sent to another endpoint
+
+        :param str instr: the string with the overpass syntax
+        :param obj fileobj: a seekable file object opened in binary mode
+        """
+        return self.pool.download(instr, fileobj, **self._timeouts())
+
+    def _get_bytes(self, instr):
+        """Private function to obtain the OSM data from overpass api as bytes
+
+        :param str instr: the string with the overpass syntax
+        """
+        if self.debug:
+            print(instr)
+        if self.cache:
+            respData = self.cache.get(instr, self.url)
+            if respData is not None:
+                return respData
+
+        buf = io.BytesIO()
+        self._download(instr, buf)
+        respData = buf.getvalue()
+        error = overpass_error(
+            respData[-ERROR_SIZE:].decode(encoding="utf-8", errors="ignore")
+        )
+        if error:
+            raise ValueError("Overpass error: {}".format(error))
+        if self.cache:
+            self.cache.set(instr, self.url, respData)
+        return respData
 
     def _get_data(self, instr):
         """Private function to obtain the OSM data from overpass api
 
+        :param str instr: the string with the overpass syntax
+        """
+        respData = self._get_bytes(instr)
+        return respData.decode(encoding="utf-8", errors="ignore")
+
+    def _iter_data(self, instr):
+        """Private function to obtain the data from overpass api as an
+        iterator of strings, the data are decoded chunk by chunk while they
+        are downloaded and written in the cache. Data ending with an Overpass
+        runtime error raise ValueError and they are not cached
+
         :param str instr: the string with the overpass syntax
         """
         if self.debug:
             print(instr)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        cached = None
+        if self.cache:
+            cached = self.cache.lookup(instr, self.url)
+        if cached:
+            with gzip.open(cached, "rb") as fi:
+                for data in iter(lambda: fi.read(CHUNK_SIZE), b""):
+                    yield decoder.decode(data)
+            yield decoder.decode(b"", final=True)
+            return
+        tmp = None
+        if self.cache:
+            tmp = tempfile.NamedTemporaryFile(suffix=".cache", delete=False)
+        resp = self._open(instr)
+        # the end of the data is kept to check the Overpass errors
+        tail = b""
+        try:
+            for data in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if tmp:
+                    tmp.write(data)
+                tail = (tail + data)[-ERROR_SIZE:]
+                yield decoder.decode(data)
+            error = overpass_error(tail.decode(encoding="utf-8", errors="ignore"))
+            if error:
+                raise ValueError("Overpass error: {}".format(error))
+            yield decoder.decode(b"", final=True)
+            if tmp:
+                tmp.close()
+                self.cache.set_file(instr, self.url, tmp.name)
+        finally:
+            resp.close()
+            if tmp:
+                tmp.close()
+                os.remove(tmp.name)
+
+    def _get_file(self, instr, suffix=".osm"):
+        """Private function to download the OSM data from overpass api into
+        a temporary file, the data are written in chunks and never fully
+        loaded in memory. The caller has to remove the file
 
-        values = {"data": instr}
-        data = urllib.parse.urlencode(values)
-        data = data.encode("utf-8")  # data should be bytes
-        req = urllib.request.Request(self.url, data, method="GET")
-        req.add_header("Referer", "http://www.cai.it")
+        :param str instr: the string with the overpass syntax
+        :param str suffix: the suffix of the temporary file, osmium uses it
+                           to detect the format
+        """
+        if self.debug:
+            print(instr)
+        cached = None
+        if self.cache:
+            cached = self.cache.lookup(instr, self.url)
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+            if cached:
+                with gzip.open(cached, "rb") as fi:
+                    shutil.copyfileobj(fi, tmp, CHUNK_SIZE)
+            else:
+                try:
+                    self._download(instr, tmp)
+                except Exception:
+                    tmp.close()
+                    os.remove(tmp.name)
+                    raise
+        if not cached:
+            with open(tmp.name, "rb") as fi:
+                fi.seek(max(0, os.path.getsize(tmp.name) - ERROR_SIZE))
+                error = overpass_error(
+                    fi.read().decode(encoding="utf-8", errors="ignore")
+                )
+            if error:
+                os.remove(tmp.name)
+                raise ValueError("Overpass error: {}".format(error))
+        if self.cache and not cached:
+            self.cache.set_file(instr, self.url, tmp.name)
+        return tmp.name
+
+    def _tiled(self):
+        """Private function to check if the queries are split in tiles, only
+        bbox queries could be split"""
+        return bool(self.bbox) and not self.area
+
+    def _get_tile(self, query, bbox, fetch, depth=0):
+        """Private function to download the data of a tile, if the query
+        fails the tile is split in two halves. It returns a list with the
+        results of fetch
+
+        :param obj query: the function returning the query for a bbox
+        :param str bbox: the bbox of the tile
+        :param obj fetch: the function to download the data of a query
+        :param int depth: the number of splits done to get this tile
+        """
+        try:
+            return [fetch(query(bbox))]
+        except (requests.RequestException, ValueError) as e:
+            if depth >= self.maxsplit:
+                raise
+            if self.debug:
+                print("Error with bbox {}, it is split: {}".format(bbox, e))
+        results = []
         try:
-            resp = urllib.request.urlopen(req)
-        except Exception as e:
-            if e.code == 429:
-                if self.debug:
-                    print("wait {} s".format(360))
-                time.sleep(360)
-                self._get_data(instr)
+            for half in bisect_bbox(bbox):
+                results.extend(self._get_tile(query, half, fetch, depth + 1))
+        except Exception:
+            self._remove_files(results)
             raise
-        respData = resp.read()
-        return respData.decode(encoding="utf-8", errors="ignore")
+        return results
+
+    def _get_tiles(self, query, fetch=None):
+        """Private function to download the data of a bbox split in tiles,
+        the tiles are downloaded in parallel. It returns a list with the
+        results of fetch, by default the paths of temporary OSM files that
+        the caller has to remove
+
+        :param obj query: the function returning the query for a bbox
+        :param obj fetch: the function to download the data of a query
+        """
+        if fetch is None:
+            fetch = self._get_file
+        if not self._tiled():
+            return [fetch(query(None))]
+        bboxes = [self.bbox]
+        if self.tilesize:
+            bboxes = split_bbox(self.bbox, self.tilesize)
+        # the pool limits the queries for each endpoint
+        workers = sum(end.slots for end in self.pool.endpoints)
+        results = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(workers, len(bboxes))) as executor:
+            futures = [
+                executor.submit(self._get_tile, query, bbox, fetch)
+                for bbox in bboxes
+            ]
+            for future in futures:
+                try:
+                    results.extend(future.result())
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            self._remove_files(results)
+            raise errors[0]
+        return results
+
+    def _remove_files(self, paths):
+        """Private function to remove the temporary files in a list
+
+        :param list paths: the list of paths, other values are ignored
+        """
+        for path in paths:
+            if isinstance(path, str) and os.path.exists(path):
+                os.remove(path)
+        return True
+
+    def _sort_file(self, inpath, outpath=None):
+        """Private function to sort an OSM file, overpass data are not sorted
+        and osmium requires nodes before ways and relations. With several
+        files they are merged and duplicated elements are removed
+
+        :param str inpath: the path to the unsorted OSM file or a list of paths
+        :param str outpath: the path to the output file, by default a
+                            temporary file is created
+        """
+        if not outpath:
+            outpath = tempfile.mkstemp(suffix=".osm")[1]
+        # osmium doesn't overwrite existing files
+        if os.path.exists(outpath):
+            os.remove(outpath)
+        if isinstance(inpath, str):
+            inpath = [inpath]
+        mir = osmium.MergeInputReader()
+        for path in inpath:
+            mir.add_file(path)
+        wh = osmium.WriteHandler(outpath)
+        mir.apply(wh)
+        wh.close()
+        return outpath
+
+    def _apply_file(self, handler, inpath):
+        """Private function to apply an handler to an unsorted OSM file, with
+        several files duplicated elements are removed
+
+        :param obj handler: the osmium handler to apply
+        :param str inpath: the path to the unsorted OSM file or a list of paths
+        """
+        if isinstance(inpath, str):
+            inpath = [inpath]
+        # trick to solve the problem that overpass data ar not sorted
+        mir = osmium.MergeInputReader()
+        for path in inpath:
+            mir.add_file(path)
+        start = time.time()
+        mir.apply(handler, idx=self.idx, simplify=True)
+        if self.debug and hasattr(handler, "callbacks"):
+            elapsed = max(time.time() - start, 0.001)
+            print(
+                "{} callbacks in {:.1f} s, {:.0f} callbacks/s".format(
+                    handler.callbacks, elapsed, handler.callbacks / elapsed
+                )
+            )
+        return True
 
 
 class CaiOsmData(CaiOsmBase):
@@ -136,63 +466,79 @@ class CaiOsmData(CaiOsmBase):
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
-        :param str url: the url to use
+        :param str url: the url to use, or a list of urls to use as a pool
         :param str querytype: the type to query to use:
             - hiking: download all hiking routes
             - caiscale: use the presence of cai_scale tag to filter routes
             - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param kwargs: the other parameters of CaiOsmBase, like cache and pool
         """
         super(CaiOsmData, self).__init__(**kwargs)
 
-    def get_data_csv(self, csvheader=False, tags='::id,"name","ref"', network="lwn"):
-        """Function to return data in CSV format
+    def _plan_query(
+        self,
+        plan,
+        network="lwn",
+        bbox=None,
+        out_format="json",
+        header=None,
+        separator=None,
+    ):
+        """Private function to return the query with the cheapest output for
+        the fields and the geometry required by a plan
 
-        :param bool csvheader: show or hide the csv header, default hidden
-        :param str tags: a list of tags to show in the csv
+        :param obj plan: the QueryPlan with the requirements of the outputs
+        :param str network: the network level to query, default 'lwn'
+        :param str bbox: the bbox to query, by default the bbox of the class
+        :param str out_format: the format used when csv is not possible, json
+                               or xml
+        :param bool header: show the csv header, by default the class value
+        :param str separator: the csv separator, by default the class value
         """
-        if csvheader:
-            self.csvheader = True
-        temp = """[timeout:{time}][out:csv({cols};{csvh};"{sep}")]
+        if header is None:
+            header = self.csvheader
+        if separator is None:
+            separator = self.separator
+        temp = """[timeout:{time}]{settings}
 ;
 {area}
 {query}
-out;
-"""
+{out}"""
         network = check_network(network)
+        if bbox is None:
+            bbox = self.bbox
         if self.area:
-            instr = temp.format(
-                area='area["name"="{}"]->.a;'.format(self.area),
-                csvh=str(self.csvheader).lower(),
-                sep=self.separator,
-                cols=tags,
-                query=self.query.format(netw=network, bbox="area.a"),
-                time=self.timeout,
-            )
-        elif self.bbox:
-            instr = temp.format(
-                area="",
-                csvh=str(self.csvheader).lower(),
-                sep=self.separator,
-                cols=tags,
-                query=self.query.format(netw=network, bbox=self.bbox),
-                time=self.timeout,
-            )
+            area = self._area()
+            bbox = "area.a"
         else:
-            instr = temp.format(
-                area="",
-                csvh=str(self.csvheader).lower(),
-                sep=self.separator,
-                cols=tags,
-                query=self.query.format(netw=network, bbox=""),
-                time=self.timeout,
-            )
+            area = ""
+        instr = temp.format(
+            area=area,
+            settings=plan.settings(header, separator, out_format),
+            query=self.query.format(netw=network, bbox=bbox or ""),
+            out=plan.output(),
+            time=self.timeout,
+        )
+        if self.debug:
+            print(plan)
+        return instr
 
-        return self._get_data(instr)
+    def get_data_csv(self, csvheader=False, tags='::id,"name","ref"', network="lwn"):
+        """Function to return data in CSV format
 
-    def get_data_osm(self, sort=True, network="lwn", remove=True):
-        """Function to return data in the original OSM format
+        :param bool csvheader: show or hide the csv header, default hidden
+        :param str tags: a list of tags to show in the csv
+        """
+        if csvheader:
+            self.csvheader = True
+        plan = QueryPlan(fields=parse_columns(tags))
+        return self._get_data(self._plan_query(plan, network=network))
+
+    def _query_osm(self, network="lwn", bbox=None):
+        """Private function to return the query for data in OSM format
 
         :param str network: the network level to query, default 'lwn'
+        :param str bbox: the bbox to query, by default the bbox of the class
         """
         temp = """[timeout:{time}][out:xml]
 ;
@@ -204,16 +550,18 @@ out qt;
 out;"""
 
         network = check_network(network)
+        if bbox is None:
+            bbox = self.bbox
         if self.area:
             instr = temp.format(
-                area='area["name"="{}"]->.a;'.format(self.area),
+                area=self._area(),
                 query=self.query.format(netw=network, bbox="area.a"),
                 time=self.timeout,
             )
-        elif self.bbox:
+        elif bbox:
             instr = temp.format(
                 area="",
-                query=self.query.format(netw=network, bbox=self.bbox),
+                query=self.query.format(netw=network, bbox=bbox),
                 time=self.timeout,
             )
         else:
@@ -222,83 +570,141 @@ out;"""
                 query=self.query.format(netw=network, bbox=""),
                 time=self.timeout,
             )
+        return instr
 
-        data = self._get_data(instr)
+    def _query_geom(self, network="lwn", bbox=None):
+        """Private function to return the query for relations and ways with
+        their geometry in JSON format
 
-        if sort:
-            mir = osmium.MergeInputReader()
-            mir.add_buffer(data.encode("utf-8"), "osm")
-            # the code stop here after printing the xml osm data
-            tempname = tempfile.mkstemp(suffix=".osm")[1]
-
-            with open(tempname, "w") as temp_osm:
-                os.unlink(temp_osm.name)
-                wh = osmium.WriteHandler(temp_osm.name)
-                mir.apply(wh, idx="flex_mem")
-                wh.close()
-                temp_osm.close()
-            with open(tempname, "r") as temp_osm:
-                data = temp_osm.read()
-            if remove:
-                os.remove(tempname)
-        return data
+        :param str network: the network level to query, default 'lwn'
+        :param str bbox: the bbox to query, by default the bbox of the class
+        """
+        return self._plan_query(
+            QueryPlan(fields=True, geometry="geom"), network=network, bbox=bbox
+        )
 
-    def get_data_json(self, network="lwn"):
-        """Function to return the OSM data in JSON formats
+    def get_files_osm(self, network="lwn"):
+        """Function to save unsorted data in OSM format into temporary files,
+        one for each tile. The caller has to remove them
 
         :param str network: the network level to query, default 'lwn'
         """
-        temp = """[timeout:{time}][out:json]
-;
-{area}
-{query}
-out;
->;
-out qt;"""
+        return self._get_tiles(
+            lambda bbox: self._query_osm(network=network, bbox=bbox)
+        )
 
-        network = check_network(network)
-        if self.area:
-            instr = temp.format(
-                area='area["name"="{}"]->.a;'.format(self.area),
-                query=self.query.format(netw=network, bbox="area.a"),
-                time=self.timeout,
-            )
-        elif self.bbox:
-            instr = temp.format(
-                area="",
-                query=self.query.format(netw=network, bbox=self.bbox),
-                time=self.timeout,
+    def get_buffer_osm(self, network="lwn"):
+        """Function to return the unsorted data in OSM format as bytes
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        if self._tiled():
+            path = self.get_file_osm(network=network)
+            try:
+                with open(path, "rb") as fil:
+                    return fil.read()
+            finally:
+                os.remove(path)
+        return self._get_bytes(self._query_osm(network=network))
+
+    def get_file_osm(self, network="lwn", sort=True, out=None, out_format=None):
+        """Function to save data in the original OSM format into a file, the
+        data of several tiles are always sorted and merged
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool sort: sort the data
+        :param str out: the path to the output file, by default a temporary
+                        file is created and the caller has to remove it
+        :param str out_format: the OSM format, one of osm, osm.gz or pbf, by
+                               default it is detected by the suffix of out
+        """
+        if out:
+            out_format, out = osm_format(out, out_format)
+        if self._tiled():
+            paths = self.get_files_osm(network=network)
+            try:
+                return self._sort_file(paths, out)
+            finally:
+                self._remove_files(paths)
+        # the data are streamed to disk and osmium writes the output format
+        path = self._get_file(self._query_osm(network=network))
+        if out and out_format == "osm" and not sort:
+            shutil.move(path, out)
+            return out
+        if sort or out:
+            try:
+                return self._sort_file(path, out)
+            finally:
+                os.remove(path)
+        return path
+
+    def get_data_osm(self, sort=True, network="lwn", remove=None):
+        """Function to return data in the original OSM format, the data are
+        sorted in memory
+
+        :param bool sort: sort the data
+        :param str network: the network level to query, default 'lwn'
+        :param bool remove: deprecated, no temporary file is created
+        """
+        if remove is not None:
+            warnings.warn(
+                "remove is deprecated, get_data_osm creates no temporary file",
+                DeprecationWarning,
+                stacklevel=2,
             )
+        data = self.get_buffer_osm(network=network)
+        if sort:
+            data = sort_osm_xml(data)
+        return data.decode(encoding="utf-8", errors="ignore")
+
+    def _query_json(self, network="lwn", onlytags=False):
+        """Private function to return the query for data in JSON format
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool onlytags: query only the tags of relations
+        """
+        if onlytags:
+            plan = QueryPlan(fields=True)
         else:
-            instr = temp.format(
-                area="",
-                query=self.query.format(netw=network, bbox=""),
-                time=self.timeout,
-            )
+            plan = QueryPlan(fields=True, geometry="full")
+        return self._plan_query(plan, network=network)
+
+    def get_data_json(self, network="lwn"):
+        """Function to return the OSM data in JSON formats
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        return json.loads(self._get_data(self._query_json(network=network)))
 
-        return json.loads(self._get_data(instr))
+    def iter_tags_json(self, debug=False, network="lwn", onlytags=True):
+        """Function to yield the tags plus id for CAI relations while data
+        are downloaded, nodes and ways are skipped without decoding them
 
-    def get_tags_json(self, debug=False, network="lwn"):
+        :param str network: the network level to query, default 'lwn'
+        :param bool onlytags: query only the tags of relations, without
+                              members, ways and nodes
+        """
+        instr = self._query_json(network=network, onlytags=onlytags)
+        for elem in iter_json_elements(self._iter_data(instr), ["relation"]):
+            tags = elem.get("tags", {})
+            # cai_scale used as tag to reconize CAI paths
+            if tags.get("type") == "route" and "cai_scale" in tags.keys():
+                vals = tags
+                vals["id"] = elem["id"]
+                if debug:
+                    print(vals)
+                yield vals
+
+    def get_tags_json(self, debug=False, network="lwn", onlytags=True):
         """Function to get the tags plus id for CAI relations
 
         :param str network: the network level to query, default 'lwn'
+        :param bool onlytags: query only the tags of relations, without
+                              members, ways and nodes
         """
-        data = self.get_data_json(network=network)
-        tags = []
-        for elem in data["elements"]:
-            # check if the element is a relation
-            if elem["type"] == "relation":
-                # cai_scale used as tag to reconize CAI paths
-                if (
-                    elem["tags"]["type"] == "route"
-                    and "cai_scale" in elem["tags"].keys()
-                ):
-                    vals = elem["tags"]
-                    vals["id"] = elem["id"]
-                    tags.append(vals)
-                    if debug:
-                        print(vals)
-        return tags
+        return list(
+            self.iter_tags_json(debug=debug, network=network, onlytags=onlytags)
+        )
 
     def wiki_table(self, network="lwn"):
         """Function to convert a CSV file to a wiki table.
@@ -306,7 +712,8 @@ out qt;"""
 
         :param str network: the network level to query, default 'lwn'
         """
-        data = self.get_data_csv(tags='"ref","name",::id', network=network)
+        plan = QueryPlan(fields=WIKI_FIELDS)
+        data = self.get_data_csv(tags=plan.columns(), network=network)
         # read it
 
         rows = data.splitlines()
@@ -352,7 +759,12 @@ out qt;"""
         if out_format == "csv":
             data = self.get_data_csv(network=network)
         elif out_format == "osm":
-            data = self.get_data_osm(network=network)
+            # the OSM format is detected by the suffix of the file
+            self.get_file_osm(network=network, out=out)
+            return True
+        elif out_format in ["osm.gz", "pbf"]:
+            self.get_file_osm(network=network, out=out, out_format=out_format)
+            return True
         elif out_format == "wikitable":
             data = self.wiki_table(network=network)
         elif out_format == "json":
@@ -368,7 +780,8 @@ out qt;"""
                 data = json.dumps(data)
         else:
             raise ValueError(
-                "Only csv, osm, wikitable, json, tags, geojson " "format are supported"
+                "Only csv, osm, osm.gz, pbf, wikitable, json, tags, geojson "
+                "format are supported"
             )
         with open(out, "w") as fil:
             fil.write(data)
@@ -390,15 +803,20 @@ class CaiOsmRoute(CaiOsmData):
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
-        :param str url: the url to use
+        :param str url: the url to use, or a list of urls to use as a pool
         :param str querytype: the type to query to use:
             - hiking: download all hiking routes
             - caiscale: use the presence of cai_scale tag to filter routes
             - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param kwargs: the other parameters of CaiOsmBase, like cache and pool
         """
         super(CaiOsmRoute, self).__init__(**kwargs)
         self.cch = None
         self.lenght = None
+        self.osmfile = None
+        # the local routes loaded by load_dataset and the plan they satisfy
+        self.dataset = None
+        self.plan = None
         if self.querytype == "caiscale":
             self.query = QUERY_CAISCALE + "({bbox});"
         elif self.querytype == "source":
@@ -416,21 +834,206 @@ class CaiOsmRoute(CaiOsmData):
         if self.lenght:
             return self.lenght
         if self.cch is None:
-            self.cch.get_cairoutehandler(network)
+            self.get_cairoutehandler(network)
         self.lenght = self.cch.length(unit=unit)
         return self.lenght
 
+    def load_dataset(self, plan=None):
+        """Function to download once the data of all networks needed by the
+        outputs and parse them, after it CSV, wikitable, tags, GeoJSON and OSM
+        outputs are created from the local data without other queries
+
+        :param obj plan: a QueryPlan with the merged requirements of the
+                         outputs, by default all the OSM data are downloaded
+        """
+        if self.osmfile or self.dataset:
+            return True
+        if plan is None or plan.geometry is not None:
+            self.osmfile = self.get_file_osm(sort=False, network=False)
+            self.cch = CaiRoutesHandler()
+            self._apply_file(self.cch, self.osmfile)
+            self.dataset = self.cch
+            self.plan = QueryPlan(fields=True, geometry="full")
+            return True
+        # the network is required to filter the local routes
+        self.plan = QueryPlan(fields=[ID_COLUMN, "network"]).merge(plan)
+        self.dataset = CaiRoutesHandler()
+        tiles = self._get_tiles(
+            lambda bbox: self._plan_query(
+                self.plan,
+                network=False,
+                bbox=bbox,
+                header=True,
+                separator=LOCAL_SEPARATOR_QUERY,
+            ),
+            lambda instr: self._plan_elements(self.plan, self._get_data(instr)),
+        )
+        for elements in tiles:
+            self.dataset.apply_elements(elements)
+        if self.debug:
+            print("Routes loaded: {}".format(self.dataset.count))
+        return True
+
+    def _plan_elements(self, plan, data):
+        """Private function to return the relations of the data downloaded
+        for a plan like the elements of an Overpass JSON response
+
+        :param obj plan: the QueryPlan used for the query
+        :param str data: the downloaded data
+        """
+        if not plan.csv():
+            return json.loads(data)["elements"]
+        elements = []
+        rows = csv.reader(data.splitlines(), delimiter=LOCAL_SEPARATOR)
+        header = [col.replace("@", "::", 1) for col in next(rows, [])]
+        for row in rows:
+            vals = dict(zip(header, row))
+            tags = {k: v for k, v in vals.items() if v and k != ID_COLUMN}
+            elements.append(
+                {"type": "relation", "id": int(vals[ID_COLUMN]), "tags": tags}
+            )
+        return elements
+
+    def _has_local(self, plan):
+        """Private function to check if the local data satisfy a plan
+
+        :param obj plan: the QueryPlan required by an output
+        """
+        if self.osmfile:
+            return True
+        return self.plan is not None and self.plan.covers(plan)
+
+    def close(self):
+        """Function to remove the local data created by load_dataset"""
+        if self.osmfile:
+            os.remove(self.osmfile)
+            self.osmfile = None
+        self.dataset = None
+        self.plan = None
+        return True
+
+    def _local_routes(self, network):
+        """Private function to return the tags of the local routes filtered
+        by network and sorted by id like Overpass output
+
+        :param str network: the network level to filter
+        """
+        routes = []
+        for k in sorted(self.dataset.routes.keys()):
+            tags = self.dataset.routes[k].tags
+            if check_network(network) and tags.get("network") != network:
+                continue
+            routes.append(tags)
+        return routes
+
+    def get_data_csv(self, csvheader=False, tags='::id,"name","ref"', network="lwn"):
+        """Function to return data in CSV format
+
+        :param bool csvheader: show or hide the csv header, default hidden
+        :param str tags: a list of tags to show in the csv
+        """
+        if not self._has_local(QueryPlan(fields=parse_columns(tags))):
+            return super(CaiOsmRoute, self).get_data_csv(
+                csvheader=csvheader, tags=tags, network=network
+            )
+        if csvheader:
+            self.csvheader = True
+        cols = parse_columns(tags)
+        rows = []
+        if self.csvheader:
+            rows.append(self.separator.join([col.replace("::", "@") for col in cols]))
+        for route in self._local_routes(network):
+            row = []
+            for col in cols:
+                if col == ID_COLUMN:
+                    row.append(str(route["id"]))
+                else:
+                    row.append(route.get(col, ""))
+            rows.append(self.separator.join(row))
+        return "".join(["{}\n".format(row) for row in rows])
+
+    def get_tags_json(self, debug=False, network="lwn", onlytags=True):
+        """Function to get the tags plus id for CAI relations
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool onlytags: query only the tags of relations, without
+                              members, ways and nodes
+        """
+        if not self._has_local(QueryPlan(fields=True)):
+            return super(CaiOsmRoute, self).get_tags_json(
+                debug=debug, network=network, onlytags=onlytags
+            )
+        tags = []
+        for route in self._local_routes(network):
+            # cai_scale used as tag to reconize CAI paths
+            if route.get("type") == "route" and "cai_scale" in route.keys():
+                vals = dict(route)
+                tags.append(vals)
+                if debug:
+                    print(vals)
+        return tags
+
+    def get_buffer_osm(self, network="lwn"):
+        """Function to return the unsorted data in OSM format as bytes
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        # the local data contain all the networks
+        if not self.osmfile or check_network(network):
+            return super(CaiOsmRoute, self).get_buffer_osm(network=network)
+        with open(self.osmfile, "rb") as fil:
+            return fil.read()
+
+    def get_file_osm(self, network="lwn", sort=True, out=None, out_format=None):
+        """Function to save data in the original OSM format into a file
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool sort: sort the data
+        :param str out: the path to the output file, by default a temporary
+                        file is created and the caller has to remove it
+        :param str out_format: the OSM format, one of osm, osm.gz or pbf, by
+                               default it is detected by the suffix of out
+        """
+        # the local data contain all the networks
+        if not self.osmfile or check_network(network):
+            return super(CaiOsmRoute, self).get_file_osm(
+                network=network, sort=sort, out=out, out_format=out_format
+            )
+        if out:
+            out_format, out = osm_format(out, out_format)
+            if out_format == "osm" and not sort:
+                shutil.copyfile(self.osmfile, out)
+                return out
+        if sort or out:
+            return self._sort_file(self.osmfile, out)
+        out = tempfile.mkstemp(suffix=".osm")[1]
+        shutil.copyfile(self.osmfile, out)
+        return out
+
     def get_cairoutehandler(self, network="lwn", infomont=False):
         """Function to download osm data and create CaiRoutesHandler instance
 
         :param str network: the network level to query, default 'lwn'
         """
-        data = self.get_data_osm(sort=False, network=network)
-        self.cch = CaiRoutesHandler(infomont=infomont)
-        # trick to solve the problem that overpass data ar not sorted
-        mir = osmium.MergeInputReader()
-        mir.add_buffer(data.encode("utf-8"), "osm")
-        mir.apply(self.cch, idx="flex_mem", simplify=True)
+        if self.osmfile:
+            if self.cch.infomont != infomont:
+                self.cch = infomont_handler(infomont)
+                self._apply_file(self.cch, self.osmfile)
+            return True
+        self.cch = infomont_handler(infomont)
+        if self.outgeom:
+            tiles = self._get_tiles(
+                lambda bbox: self._query_geom(network=network, bbox=bbox),
+                lambda instr: json.loads(self._get_data(instr)),
+            )
+            for data in tiles:
+                self.cch.apply_elements(data["elements"])
+            return True
+        paths = self.get_files_osm(network=network)
+        try:
+            self._apply_file(self.cch, paths)
+        finally:
+            self._remove_files(paths)
         return True
 
     def get_geojson(self, network="lwn"):
@@ -440,6 +1043,13 @@ class CaiOsmRoute(CaiOsmData):
         """
         if self.cch is None:
             self.get_cairoutehandler(network)
+        if self.osmfile and check_network(network):
+            feats = [
+                feat
+                for feat in self.cch.iter_routes_geojson()
+                if feat["properties"].get("network") == network
+            ]
+            return geojson.FeatureCollection(feats)
         if not self.cch.gjson:
             self.cch.create_routes_geojson()
         return self.cch.gjson
@@ -457,6 +1067,7 @@ class CaiOsmOffice(CaiOsmData):
         separator="|",
         debug=False,
         timeout=2500,
+        **kwargs
     ):
         """Inizialize
 
@@ -468,6 +1079,7 @@ class CaiOsmOffice(CaiOsmData):
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
+        :param kwargs: the other parameters of CaiOsmBase, like cache and pool
         """
         super(CaiOsmOffice, self).__init__(
             area=area,
@@ -476,6 +1088,7 @@ class CaiOsmOffice(CaiOsmData):
             bbox_inverted=bbox_inverted,
             separator=separator,
             debug=debug,
+            **kwargs
         )
         self.query = """
 (
@@ -553,11 +1166,12 @@ class CaiOsmSourceRef(CaiOsmData):
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
-        :param str url: the url to use
+        :param str url: the url to use, or a list of urls to use as a pool
         :param str querytype: the type to query to use:
             - hiking: download all hiking routes
             - caiscale: use the presence of cai_scale tag to filter routes
             - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param kwargs: the other parameters of CaiOsmBase, like cache and pool
         """
         super(CaiOsmSourceRef, self).__init__(**kwargs)
         source = """
@@ -609,9 +1223,11 @@ class CaiOsmSourceRef(CaiOsmData):
         "791&single=true&output=csv",
     ):
         """Function to download data into CSV file"""
-        req = urllib.request.Request(url)
-        resp = urllib.request.urlopen(req)
-        respData = resp.read()
+        resp = request(
+            url, connect_timeout=self.connect_timeout, read_timeout=self.read_timeout
+        )
+        respData = resp.content
+        resp.close()
         with open(self.codespath, "w") as fi:
             fi.write(respData.decode(encoding="utf-8", errors="ignore"))
         self._read_codes()
@@ -622,8 +1238,9 @@ class CaiOsmSourceRef(CaiOsmData):
         :param str network: the network level to query, default 'lwn'
         """
         if not self.osm_codes:
+            plan = QueryPlan(fields=["source:ref"])
             osm_codes = self.get_data_csv(
-                csvheader=False, tags='"source:ref"', network=network
+                csvheader=False, tags=plan.columns(), network=network
             )
             self.osm_codes = list(set(osm_codes.splitlines()))
         return self.osm_codes
@@ -696,11 +1313,12 @@ class CaiOsmRouteSourceRef(CaiOsmRoute):
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
-        :param str url: the url to use
+        :param str url: the url to use, or a list of urls to use as a pool
         :param str querytype: the type to query to use:
             - hiking: download all hiking routes
             - caiscale: use the presence of cai_scale tag to filter routes
             - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param kwargs: the other parameters of CaiOsmBase, like cache and pool
         """
         super(CaiOsmRouteSourceRef, self).__init__(**kwargs)
         source = '["source:ref"="{code}"];'.format(code=sourceref)
@@ -734,11 +1352,12 @@ class CaiOsmRouteDiff(CaiOsmBase):
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
-        :param str url: the url to use
+        :param str url: the url to use, or a list of urls to use as a pool
         :param str querytype: the type to query to use:
             - hiking: download all hiking routes
             - caiscale: use the presence of cai_scale tag to filter routes
             - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param kwargs: the other parameters of CaiOsmBase, like cache and pool
         """
         super(CaiOsmRouteDiff, self).__init__(**kwargs)
         if not startdate:
@@ -772,17 +1391,17 @@ class CaiOsmRouteDiff(CaiOsmBase):
             self.query += """({bbox})"""
         self.query += """; (._;>;);out meta geom;"""
         self.osmdata = None
+        self.routes = []
 
-    def get_data_osm(self, network="lwn"):
-        """Function to return data in the original OSM format
+    def _query_osm(self, network="lwn"):
+        """Private function to return the query for the augmented diff
 
         :param str network: the network level to query, default 'lwn'
         """
-
         network = check_network(network)
         if self.area:
             instr = self.query.format(
-                area='area["name"="{}"]->.a;'.format(self.area),
+                area=self._area(),
                 bbox="area.a",
                 netw=network,
             )
@@ -790,46 +1409,50 @@ class CaiOsmRouteDiff(CaiOsmBase):
             instr = self.query.format(area="", bbox=self.bbox, netw=network)
         else:
             instr = self.query.format(area="", bbox="", netw=network)
+        return instr
+
+    def get_data_osm(self, network="lwn"):
+        """Function to return data in the original OSM format
 
-        self.osmdata = self._get_data(instr)
+        :param str network: the network level to query, default 'lwn'
+        """
+        self.osmdata = self._get_data(self._query_osm(network=network))
         return self.osmdata
 
-    def get_changeset(self, network="lwn"):
-        """Return the changeset id
+    def get_changes(self, network="lwn"):
+        """Return a list of dictionary with action, type, id, changeset and
+        timestamp of the changes done between start and end date. The
+        augmented diff is parsed while it is downloaded, the ids of the
+        changed routes are stored in routes attribute
 
         :param str network: the network level to query, default 'lwn'
         """
-        if not self.osmdata:
-            self.get_data_osm(network=network)
-        jsonosm = xmltodict.parse(self.osmdata)
-        if "action" not in jsonosm["osm"].keys():
-            return []
-        output = []
-        if type(jsonosm["osm"]["action"]) == collections.OrderedDict:
-            changes = [jsonosm["osm"]["action"]]
+        if self.osmdata:
+            chunks = [self.osmdata]
         else:
-            changes = jsonosm["osm"]["action"]
-        for change in changes:
-            if change["@type"] in ["modify", "delete"]:
-                value = change["new"]
-            elif change["@type"] == "create":
-                value = change
-
-            if "node" in value.keys():
-                data = value["node"]
-            elif "way" in value.keys():
-                data = value["way"]
-            elif "relation" in value.keys():
-                data = value["relation"]
-            else:
-                continue
-            changedata = dateutil.parser.parse(data["@timestamp"])
-            if self.startdate.date() <= changedata.date() <= self.enddate.date():
-                changeset = data["@changeset"]
-                if changeset not in output:
-                    output.append(changeset)
+            chunks = self._iter_data(self._query_osm(network=network))
+        start = self.startdate.date().isoformat()
+        end = self.enddate.date().isoformat()
+        reader = AdiffReader()
+        output = []
+        for change in reader.iter_changes(chunks):
+            # timestamps are in ISO format, the date is the first part
+            if change["timestamp"] and start <= change["timestamp"][:10] <= end:
+                reader.add_change(change)
+                output.append(change)
+        self.routes = reader.routes
         return output
 
+    def get_changeset(self, network="lwn"):
+        """Return the changeset id
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        output = collections.OrderedDict()
+        for change in self.get_changes(network=network):
+            output[change["changeset"]] = True
+        return list(output.keys())
+
     def get_cairoutehandler(self, network="lwn"):
         """Function to download osm data and create CaiRoutesHandler instance
 
@@ -842,7 +1465,7 @@ class CaiOsmRouteDiff(CaiOsmBase):
         with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".osm") as fi:
             fi.write(self.osmdata)
         self.cch = CaiRoutesHandler()
-        self.cch.apply_file(fi.name, locations=True)
+        self.cch.apply_file(fi.name, locations=True, idx=self.idx)
         os.remove(fi.name)
         return True
 
@@ -872,23 +1495,25 @@ class CaiOsmRouteDate(CaiOsmBase):
         :param str separator: the separator to use for CSV
         :param bool debug: print debug information
         :param int timeout: the timeout value for overpass
-        :param str url: the url to use
+        :param str url: the url to use, or a list of urls to use as a pool
         :param str querytype: the type to query to use:
             - hiking: download all hiking routes
             - caiscale: use the presence of cai_scale tag to filter routes
             - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param kwargs: the other parameters of CaiOsmBase, like cache and pool
         """
         super(CaiOsmRouteDate, self).__init__(**kwargs)
 
-        header = '[timeout:{time}][out:xml][date:"{start}"];'.format(
+        header = '[timeout:{time}][out:{{fmt}}][date:"{start}"];'.format(
             start="{}T00:00:00Z".format(startdate), time=self.timeout
         )
+        source = ""
         if sourceref:
             source = '["source:ref"="{code}"]'.format(code=sourceref)
         if self.querytype == "caiscale":
-            self.query = header + "{area}" + QUERY_CAISCALE
+            query = header + "{area}" + QUERY_CAISCALE
         elif self.querytype == "source":
-            self.query = (
+            query = (
                 header
                 + "{area}"
                 + QUERY_SOURCECAI
@@ -898,49 +1523,128 @@ class CaiOsmRouteDate(CaiOsmBase):
                 + source
             )
         else:
-            self.query = header + "{area}" + QUERY_HIKING
+            query = header + "{area}" + QUERY_HIKING
 
         if self.area or self.bbox:
-            self.query += """({bbox})"""
-        self.query += """; (._;>;);out meta;"""
+            query += """({bbox})"""
+        self.query = query.replace("{fmt}", "xml") + """; (._;>;);out meta;"""
+        self.geomquery = (
+            query.replace("{fmt}", "json") + """; out; way(r); out geom;"""
+        )
         self.lenght = None
 
-    def get_data_osm(self, network="lwn", sort=True, remove=True):
-        """Function to return data in the original OSM format
+    def _query_osm(self, network="lwn", bbox=None):
+        """Private function to return the query for data in OSM format
+
+        :param str network: the network level to query, default 'lwn'
+        :param str bbox: the bbox to query, by default the bbox of the class
+        """
+        return self._format_query(self.query, network, bbox)
+
+    def _query_geom(self, network="lwn", bbox=None):
+        """Private function to return the query for relations and ways with
+        their geometry in JSON format
 
         :param str network: the network level to query, default 'lwn'
+        :param str bbox: the bbox to query, by default the bbox of the class
         """
+        return self._format_query(self.geomquery, network, bbox)
+
+    def _format_query(self, query, network="lwn", bbox=None):
+        """Private function to set area and network in a query
 
+        :param str query: the query template
+        :param str network: the network level to query, default 'lwn'
+        :param str bbox: the bbox to query, by default the bbox of the class
+        """
         network = check_network(network)
+        if bbox is None:
+            bbox = self.bbox
         if self.area:
-            instr = self.query.format(
-                area='area["name"="{}"]->.a;'.format(self.area),
+            instr = query.format(
+                area=self._area(),
                 bbox="area.a",
                 netw=network,
             )
-        elif self.bbox:
-            instr = self.query.format(area="", bbox=self.bbox, netw=network)
+        elif bbox:
+            instr = query.format(area="", bbox=bbox, netw=network)
         else:
-            instr = self.query.format(area="", bbox="", netw=network)
+            instr = query.format(area="", bbox="", netw=network)
+        return instr
 
-        data = self._get_data(instr)
+    def get_files_osm(self, network="lwn"):
+        """Function to save unsorted data in OSM format into temporary files,
+        one for each tile. The caller has to remove them
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        return self._get_tiles(
+            lambda bbox: self._query_osm(network=network, bbox=bbox)
+        )
+
+    def get_buffer_osm(self, network="lwn"):
+        """Function to return the unsorted data in OSM format as bytes
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        if self._tiled():
+            path = self.get_file_osm(network=network)
+            try:
+                with open(path, "rb") as fil:
+                    return fil.read()
+            finally:
+                os.remove(path)
+        return self._get_bytes(self._query_osm(network=network))
+
+    def get_file_osm(self, network="lwn", sort=True, out=None, out_format=None):
+        """Function to save data in the original OSM format into a file, the
+        data of several tiles are always sorted and merged
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool sort: sort the data
+        :param str out: the path to the output file, by default a temporary
+                        file is created and the caller has to remove it
+        :param str out_format: the OSM format, one of osm, osm.gz or pbf, by
+                               default it is detected by the suffix of out
+        """
+        if out:
+            out_format, out = osm_format(out, out_format)
+        if self._tiled():
+            paths = self.get_files_osm(network=network)
+            try:
+                return self._sort_file(paths, out)
+            finally:
+                self._remove_files(paths)
+        # the data are streamed to disk and osmium writes the output format
+        path = self._get_file(self._query_osm(network=network))
+        if out and out_format == "osm" and not sort:
+            shutil.move(path, out)
+            return out
+        if sort or out:
+            try:
+                return self._sort_file(path, out)
+            finally:
+                os.remove(path)
+        return path
+
+    def get_data_osm(self, network="lwn", sort=True, remove=None):
+        """Function to return data in the original OSM format, the data are
+        sorted in memory
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool sort: sort the data
+        :param bool remove: deprecated, no temporary file is created
+        """
+        if remove is not None:
+            warnings.warn(
+                "remove is deprecated, get_data_osm creates no temporary file",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+        data = self.get_buffer_osm(network=network)
         if sort:
-            mir = osmium.MergeInputReader()
-            mir.add_buffer(data.encode("utf-8"), "osm")
-            # the code stop here after printing the xml osm data
-            tempname = tempfile.mkstemp(suffix=".osm")[1]
-
-            with open(tempname, "w") as temp_osm:
-                os.unlink(temp_osm.name)
-                wh = osmium.WriteHandler(temp_osm.name)
-                mir.apply(wh, idx="flex_mem")
-                wh.close()
-                temp_osm.close()
-            with open(tempname, "r") as temp_osm:
-                data = temp_osm.read()
-            if remove:
-                os.remove(tempname)
-        return data
+            data = sort_osm_xml(data)
+        return data.decode(encoding="utf-8", errors="ignore")
 
     def get_length(self, network="lwn", unit="km"):
         """Function to return the total lenght of data
@@ -960,12 +1664,20 @@ class CaiOsmRouteDate(CaiOsmBase):
 
         :param str network: the network level to query, default 'lwn'
         """
-        data = self.get_data_osm(network=network)
-        self.cch = CaiRoutesHandler(infomont=infomont)
-        # trick to solve the problem that overpass data ar not sorted
-        mir = osmium.MergeInputReader()
-        mir.add_buffer(data.encode("utf-8"), "osm")
-        mir.apply(self.cch, idx="flex_mem", simplify=True)
+        self.cch = infomont_handler(infomont)
+        if self.outgeom:
+            tiles = self._get_tiles(
+                lambda bbox: self._query_geom(network=network, bbox=bbox),
+                lambda instr: json.loads(self._get_data(instr)),
+            )
+            for data in tiles:
+                self.cch.apply_elements(data["elements"])
+            return True
+        paths = self.get_files_osm(network=network)
+        try:
+            self._apply_file(self.cch, paths)
+        finally:
+            self._remove_files(paths)
         return True
 
     def get_geojson(self, network="lwn"):
@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:48:26 2026
+
+@author: lucadelu
+"""
+import os
+import json
+import time
+import tempfile
+from array import array
+import osmium
+from shapely.geometry import box
+from shapely.prepared import prep
+from .data_from_overpass import CaiOsmRoute
+from .functions import check_network
+from .functions import index_file
+from .functions import osm_format
+from .functions import polygon_from_lines
+from .osmium_handler import CaiRoutesHandler
+from .osmium_handler import copy_tags
+from .geometries import WayGeometries
+from .records import Route
+from .records import Way
+
+
+def route_filter(querytype):
+    """Return a function to check if the tags of a relation match the
+    querytype, like the Overpass queries
+
+    :param str querytype: the type to query to use, hiking, caiscale or source
+    """
+
+    def select(tags):
+        if tags.get("route") != "hiking":
+            return False
+        if querytype == "caiscale":
+            return "cai_scale" in tags
+        elif querytype == "source":
+            return tags.get("source") in ["CAI", "survey:CAI"]
+        return True
+
+    return select
+
+
+def apply_reader(path, handler, bits, debug=False):
+    """Apply an handler to an OSM file, osmium decodes only the entity types
+    set in bits and calls only the callbacks defined by the handler
+
+    :param str path: the path to the OSM file
+    :param obj handler: the osmium handler with a callbacks counter
+    :param int bits: the osmium.osm.osm_entity_bits to read
+    :param bool debug: print the number of callbacks per second
+    """
+    start = time.time()
+    reader = osmium.io.Reader(path, bits)
+    try:
+        osmium.apply(reader, handler)
+    finally:
+        reader.close()
+    if debug:
+        elapsed = max(time.time() - start, 0.001)
+        print(
+            "{}: {} callbacks in {:.1f} s, {:.0f} callbacks/s".format(
+                type(handler).__name__,
+                handler.callbacks,
+                elapsed,
+                handler.callbacks / elapsed,
+            )
+        )
+    return True
+
+
+class PbfRelationsHandler(osmium.SimpleHandler):
+    """Class to read the routes and the boundaries of an area from the
+    relations of an OSM file"""
+
+    def __init__(self, select, area=None, keys=None):
+        """Inizialize
+
+        :param obj select: the function to check the tags of a route
+        :param str area: the name of the area of interest
+        :param list keys: the keys of the tags to copy, by default all
+        """
+        osmium.SimpleHandler.__init__(self)
+        self.select = select
+        self.area = area
+        self.keys = keys
+        self.callbacks = 0
+        self.routes = {}
+        self.boundaries = []
+
+    def relation(self, rel):
+        """Function to parse relations"""
+        self.callbacks += 1
+        if self.area and rel.tags.get("name") == self.area:
+            if rel.tags.get("type") in ["boundary", "multipolygon"]:
+                members = [
+                    (mem.ref, mem.role) for mem in rel.members if mem.type == "w"
+                ]
+                level = int(rel.tags.get("admin_level", "99") or 99)
+                self.boundaries.append((level, rel.id, members))
+        if not self.select(rel.tags):
+            return
+        members = [mem.ref for mem in rel.members if mem.type == "w"]
+        tags = copy_tags(rel.tags, self.keys)
+        tags["id"] = rel.id
+        self.routes[rel.id] = Route(tags, members)
+
+
+class PbfWaysHandler(osmium.SimpleHandler):
+    """Class to read the tags and nodes of selected ways from an OSM file,
+    the geometries are added later from the locations of their nodes"""
+
+    def __init__(self, ids, keys=None):
+        """Inizialize
+
+        :param set ids: the ids of the ways to read
+        :param list keys: the keys of the tags to copy, by default all
+        """
+        osmium.SimpleHandler.__init__(self)
+        self.ids = ids
+        self.keys = keys
+        self.callbacks = 0
+        self.ways = {}
+        self.geoms = WayGeometries()
+        self.nodes = {}
+
+    def way(self, way):
+        """Function to parse ways"""
+        self.callbacks += 1
+        if way.id not in self.ids:
+            return
+        tags = {"id": way.id}
+        tags.update(copy_tags(way.tags, self.keys))
+        self.ways[way.id] = Way(tags)
+        self.nodes[way.id] = [n.ref for n in way.nodes]
+
+    def node_ids(self):
+        """Return the set of the nodes used by the selected ways"""
+        ids = set()
+        for refs in self.nodes.values():
+            ids.update(refs)
+        return ids
+
+    def add_geometries(self, locations):
+        """Add the geometry of the ways, like osmium a way with a missing
+        node has no geometry
+
+        :param obj locations: the osmium index with the nodes locations
+        """
+        for wid in sorted(self.nodes.keys()):
+            try:
+                points = []
+                for ref in self.nodes[wid]:
+                    loc = locations.get(ref)
+                    points.append((loc.lon, loc.lat))
+                self.geoms.add(wid, points)
+            except Exception:
+                print("Error creating geometry for way {}".format(wid))
+        return True
+
+
+class PbfNodesHandler(osmium.SimpleHandler):
+    """Class to store the locations of selected nodes of an OSM file"""
+
+    def __init__(self, ids, locations):
+        """Inizialize
+
+        :param set ids: the ids of the nodes to store, None to store all
+        :param obj locations: the osmium index to fill with nodes locations
+        """
+        osmium.SimpleHandler.__init__(self)
+        self.ids = ids
+        self.locations = locations
+        self.callbacks = 0
+
+    def node(self, node):
+        """Function to parse nodes"""
+        self.callbacks += 1
+        if self.ids is None or node.id in self.ids:
+            self.locations.set(node.id, node.location)
+
+
+class PbfWriteHandler(osmium.SimpleHandler):
+    """Class to copy the selected objects of an OSM file into a writer"""
+
+    def __init__(self, writer, nodes, ways, relations):
+        """Inizialize
+
+        :param obj writer: the osmium SimpleWriter instance
+        :param set nodes: the ids of the nodes to copy
+        :param set ways: the ids of the ways to copy
+        :param set relations: the ids of the relations to copy
+        """
+        osmium.SimpleHandler.__init__(self)
+        self.writer = writer
+        self.nodes = nodes
+        self.ways = ways
+        self.relations = relations
+        self.callbacks = 0
+
+    def node(self, node):
+        self.callbacks += 1
+        if node.id in self.nodes:
+            self.writer.add_node(node)
+
+    def way(self, way):
+        self.callbacks += 1
+        if way.id in self.ways:
+            self.writer.add_way(way)
+
+    def relation(self, rel):
+        self.callbacks += 1
+        if rel.id in self.relations:
+            self.writer.add_relation(rel)
+
+
+class CaiOsmRoutePbf(CaiOsmRoute):
+    """Class to get CAI routes from a local OSM file, like a PBF extract,
+    instead of Overpass API and convert in different formats"""
+
+    def __init__(
+        self, path, polygon=None, idx=None, reltags=None, waytags=None, **kwargs
+    ):
+        """Inizialize
+
+        :param str path: the path to the OSM file, PBF or XML
+        :param obj polygon: a shapely polygon in WGS84 to select the routes,
+                            it replaces area and bbox
+        :param str idx: the osmium index type to store the locations of the
+                        nodes used by the routes, default sparse_mem_array.
+                        With file based types, like
+                        sparse_file_array,/path/file, the locations of all
+                        the nodes are stored once in the file and reused by
+                        the next runs on the same OSM file
+        :param list reltags: the keys of the route tags to read, by default
+                             all, only they are copied from osmium
+        :param list waytags: the keys of the way tags to read, by default all
+        :param str area: the name of the area of interest, its boundary is
+                         read from the OSM file
+        :param str bbox: a string with the bounding box of the area, needed
+                         format is YMIN,XMIN,YMAX,XMAX
+        :param bool bbox_inverted: set True id the bbox format is
+                                    XMIN,YMIN,XMAX,YMAX
+        :param str separator: the separator to use for CSV
+        :param bool debug: print debug information
+        :param str querytype: the type to query to use:
+            - hiking: download all hiking routes
+            - caiscale: use the presence of cai_scale tag to filter routes
+            - source: use source=servey:CAI and source=CAI tag to filter routes
+        """
+        if not os.path.exists(path):
+            raise ValueError("OSM file {} does not exist".format(path))
+        if idx is None:
+            idx = "sparse_mem_array"
+        super(CaiOsmRoutePbf, self).__init__(idx=idx, **kwargs)
+        # the local file enables the local outputs of CaiOsmRoute
+        self.osmfile = path
+        self.polygon = polygon
+        self.reltags = reltags
+        self.waytags = waytags
+        self.full = None
+        self.waynodes = {}
+
+    def _clip_polygon(self, boundaries, geoms):
+        """Private function to return the polygon used to select the routes
+
+        :param list boundaries: the boundaries found with the area name
+        :param obj geoms: the WayGeometries of the ways read from the file
+        """
+        if self.polygon is not None:
+            return self.polygon
+        if self.area:
+            if not boundaries:
+                raise ValueError("Boundary of {} not found".format(self.area))
+            # the boundary with the lowest admin_level is used
+            members = sorted(boundaries)[0][2]
+            outers = []
+            inners = []
+            for ref, role in members:
+                if ref not in geoms:
+                    continue
+                line = geoms.linestring(ref)
+                if role == "inner":
+                    inners.append(line)
+                else:
+                    outers.append(line)
+            return polygon_from_lines(outers, inners)
+        if self.bbox:
+            ymin, xmin, ymax, xmax = [float(v) for v in self.bbox.split(",")]
+            return box(xmin, ymin, xmax, ymax)
+        return None
+
+    def _read_nodes(self, ids, locations):
+        """Private function to store the locations of the nodes into an index
+
+        :param set ids: the ids of the nodes to store, None to store all
+        :param obj locations: the osmium index to fill
+        """
+        nh = PbfNodesHandler(ids, locations)
+        return apply_reader(
+            self.osmfile, nh, osmium.osm.osm_entity_bits.NODE, self.debug
+        )
+
+    def _node_locations(self, ids):
+        """Private function to return the index with the nodes locations. A
+        file based index is reused if it was created from the same OSM file,
+        otherwise it is created in a temporary file and moved when complete,
+        so processes sharing the index never read an incomplete one
+
+        :param set ids: the ids of the needed nodes
+        """
+        path = index_file(self.idx)
+        if not path:
+            # nodes are sorted by id in OSM files, sparse indexes are sorted
+            locations = osmium.index.create_map(self.idx)
+            self._read_nodes(ids, locations)
+            return locations
+        stat = os.stat(self.osmfile)
+        source = {
+            "index": self.idx.split(",")[0],
+            "source": os.path.abspath(self.osmfile),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+        meta = path + ".json"
+        if os.path.exists(path) and os.path.exists(meta):
+            with open(meta) as fil:
+                if json.load(fil) == source:
+                    if self.debug:
+                        print("Reusing node locations index {}".format(path))
+                    return osmium.index.create_map(self.idx)
+        if self.debug:
+            print("Creating node locations index {}".format(path))
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        locations = osmium.index.create_map("{},{}".format(source["index"], tmp))
+        self._read_nodes(None, locations)
+        # release the index to write it on disk
+        del locations
+        with open(tmp + ".json", "w") as fil:
+            json.dump(source, fil)
+        os.replace(tmp, path)
+        os.replace(tmp + ".json", meta)
+        return osmium.index.create_map(self.idx)
+
+    def _read_file(self):
+        """Private function to read the OSM file in three passes: relations,
+        then only their ways and then only the locations of the nodes of
+        these ways, so memory depends on the routes and not on the size of
+        the file. It returns a tuple with the routes, the boundaries of the
+        area, the ways, their geometries and the nodes of each way"""
+        rh = PbfRelationsHandler(
+            route_filter(self.querytype), self.area, self.reltags
+        )
+        apply_reader(
+            self.osmfile, rh, osmium.osm.osm_entity_bits.RELATION, self.debug
+        )
+        if self.debug:
+            print("Routes found in {}: {}".format(self.osmfile, len(rh.routes)))
+        ids = set()
+        for route in rh.routes.values():
+            ids.update(route.elems)
+        for bound in rh.boundaries:
+            ids.update([ref for ref, role in bound[2]])
+        wh = PbfWaysHandler(ids, self.waytags)
+        apply_reader(self.osmfile, wh, osmium.osm.osm_entity_bits.WAY, self.debug)
+        locations = self._node_locations(wh.node_ids())
+        wh.add_geometries(locations)
+        return rh.routes, rh.boundaries, wh.ways, wh.geoms, wh.nodes
+
+    def load_dataset(self, plan=None):
+        """Function to read the routes from the OSM file and select the
+        ones inside the area
+
+        :param obj plan: not used, the file is read once for all the outputs
+        """
+        if self.full:
+            return True
+        routes, boundaries, ways, geoms, nodes = self._read_file()
+        poly = self._clip_polygon(boundaries, geoms)
+        if poly is not None:
+            poly = prep(poly)
+        self.full = CaiRoutesHandler(separator=self.separator, debug=self.debug)
+        for rid, route in routes.items():
+            # ways outside the file or without geometry are not used
+            members = [w for w in route.elems if w in geoms]
+            if not members:
+                continue
+            # like Overpass a route is in the area if one of its ways is inside
+            if poly is not None and not any(
+                poly.intersects(geoms.linestring(w)) for w in members
+            ):
+                continue
+            route.elems = members
+            self.full.routes[rid] = route
+            self.full.count += 1
+            for w in members:
+                self.full.ways[w] = ways[w]
+                self.full.members[w] = array("q")
+                self.waynodes[w] = nodes[w]
+        self.full.geoms = geoms.subset(self.full.ways.keys())
+        return True
+
+    def close(self):
+        """Function to free the data read from the OSM file"""
+        self.full = None
+        self.cch = None
+        self.waynodes = {}
+        return True
+
+    def _route_ids(self, network):
+        """Private function to return the ids of the routes filtered by
+        network
+
+        :param str network: the network level to filter
+        """
+        self.load_dataset()
+        return [
+            rid
+            for rid, route in self.full.routes.items()
+            if not check_network(network) or route.tags.get("network") == network
+        ]
+
+    def _local_routes(self, network):
+        """Private function to return the tags of the routes filtered by
+        network and sorted by id like Overpass output
+
+        :param str network: the network level to filter
+        """
+        return [
+            self.full.routes[rid].tags for rid in sorted(self._route_ids(network))
+        ]
+
+    def get_cairoutehandler(self, network="lwn", infomont=False):
+        """Function to read the OSM file and create CaiRoutesHandler instance
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool infomont: if the output should follow Infomont format
+        """
+        ids = self._route_ids(network)
+        self.cch = self.full.subset(ids, infomont=infomont)
+        self.lenght = None
+        return True
+
+    def get_file_osm(self, network="lwn", sort=True, out=None, out_format=None):
+        """Function to save the routes, their ways and nodes into a file,
+        the data are always sorted
+
+        :param str network: the network level to query, default 'lwn'
+        :param bool sort: not used, data are copied in the order of the file
+        :param str out: the path to the output file, by default a temporary
+                        file is created and the caller has to remove it
+        :param str out_format: the OSM format, one of osm, osm.gz or pbf, by
+                               default it is detected by the suffix of out
+        """
+        rels = set(self._route_ids(network))
+        ways = set()
+        for rid in rels:
+            ways.update(self.full.routes[rid].elems)
+        nodes = set()
+        for w in ways:
+            nodes.update(self.waynodes.get(w, []))
+        if out:
+            out = osm_format(out, out_format)[1]
+        else:
+            with tempfile.NamedTemporaryFile(suffix=".osm", delete=False) as tmp:
+                out = tmp.name
+        # osmium doesn't overwrite existing files
+        if os.path.exists(out):
+            os.remove(out)
+        writer = osmium.SimpleWriter(out)
+        try:
+            handler = PbfWriteHandler(writer, nodes, ways, rels)
+            bits = osmium.osm.osm_entity_bits
+            apply_reader(
+                self.osmfile, handler, bits.NODE | bits.WAY | bits.RELATION, self.debug
+            )
+        finally:
+            writer.close()
+        return out
+
+    def get_files_osm(self, network="lwn"):
+        """Function to save the routes in OSM format into a temporary file,
+        the caller has to remove it
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        return [self.get_file_osm(network=network)]
+
+    def get_buffer_osm(self, network="lwn"):
+        """Function to return the routes in OSM format as bytes
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        path = self.get_file_osm(network=network)
+        try:
+            with open(path, "rb") as fil:
+                return fil.read()
+        finally:
+            os.remove(path)
+
+    def get_data_json(self, network="lwn"):
+        """Overpass JSON format is not available for local files"""
+        raise ValueError("JSON format is not supported with local OSM files")
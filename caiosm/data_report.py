@@ -5,7 +5,6 @@ Created on Wed Mar 27 11:49:25 2019
 
 @author: lucadelu
 """
-from time import sleep
 from datetime import datetime
 from datetime import timedelta
 import matplotlib.pyplot as plt
@@ -13,6 +12,9 @@ import numpy as np
 from caiosm.data_from_overpass import CaiOsmRoute
 from caiosm.data_from_overpass import CaiOsmRouteDate
 from caiosm.functions import REGIONI
+from caiosm.scheduler import OverpassScheduler
+from caiosm.regions import CaiOsmRegions
+from caiosm.fetcher import RegionsFetcher
 
 SINGULAR_GRAN = ["day", "month", "year"]
 PLURAL_GRAN = ["days", "months", "years"]
@@ -71,31 +73,94 @@ class CaiOsmTable:
     """Print or write to a file statistics for regions, it calculate number
     and lenght routes for each region"""
 
-    def __init__(self, regions=REGIONI.keys()):
+    def __init__(
+        self,
+        regions=REGIONI.keys(),
+        cache=None,
+        scheduler=None,
+        pool=None,
+        national=False,
+        concurrency=2,
+        areas=None,
+    ):
         """Initialize function
 
         :param list regions: a list of region to process, by default it
                              execute for all Italian regions
+        :param obj cache: an OverpassCache instance to store the responses
+        :param obj scheduler: an OverpassScheduler instance to wait for slots,
+                              shared by all the queries
+        :param obj pool: an OverpassPool instance with several endpoints, it
+                         replaces scheduler
+        :param bool national: download the routes of all Italy with one query
+                              and split them by region locally, the length
+                              of routes is clipped with regional boundaries
+        :param int concurrency: the maximum number of regions processed at
+                                the same time
+        :param obj areas: an AreaIds instance to select the regions by their
+                          Overpass id instead of their name
         """
         self.regions = regions
+        self.cache = cache
+        if scheduler is None:
+            scheduler = OverpassScheduler()
+        self.scheduler = scheduler
+        self.pool = pool
+        self.national = national
+        self.concurrency = concurrency
+        self.areas = areas
 
     def print_region(self, reg, unit="km"):
         """Return info for each region"""
-        cod = CaiOsmRoute(area=reg)
+        cod = CaiOsmRoute(
+            area=reg,
+            cache=self.cache,
+            scheduler=self.scheduler,
+            pool=self.pool,
+            areas=self.areas,
+        )
         cod.get_cairoutehandler()
         leng = cod.get_length(unit=unit)
         count = cod.cch.count
         return leng, count
 
+    def _regions_values(self, callback, unit="km"):
+        """Run callback with region, lenght and number of routes for each
+        region, as soon as the data of a region are ready. The failed regions
+        are reported at the end
+
+        :param obj callback: the function to run for each region
+        :param str unit: the unit of the length, km or m
+        """
+        if self.national:
+            cors = CaiOsmRegions(
+                regions=self.regions,
+                cache=self.cache,
+                scheduler=self.scheduler,
+                pool=self.pool,
+                areas=self.areas,
+            )
+            values = cors.lengths(unit=unit)
+            for re in self.regions:
+                callback(re, values[re][0], values[re][1])
+            return True
+        fetcher = RegionsFetcher(regions=self.regions, concurrency=self.concurrency)
+        fetcher.run(
+            lambda re: self.print_region(re, unit=unit),
+            lambda re, val: callback(re, val[0], val[1]),
+        )
+        return fetcher.check()
+
     def print_regions(self):
         """Return number of routes and total lenght for each region"""
-        for re in self.regions:
-            l, c = self.print_region(re)
+
+        def output(re, l, c):
             print(
                 "{re}: {to} percorsi, lunghezza totale {le} "
                 "km\n".format(re=re, le=l, to=c)
             )
-            sleep(30)
+
+        return self._regions_values(output)
 
     def write_regions(self, output):
         """Return number of routes and total lenght for each region
@@ -103,13 +168,15 @@ class CaiOsmTable:
         :param str output: the path for output file
         """
         with open(output, "w") as fi:
-            for re in self.regions:
-                l, c = self.print_region(re)
+
+            def write(re, l, c):
                 fi.write(
                     "{re}: {to} percorsi, lunghezza totale "
                     "{le} km\n".format(re=re, le=l, to=c)
                 )
-        return True
+                fi.flush()
+
+            return self._regions_values(write)
 
 
 class CaiOsmHistory:
@@ -123,6 +190,12 @@ class CaiOsmHistory:
         regions=REGIONI.keys(),
         sleep=300,
         debug=False,
+        cache=None,
+        scheduler=None,
+        pool=None,
+        national=False,
+        concurrency=2,
+        areas=None,
     ):
         """Initialize function
         :param str startdate: the starting date in format YYYY-MM-DD
@@ -131,10 +204,26 @@ class CaiOsmHistory:
                               "2 months", "6 months", "1 year"
         :param list regions: a list of region to process, by default it
                              execute for all Italian regions
-        :param list sleep: seconds to wait between two overpass query
+        :param int sleep: maximum seconds to wait for a free overpass slot,
+                          used only when scheduler is not set
         :param bool debug: print debug information
+        :param obj cache: an OverpassCache instance to store the responses
+        :param obj scheduler: an OverpassScheduler instance to wait for slots,
+                              shared by all the queries
+        :param obj pool: an OverpassPool instance with several endpoints, it
+                         replaces scheduler
+        :param bool national: download the routes of all Italy with one query
+                              for each date and split them by region locally
+        :param int concurrency: the maximum number of regions processed at
+                                the same time
+        :param obj areas: an AreaIds instance to select the regions by their
+                          Overpass id instead of their name
         """
         self.regions = regions
+        self.cache = cache
+        self.national = national
+        self.concurrency = concurrency
+        self.areas = areas
         self.debug = debug
         self.startdate = datetime.strptime(startdate, "%Y-%m-%d")
         self.times = [self.startdate]
@@ -164,6 +253,10 @@ class CaiOsmHistory:
         if self.debug:
             print(self.times)
         self.sleep = sleep
+        if scheduler is None:
+            scheduler = OverpassScheduler(maxwait=self.sleep, debug=self.debug)
+        self.scheduler = scheduler
+        self.pool = pool
 
     def reg_history(self, region):
         """Return data about the history of CAI path for a region
@@ -173,10 +266,17 @@ class CaiOsmHistory:
         output = {}
         for y in self.times:
             data = y.strftime("%Y-%m-%d")
-            cord = CaiOsmRouteDate(startdate=y, area=region, debug=self.debug)
+            cord = CaiOsmRouteDate(
+                startdate=y,
+                area=region,
+                debug=self.debug,
+                cache=self.cache,
+                scheduler=self.scheduler,
+                pool=self.pool,
+                areas=self.areas,
+            )
             cord.get_cairoutehandler()
             output[data] = [cord.cch.count, cord.get_length(unit="km")]
-            sleep(self.sleep)
         if self.debug:
             print(output)
         return output
@@ -206,12 +306,41 @@ class CaiOsmHistory:
         plot_one(data, "Andamento sentieri CAI in {}".format(region), outpath)
         return True
 
+    def national_history(self):
+        """Return data about the history of CAI path for all Italian regions
+        downloading the data of all Italy once for each date"""
+        output = {}
+        for re in self.regions:
+            output[re] = {}
+        for y in self.times:
+            data = y.strftime("%Y-%m-%d")
+            cors = CaiOsmRegions(
+                regions=self.regions,
+                startdate=data,
+                debug=self.debug,
+                cache=self.cache,
+                scheduler=self.scheduler,
+                pool=self.pool,
+                areas=self.areas,
+            )
+            for re, (leng, count) in cors.lengths(unit="km").items():
+                output[re][data] = [count, leng]
+        if self.debug:
+            print(output)
+        return output
+
     def regions_history(self):
         """Return data about the history of CAI path for all Italian regions"""
+        if self.national:
+            return self.national_history()
+        fetcher = RegionsFetcher(
+            regions=self.regions, concurrency=self.concurrency, debug=self.debug
+        )
+        history = fetcher.run(self.reg_history)
+        fetcher.check()
         output = {}
         for re in self.regions:
-            output[re] = self.reg_history(re)
-            sleep(self.sleep)
+            output[re] = history[re]
         return output
 
     def regions_csv(self, outpath=None):
@@ -225,9 +354,10 @@ class CaiOsmHistory:
         for t in self.times:
             output += "|{}".format(t.strftime("%Y-%m-%d"))
         output += "\n"
+        history = self.regions_history()
         for re in self.regions:
             output += "{}".format(re)
-            regdata = self.reg_history(re)
+            regdata = history[re]
             for t in self.times:
                 output += "|{}".format(regdata[t.strftime("%Y-%m-%d")][1])
             output += "\n"
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:02:17 2026
+
+@author: lucadelu
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .functions import REGIONI
+
+
+class RegionsFetcher:
+    """Class to run the queries of several regions concurrently, the number
+    of parallel queries is limited and the Overpass pool limits it further
+    for each endpoint"""
+
+    def __init__(self, regions=REGIONI.keys(), concurrency=2, debug=False):
+        """Inizialize
+
+        :param list regions: a list of region to process, by default it
+                             execute for all Italian regions
+        :param int concurrency: the maximum number of regions processed at
+                                the same time
+        :param bool debug: print debug information
+        """
+        self.regions = list(regions)
+        self.concurrency = max(1, concurrency)
+        self.debug = debug
+        self.errors = {}
+
+    async def _fetch(self, loop, executor, semaphore, fetch, reg):
+        """Run the fetch function for a region in a thread
+
+        :param obj loop: the asyncio loop
+        :param obj executor: the thread pool executor
+        :param obj semaphore: the semaphore limiting the concurrency
+        :param obj fetch: the function to run, it gets the region name
+        :param str reg: the name of the region
+        """
+        async with semaphore:
+            if self.debug:
+                print("-------- Processing : {} --------".format(reg))
+            return await loop.run_in_executor(executor, fetch, reg)
+
+    async def _run(self, loop, fetch, process):
+        """Run all the regions and process the results when they are ready
+
+        :param obj loop: the asyncio loop
+        :param obj fetch: the function to run, it gets the region name
+        :param obj process: the function to run with region name and result
+                            of fetch when a region is completed
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            tasks = {}
+            for reg in self.regions:
+                task = loop.create_task(
+                    self._fetch(loop, executor, semaphore, fetch, reg)
+                )
+                tasks[task] = reg
+            pending = set(tasks.keys())
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    reg = tasks[task]
+                    try:
+                        result = task.result()
+                        if process:
+                            result = process(reg, result)
+                        results[reg] = result
+                    except Exception as e:
+                        if self.debug:
+                            print("Error processing {}: {}".format(reg, e))
+                        self.errors[reg] = e
+        return results
+
+    def run(self, fetch, process=None):
+        """Run fetch for all the regions and return a dictionary with region
+        name and result, failed regions are stored in errors
+
+        :param obj fetch: the function to run, it gets the region name
+        :param obj process: the function to run with region name and result
+                            of fetch when a region is completed, its return
+                            value replaces the result of fetch
+        """
+        self.errors = {}
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._run(loop, fetch, process))
+        finally:
+            loop.close()
+
+    def report(self):
+        """Return a string with the regions failed and their errors"""
+        return "\n".join(
+            "{}: {}".format(reg, err) for reg, err in self.errors.items()
+        )
+
+    def check(self):
+        """Raise an error listing the failed regions, if any"""
+        if self.errors:
+            raise ValueError(
+                "Error processing {} regions:\n{}".format(
+                    len(self.errors), self.report()
+                )
+            )
+        return True
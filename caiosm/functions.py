@@ -6,12 +6,13 @@ Created on Sun Apr 21 23:45:52 2019
 @author: lucadelu
 """
 import os
+import re
 import csv
 import json
 from subprocess import Popen, PIPE
 import configparser
-import itertools
 import smtplib
+import xml.etree.ElementTree as ET
 from collections import OrderedDict
 from copy import deepcopy
 from email.mime.text import MIMEText
@@ -20,6 +21,11 @@ from email.mime.base import MIMEBase
 from email import encoders
 from shapely.geometry import mapping, shape, MultiPoint, Point
 from shapely.ops import split
+from shapely.ops import linemerge
+from shapely.ops import polygonize
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+from shapely.prepared import prep
 import geojson
 import geopandas as gpd
 import matplotlib.pyplot as plt
@@ -49,6 +55,19 @@ REGIONI = OrderedDict(
         ("Valle d'Aosta/Vallée d'Aoste", "15"),
     )
 )
+# OSM formats supported for output, with the suffix of the file
+OSM_FORMATS = OrderedDict((("osm", ".osm"), ("osm.gz", ".osm.gz"), ("pbf", ".osm.pbf")))
+# order of OSM elements in a sorted file
+OSM_ORDER = {"node": 0, "way": 1, "relation": 2}
+# regular expressions to scan Overpass JSON data without decoding it
+JSON_ELEMENTS_RE = re.compile(r'"elements"\s*:\s*\[')
+JSON_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*("|\\?\Z)|[{}\[\]]')
+JSON_TYPE_RE = re.compile(r'\{\s*"type"\s*:\s*"(\w+)"')
+# regular expression to find the runtime errors in Overpass XML and JSON data
+OVERPASS_ERROR_RE = re.compile(
+    r"<remark>\s*(runtime error[^<]*)"
+    r'|"remark"\s*:\s*"\s*(runtime error(?:[^"\\]|\\.)*)'
+)
 
 # functions
 def invert_bbox(bbox):
@@ -60,6 +79,76 @@ def invert_bbox(bbox):
     return "{ymi},{xmi},{yma},{xma}".format(ymi=l[1], xmi=l[0], yma=l[3], xma=l[2])
 
 
+def format_bbox(ymin, xmin, ymax, xmax):
+    """Return the string of a bounding box in YMIN,XMIN,YMAX,XMAX format
+
+    :param float ymin: the minimum latitude
+    :param float xmin: the minimum longitude
+    :param float ymax: the maximum latitude
+    :param float xmax: the maximum longitude
+    """
+    return ",".join([str(round(v, 7)) for v in (ymin, xmin, ymax, xmax)])
+
+
+def split_bbox(bbox, size):
+    """Split a bounding box in tiles, it returns a list of bounding boxes
+    in YMIN,XMIN,YMAX,XMAX format
+
+    :param str bbox: the string of the bounding box in YMIN,XMIN,YMAX,XMAX
+                     format
+    :param float size: the maximum size of the tiles in degrees
+    """
+    ymin, xmin, ymax, xmax = [float(v) for v in bbox.split(",")]
+    rows = max(1, int(-(-(ymax - ymin) // size)))
+    cols = max(1, int(-(-(xmax - xmin) // size)))
+    ystep = (ymax - ymin) / rows
+    xstep = (xmax - xmin) / cols
+    tiles = []
+    for r in range(rows):
+        for c in range(cols):
+            tiles.append(
+                format_bbox(
+                    ymin + r * ystep,
+                    xmin + c * xstep,
+                    ymax if r == rows - 1 else ymin + (r + 1) * ystep,
+                    xmax if c == cols - 1 else xmin + (c + 1) * xstep,
+                )
+            )
+    return tiles
+
+
+def bisect_bbox(bbox):
+    """Split a bounding box in two halves along the longest side
+
+    :param str bbox: the string of the bounding box in YMIN,XMIN,YMAX,XMAX
+                     format
+    """
+    ymin, xmin, ymax, xmax = [float(v) for v in bbox.split(",")]
+    if ymax - ymin > xmax - xmin:
+        ymid = (ymin + ymax) / 2
+        return [
+            format_bbox(ymin, xmin, ymid, xmax),
+            format_bbox(ymid, xmin, ymax, xmax),
+        ]
+    xmid = (xmin + xmax) / 2
+    return [
+        format_bbox(ymin, xmin, ymax, xmid),
+        format_bbox(ymin, xmid, ymax, xmax),
+    ]
+
+
+def overpass_error(text):
+    """Return the runtime error reported by Overpass at the end of the data,
+    None if there is no error
+
+    :param str text: the final part of the Overpass data
+    """
+    match = OVERPASS_ERROR_RE.search(text)
+    if match:
+        return (match.group(1) or match.group(2)).strip()
+    return None
+
+
 def check_network(net):
     """Check if network is set
 
@@ -75,7 +164,8 @@ def WriteDictToCSV(csv_file, csv_columns, dict_data):
 
     :param str csv_file: the path to the output CSV file
     :param list csv_columns: the name of the column and dictionary keys
-    :param dict dict_data: the dictionary with the data
+    :param dict dict_data: the dictionary with the data, the values are
+                           Route records or dictionaries with a tags key
     """
     try:
         with open(csv_file, "w") as csvfile:
@@ -84,18 +174,9 @@ def WriteDictToCSV(csv_file, csv_columns, dict_data):
             )
             writer.writeheader()
             for k, data in dict_data.items():
-                allcols = True
-                missing = []
-                for col in csv_columns:
-                    if col not in data["tags"].keys():
-                        allcols = False
-                        missing.append(col)
-                if allcols:
-                    writer.writerow(data["tags"])
-                else:
-                    for mis in missing:
-                        data["tags"][mis] = ""
-                    writer.writerow(data["tags"])
+                tags = data["tags"]
+                # missing columns are written empty without changing the tags
+                writer.writerow({col: tags.get(col, "") for col in csv_columns})
     except IOError as err:
         errno, strerror = err.args
         print("I/O error({0}): {1}".format(errno, strerror))
@@ -273,41 +354,63 @@ def send_mail(sub, mess, to=None, cc=None, bcc=None, attach=None, path=None, tls
         print(to)
 
 
+def _intersection_points(inter):
+    """Return the points of the intersection between two lines
+
+    :param obj inter: the shapely geometry of the intersection
+    """
+    points = []
+    if "Point" == inter.geom_type:
+        points.append(inter)
+    elif "MultiPoint" == inter.geom_type:
+        points.extend([pt for pt in inter.geoms])
+    elif "MultiLineString" == inter.geom_type:
+        multiLine = [line for line in inter.geoms]
+        first_coords = multiLine[0].coords[0]
+        last_coords = multiLine[len(multiLine) - 1].coords[1]
+        points.append(Point(first_coords[0], first_coords[1]))
+        points.append(Point(last_coords[0], last_coords[1]))
+    elif "GeometryCollection" == inter.geom_type:
+        for geom in inter.geoms:
+            if geom.geom_type in ["Point", "MultiPoint", "MultiLineString"]:
+                points.extend(_intersection_points(geom))
+    return points
+
+
+def intersecting_pairs(geoms):
+    """Return the sorted pairs of indexes (i, j), with i lower than j, of the
+    geometries intersecting each other. The candidates are selected by their
+    bounding box with a STRtree
+
+    :param list geoms: a list of shapely geometries
+    """
+    tree, index = strtree_index(geoms)
+    try:
+        # shapely >= 2.0 checks the predicate for all the geometries at once
+        pairs = tree.query(geoms, predicate="intersects")
+    except TypeError:
+        pairs = None
+    if pairs is not None:
+        return sorted({(int(i), int(j)) for i, j in zip(*pairs) if i < j})
+    output = set()
+    for i, geom in enumerate(geoms):
+        prepared = prep(geom)
+        for j in strtree_query(tree, index, geom):
+            if i < j and prepared.intersects(geoms[j]):
+                output.add((i, j))
+    return sorted(output)
+
+
 def get_points(lines):
     """Get points of intersection beetween to lines
 
     :param list lines: a list of dictionary containing geometri in WKT format
     """
+    geoms = [shape(line["geometry"]) for line in lines]
     inters = []
-    # iterate all the combinations between lines
-    for l1, l2 in itertools.combinations(lines, 2):
-        line1 = shape(l1["geometry"])
-        line2 = shape(l2["geometry"])
-        # if the two lines intersect get the points
-        if line1.intersects(line2):
-            inter = line1.intersection(line2)
-            if "Point" == inter.type:
-                inters.append(inter)
-            elif "MultiPoint" == inter.type:
-                inters.extend([pt for pt in inter])
-            elif "MultiLineString" == inter.type:
-                multiLine = [line for line in inter]
-                first_coords = multiLine[0].coords[0]
-                last_coords = multiLine[len(multiLine) - 1].coords[1]
-                inters.append(Point(first_coords[0], first_coords[1]))
-                inters.append(Point(last_coords[0], last_coords[1]))
-            elif "GeometryCollection" == inter.type:
-                for geom in inter:
-                    if "Point" == geom.type:
-                        inters.append(geom)
-                    elif "MultiPoint" == geom.type:
-                        inters.extend([pt for pt in geom])
-                    elif "MultiLineString" == geom.type:
-                        multiLine = [line for line in geom]
-                        first_coords = multiLine[0].coords[0]
-                        last_coords = multiLine[len(multiLine) - 1].coords[1]
-                        inters.append(Point(first_coords[0], first_coords[1]))
-                        inters.append(Point(last_coords[0], last_coords[1]))
+    # only the pairs of intersecting lines, in the order of the combinations
+    for i, j in intersecting_pairs(geoms):
+        inters.extend(_intersection_points(geoms[i].intersection(geoms[j])))
     return MultiPoint(inters)
 
 
@@ -317,12 +420,18 @@ def split_at_intersection(lines, prefix=None):
     :param list lines: a list of dictionary containing geometri in WKT format
     """
     # get intersection
-    mp = get_points(lines)
+    points = list(get_points(lines).geoms)
+    tree, index = strtree_index(points)
     x = 0
     output = []
-    # for each line split it
+    # for each line split it, only with the points inside its bounding box
     for line in lines:
-        splitlines = split(shape(line["geometry"]), mp)
+        geom = shape(line["geometry"])
+        near = [points[i] for i in sorted(strtree_query(tree, index, geom))]
+        if near:
+            splitlines = split(geom, MultiPoint(near)).geoms
+        else:
+            splitlines = [geom]
         for sl in splitlines:
             if prefix:
                 idd = str(prefix) + str(x)
@@ -337,6 +446,57 @@ def split_at_intersection(lines, prefix=None):
     return geojson.FeatureCollection(output)
 
 
+def polygon_from_lines(outers, inners=None):
+    """Return a shapely polygon from the lines of a boundary relation
+
+    :param list outers: the list of shapely lines with outer role
+    :param list inners: the list of shapely lines with inner role
+    """
+    poly = unary_union(list(polygonize(linemerge(outers))))
+    if inners:
+        poly = poly.difference(unary_union(list(polygonize(linemerge(inners)))))
+    return poly
+
+
+def round_length(value, unit="m"):
+    """Return a length in meters rounded in the required unit
+
+    :param float value: the length in meters
+    :param str unit: the unit of the output, km or m
+    """
+    if unit == "km":
+        return round(round(value) / 1000, 1)
+    elif unit != "m":
+        print("Unit not supported, reported in meters")
+    return round(value)
+
+
+def strtree_index(geoms):
+    """Return a STRtree for a list of geometries and a dictionary to convert
+    the geometries returned by the tree to their indexes
+
+    :param list geoms: a list of shapely geometries
+    """
+    return STRtree(geoms), {id(g): i for i, g in enumerate(geoms)}
+
+
+def strtree_query(tree, index, geom):
+    """Return the indexes of the geometries in a STRtree whose bounding box
+    intersects the bounding box of geom
+
+    :param obj tree: the shapely STRtree object
+    :param dict index: the dictionary returned by strtree_index
+    :param obj geom: the geometry to query
+    """
+    result = tree.query(geom)
+    if len(result) == 0:
+        return []
+    # shapely < 2.0 returns geometries instead of indexes
+    if hasattr(result[0], "geom_type"):
+        return [index[id(g)] for g in result]
+    return [int(i) for i in result]
+
+
 def make_safe_filename(s):
     """Function to clean a variable for file name
     https://stackoverflow.com/questions/7406102/create-sane-safe-filename-from-any-unsafe-string
@@ -356,3 +516,132 @@ def utf8len(s):
     https://stackoverflow.com/questions/30686701/python-get-size-of-string-in-bytes
     """
     return len(s.encode("utf-8"))
+
+
+def osm_format(path, out_format=None):
+    """Return a tuple with the OSM format and the path with the right suffix,
+    without format it is detected by the suffix of the path
+
+    :param str path: the path to the output file
+    :param str out_format: the OSM format, one of OSM_FORMATS keys
+    """
+    if out_format is None:
+        for fmt in reversed(OSM_FORMATS.keys()):
+            if path.endswith(fmt):
+                return fmt, path
+        return "osm", path
+    if out_format not in OSM_FORMATS.keys():
+        raise ValueError(
+            "Only {} OSM formats are supported".format(", ".join(OSM_FORMATS.keys()))
+        )
+    if not path.endswith(out_format):
+        path += OSM_FORMATS[out_format]
+    return out_format, path
+
+
+def index_file(idx):
+    """Return the path of the file used by a file based osmium index, like
+    dense_file_array,/path/file, or None for the other indexes
+
+    :param str idx: the osmium index type
+    """
+    parts = idx.split(",", 1)
+    if len(parts) == 2 and parts[0].endswith("_file_array") and parts[1]:
+        return parts[1]
+    return None
+
+
+def sort_osm_xml(data):
+    """Sort in memory OSM XML data, like osmium nodes are written before
+    ways and relations, every type is sorted by id and duplicated elements
+    are removed. It returns the sorted data as bytes
+
+    :param bytes data: the OSM XML data
+    """
+    root = ET.fromstring(data)
+    header = []
+    elements = {}
+    for elem in root:
+        if elem.tag in OSM_ORDER.keys():
+            key = (OSM_ORDER[elem.tag], int(elem.get("id")))
+            if key not in elements:
+                elements[key] = elem
+        else:
+            header.append(elem)
+    for elem in list(root):
+        root.remove(elem)
+    for elem in header + [elements[key] for key in sorted(elements.keys())]:
+        elem.tail = "\n  "
+        root.append(elem)
+    if len(root):
+        root[-1].tail = "\n"
+    root.text = "\n  "
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True) + b"\n"
+
+
+def _json_element_end(text, start):
+    """Return the position after the JSON object starting at start, None if
+    the object is not complete
+
+    :param str text: the JSON text
+    :param int start: the position of the opening brace
+    """
+    depth = 0
+    for match in JSON_TOKEN_RE.finditer(text, start):
+        token = match.group(0)
+        if token[0] == '"':
+            if match.group(1) != '"':
+                # the string continues in the next chunk
+                return None
+        elif token in "{[":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return None
+
+
+def iter_json_elements(chunks, types=None):
+    """Parse incrementally the elements of Overpass JSON data and yield them
+    as dictionary. The elements of other types are skipped without decoding
+    them, so memory does not grow with the size of the data
+
+    :param obj chunks: an iterable of strings with the JSON data
+    :param list types: the types of elements to return, by default all
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ""
+    pos = None
+    for chunk in chunks:
+        buf += chunk
+        if pos is None:
+            match = JSON_ELEMENTS_RE.search(buf)
+            if not match:
+                continue
+            pos = match.end()
+        while True:
+            # skip separators between elements
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                # consume the remaining data, so the source could complete
+                for chunk in chunks:
+                    pass
+                return
+            end = _json_element_end(buf, pos)
+            if end is None:
+                break
+            typ = JSON_TYPE_RE.match(buf, pos)
+            if types is None or typ is None or typ.group(1) in types:
+                elem = decoder.raw_decode(buf, pos)[0]
+                if types is None or elem.get("type") in types:
+                    yield elem
+            pos = end
+        buf = buf[pos:]
+        pos = 0
+    if pos is None:
+        raise ValueError("Elements not found in JSON data")
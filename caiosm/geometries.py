@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:14:05 2026
+
+@author: lucadelu
+"""
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+import numpy as np
+import pyproj
+from shapely.geometry import LineString
+
+# decimal digits of the coordinates, the same precision of osmium
+PRECISION = 7
+
+
+@lru_cache(maxsize=None)
+def transformer(epsg):
+    """Return a pyproj Transformer from WGS84 to epsg, longitude and latitude
+    order is used like the coordinates of OSM data
+
+    :param str epsg: the EPSG code string of the output projection
+    """
+    return pyproj.Transformer.from_crs("EPSG:4326", epsg, always_xy=True)
+
+
+class WayGeometries:
+    """Class to store the geometries of ways in a compact form: the ids in an
+    integer array, all the coordinates in a single float64 array and the
+    offsets of the first point of each way. Shapely geometries are created
+    only when they are requested"""
+
+    def __init__(self):
+        """Inizialize"""
+        self.ids = array("q")
+        self.offsets = array("Q", [0])
+        # longitude and latitude of all the points
+        self.coords = array("d")
+        # ids are searched with bisect while they are added sorted, like in
+        # OSM files, otherwise a dictionary with their positions is used
+        self.index = None
+        # projected coordinates and lengths for each EPSG code
+        self.projections = {}
+        self.lengths = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, wid):
+        return self._position(wid) is not None
+
+    def _position(self, wid):
+        """Private function to return the position of a way or None
+
+        :param int wid: the id of the way
+        """
+        if self.index is not None:
+            return self.index.get(wid)
+        pos = bisect_left(self.ids, wid)
+        if pos < len(self.ids) and self.ids[pos] == wid:
+            return pos
+        return None
+
+    def add(self, wid, points):
+        """Add the geometry of a way, like osmium consecutive duplicated
+        points are removed. It returns False if the way is already stored
+
+        :param int wid: the id of the way
+        :param list points: the list of (lon, lat) tuples, None values are
+                            skipped
+        """
+        if wid in self:
+            return False
+        coords = []
+        last = None
+        for pt in points:
+            if pt is None:
+                continue
+            pt = (round(pt[0], PRECISION), round(pt[1], PRECISION))
+            if pt != last:
+                coords.extend(pt)
+                last = pt
+        if len(coords) < 4:
+            raise ValueError("A linestring requires at least two points")
+        if self.index is None and self.ids and wid < self.ids[-1]:
+            self.index = {w: pos for pos, w in enumerate(self.ids)}
+        if self.index is not None:
+            self.index[wid] = len(self.ids)
+        self.ids.append(wid)
+        self.coords.extend(coords)
+        self.offsets.append(len(self.coords) // 2)
+        self.projections = {}
+        self.lengths = {}
+        return True
+
+    def add_way(self, way):
+        """Add the geometry of an osmium way with node locations
+
+        :param obj way: the osmium way
+        """
+        return self.add(
+            way.id, [(n.location.lon, n.location.lat) for n in way.nodes]
+        )
+
+    def add_elements(self, wid, geometry):
+        """Add the geometry of a way downloaded with 'out geom'
+
+        :param int wid: the id of the way
+        :param list geometry: the list of points with lat and lon keys
+        """
+        return self.add(
+            wid, [(pt["lon"], pt["lat"]) if pt else None for pt in geometry]
+        )
+
+    def project(self, epsg):
+        """Return the coordinates of all the points reprojected to epsg as
+        numpy array with a row for each point, all the points are transformed
+        with a single call and the result is kept for the next requests
+
+        :param str epsg: the EPSG code string of the output projection
+        """
+        if not self.ids:
+            return np.empty((0, 2))
+        if epsg not in self.projections:
+            coords = np.frombuffer(self.coords, dtype=np.float64).reshape(-1, 2)
+            xs, ys = transformer(epsg).transform(coords[:, 0], coords[:, 1])
+            self.projections[epsg] = np.column_stack([xs, ys])
+        return self.projections[epsg]
+
+    def way_lengths(self, epsg="EPSG:3035"):
+        """Return a dictionary with the length of each way in the units of
+        epsg, the lengths are computed for all the ways at once
+
+        :param str epsg: the EPSG code string of the projection to use
+        """
+        if not self.ids:
+            return {}
+        if epsg not in self.lengths:
+            coords = self.project(epsg)
+            segments = np.hypot(*np.diff(coords, axis=0).T)
+            # cumulative length at each point, the segments between the last
+            # point of a way and the first of the next way are not used
+            cumul = np.concatenate([[0.0], np.cumsum(segments)])
+            offsets = np.frombuffer(self.offsets, dtype=np.uint64).astype(np.int64)
+            values = cumul[offsets[1:] - 1] - cumul[offsets[:-1]]
+            self.lengths[epsg] = dict(zip(self.ids, values.tolist()))
+        return self.lengths[epsg]
+
+    def coordinates(self, wid, epsg=None):
+        """Return the coordinates of a way as numpy array with a row for
+        each point
+
+        :param int wid: the id of the way
+        :param str epsg: the EPSG code string of the output projection, by
+                         default WGS84 coordinates are returned
+        """
+        pos = self._position(wid)
+        if pos is None:
+            raise KeyError(wid)
+        start = self.offsets[pos]
+        end = self.offsets[pos + 1]
+        if epsg is not None:
+            return self.project(epsg)[start:end]
+        return np.frombuffer(
+            self.coords[start * 2 : end * 2], dtype=np.float64
+        ).reshape(-1, 2)
+
+    def linestring(self, wid, epsg=None):
+        """Return the shapely LineString of a way
+
+        :param int wid: the id of the way
+        :param str epsg: the EPSG code string of the output projection, by
+                         default WGS84 coordinates are used
+        """
+        return LineString(self.coordinates(wid, epsg))
+
+    def subset(self, wids):
+        """Return a new WayGeometries with only the selected ways
+
+        :param list wids: the ids of the ways to copy, missing ways are
+                          skipped
+        """
+        output = WayGeometries()
+        for wid in sorted(set(wids)):
+            pos = self._position(wid)
+            if pos is None:
+                continue
+            output.ids.append(wid)
+            output.coords.extend(
+                self.coords[self.offsets[pos] * 2 : self.offsets[pos + 1] * 2]
+            )
+            output.offsets.append(len(output.coords) // 2)
+        return output
@@ -7,6 +7,9 @@ Created on Mon Apr 22 00:41:04 2019
 """
 import os
 from .data_from_overpass import CaiOsmRoute
+from .data_from_pbf import CaiOsmRoutePbf
+from .osmium_handler import INFOMONT_TAGS
+from .osmium_handler import INFOMONT_WAY_TAGS
 
 # class to get data from overpass and convert in infomont system
 class CaiOsmInfomont:
@@ -21,6 +24,15 @@ class CaiOsmInfomont:
         epsg=32632,
         prefix=None,
         debug=None,
+        cache=None,
+        scheduler=None,
+        pool=None,
+        handler=None,
+        outgeom=False,
+        tilesize=None,
+        pbf=None,
+        idx=None,
+        areas=None,
     ):
         """Inizialize function
         :param str area: the name of the area of interest
@@ -31,21 +43,61 @@ class CaiOsmInfomont:
         :param str driver: the OGR driver to use as output
         :param str prefix: a prefix to add to ways id
         :param bool debug: print debug information
+        :param obj cache: an OverpassCache instance to store the responses
+        :param obj scheduler: an OverpassScheduler instance to wait for slots
+        :param obj pool: an OverpassPool instance with several endpoints
+        :param obj handler: a CaiRoutesHandler instance with infomont format
+                            already populated, area and bbox are not used
+        :param bool outgeom: download the geometry of ways with 'out geom'
+                             instead of their nodes
+        :param float tilesize: the maximum size in degrees of the tiles used
+                               to split the bbox query
+        :param str pbf: the path to a local OSM file, like a PBF extract, to
+                        read instead of using Overpass API
+        :param str idx: the osmium index type to store node locations, by
+                        default flex_mem for Overpass data and
+                        sparse_mem_array for local files
+        :param obj areas: an AreaIds instance to select the area by its
+                          Overpass id instead of its name
         """
 
         self.debug = debug
-        self.cor = CaiOsmRoute(
-            area=area, bbox=bbox, debug=self.debug, bbox_inverted=bbox_inverted
-        )
-        if self.debug:
-            print("Before get handler")
-        self.cor.get_cairoutehandler(infomont=True)
+        self.cor = None
+        if handler is None and pbf:
+            self.cor = CaiOsmRoutePbf(
+                pbf,
+                area=area,
+                bbox=bbox,
+                debug=self.debug,
+                bbox_inverted=bbox_inverted,
+                idx=idx,
+                reltags=INFOMONT_TAGS,
+                waytags=INFOMONT_WAY_TAGS,
+            )
+        elif handler is None:
+            self.cor = CaiOsmRoute(
+                area=area,
+                bbox=bbox,
+                debug=self.debug,
+                bbox_inverted=bbox_inverted,
+                cache=cache,
+                scheduler=scheduler,
+                pool=pool,
+                outgeom=outgeom,
+                tilesize=tilesize,
+                idx=idx or "flex_mem",
+                areas=areas,
+            )
+        if self.cor:
+            if self.debug:
+                print("Before get handler")
+            self.cor.get_cairoutehandler(infomont=True)
+            handler = self.cor.cch
+        self.cch = handler
         if self.debug:
             print("Before create way")
-        self.cor.cch.create_way_geojson(prefix)
-        if self.debug:
-            print("Before create route ")
-        self.cor.cch.create_routes_geojson()
+        self.cch.create_way_geojson(prefix)
+        # the routes features are created while they are written
         self.driver = driver
         self.epsg = epsg
 
@@ -54,21 +106,21 @@ class CaiOsmInfomont:
 
         :param str outpath: the path to the output file
         """
-        self.cor.cch.write_geojson(outpath, typ="way", driv=self.driver, epsg=self.epsg)
+        self.cch.write_geojson(outpath, typ="way", driv=self.driver, epsg=self.epsg)
 
     def write_routes(self, outpath):
         """Write routes info in a OGR format
 
         :param str outpath: the path to the output file
         """
-        self.cor.cch.write_relations_infomont(outpath)
+        self.cch.write_relations_infomont(outpath)
 
     def write_routes_geo(self, outpath):
         """Write routes info a OGR format
 
         :param str outpath: the path to the output file
         """
-        self.cor.cch.write_geojson(
+        self.cch.write_geojson(
             outpath, typ="route", driv=self.driver, epsg=self.epsg
         )
 
@@ -77,7 +129,7 @@ class CaiOsmInfomont:
 
         :param str outpath: the path to the output file
         """
-        self.cor.cch.write_geojson(
+        self.cch.write_geojson(
             outpath, typ="members", driv=self.driver, epsg=self.epsg
         )
 
@@ -86,7 +138,7 @@ class CaiOsmInfomont:
 
         :param str outpath: the path to the output file
         """
-        self.cor.cch.write_relation_members_infomont(outpath)
+        self.cch.write_relation_members_infomont(outpath)
 
     def write_all(self, outdir):
         """Write all info ready to be imported in infomont
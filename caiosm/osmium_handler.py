@@ -8,11 +8,10 @@ Created on Sun Mar  3 08:51:30 2019
 
 import osmium
 import copy
+from array import array
 import geojson
 from collections import OrderedDict
-import shapely.wkt as wktlib
 from shapely.geometry import MultiLineString
-from shapely.geometry import LineString
 from shapely.geometry import mapping
 from shapely.geometry import shape
 from shapely.ops import transform
@@ -23,6 +22,10 @@ from functools import partial
 
 from .functions import WriteDictToCSV
 from .functions import split_at_intersection
+from .functions import round_length
+from .geometries import WayGeometries
+from .records import Route
+from .records import Way
 
 # column to create the csv with route informations
 ROUTE_COLUMNS = [
@@ -91,28 +94,72 @@ ROUTE_FIELD = OrderedDict(
         ("PerDif", "cai_scale"),
     ]
 )
+# route tags used by the Infomont outputs, network is used to filter them
+INFOMONT_TAGS = list(
+    OrderedDict.fromkeys(
+        ROUTE_COLUMNS
+        + list(ROUTE_FIELD.values())
+        + ["symbol", "symbol:it", "osmc:symbol", "network"]
+    )
+)
+# way tags used by the Infomont outputs
+INFOMONT_WAY_TAGS = ["highway", "surface", "footway", "sidewalk"]
 # WKT class from osmium
 WKTFAB = osmium.geom.WKTFactory()
 
+
+def copy_tags(tags, keys=None):
+    """Return a dictionary with the tags of an osmium object, with keys only
+    the whitelisted tags are looked up and copied
+
+    :param obj tags: the osmium TagList, or a dictionary when keys are set
+    :param list keys: the keys to copy, None to copy all the tags
+    """
+    if keys is None:
+        return {t.k: t.v for t in tags}
+    output = {}
+    for k in keys:
+        v = tags.get(k)
+        if v is not None:
+            output[k] = v
+    return output
+
+
 # classes to parse osm and get way and relations
 class CaiRoutesHandler(osmium.SimpleHandler):
     """Class to parse CAI routes from OSM file and return them in different
     format"""
 
-    def __init__(self, separator=",", infomont=False, debug=False):
+    def __init__(
+        self,
+        separator=",",
+        infomont=False,
+        debug=False,
+        reltags=None,
+        waytags=None,
+    ):
         """Inizialize function
 
         :param str separator: the separator string for CSV output
         :param bool infomont: if the output should follow Infomont format
+        :param list reltags: the keys of the relation tags to copy, by
+                             default all
+        :param list waytags: the keys of the way tags to copy, by default all
         """
 
         osmium.SimpleHandler.__init__(self)
         self.debug = debug
         self.infomont = infomont
+        self.reltags = reltags
+        self.waytags = waytags
+        self.callbacks = 0
         self.count = 0
         self.routes = {}
         self.ways = {}
+        self.geoms = WayGeometries()
         self.members = {}
+        # the members index is built once by build_members
+        self.indexed = False
         self.gjson = None
         self.wjson = None
         self.sep = separator
@@ -149,29 +196,92 @@ class CaiRoutesHandler(osmium.SimpleHandler):
 
     def way(self, way):
         """Function to parse ways"""
-        self.members[way.id] = []
-        self.ways[way.id] = {}
+        self.callbacks += 1
+        self.members[way.id] = array("q")
         try:
-            self.ways[way.id]["geom"] = WKTFAB.create_linestring(way)
+            self.geoms.add_way(way)
         except Exception:
             print("Error creating geometry for way {}".format(way.id))
         tags = {"id": way.id}
-        for p in way.tags:
-            tags[p.k] = p.v
-        self.ways[way.id]["tags"] = tags
+        tags.update(copy_tags(way.tags, self.waytags))
+        self.ways[way.id] = Way(tags)
 
     def relation(self, rel):
         """Function to parse relations"""
+        self.callbacks += 1
         members = []
-        tags = {}
         for mem in rel.members:
             if mem.type == "w":
                 members.append(mem.ref)
-        for t in rel.tags:
-            tags[t.k] = t.v
+        tags = copy_tags(rel.tags, self.reltags)
         tags["id"] = rel.id
         self.count += 1
-        self.routes[rel.id] = {"tags": tags, "elems": members}
+        self.routes[rel.id] = Route(tags, members)
+
+    def apply_elements(self, elements):
+        """Function to parse the elements of an Overpass JSON response with
+        relations and ways downloaded with 'out geom'. The geometry of ways
+        is created from the embedded coordinates, nodes and the location
+        index are not needed
+
+        :param list elements: the list of elements of the JSON response
+        """
+        rels = []
+        for elem in elements:
+            if elem["type"] == "relation":
+                rels.append(elem)
+            elif elem["type"] == "way" and elem["id"] not in self.ways:
+                self.members[elem["id"]] = array("q")
+                try:
+                    self.geoms.add_elements(elem["id"], elem.get("geometry") or [])
+                except Exception:
+                    print("Error creating geometry for way {}".format(elem["id"]))
+                tags = {"id": elem["id"]}
+                if self.waytags is None:
+                    tags.update(elem.get("tags", {}))
+                else:
+                    tags.update(copy_tags(elem.get("tags", {}), self.waytags))
+                self.ways[elem["id"]] = Way(tags)
+        # relations after ways like in a sorted OSM file
+        for rel in rels:
+            if rel["id"] in self.routes:
+                continue
+            members = []
+            for mem in rel.get("members", []):
+                if mem["type"] == "way":
+                    members.append(mem["ref"])
+            if self.reltags is None:
+                tags = dict(rel.get("tags", {}))
+            else:
+                tags = copy_tags(rel.get("tags", {}), self.reltags)
+            tags["id"] = rel["id"]
+            self.count += 1
+            self.routes[rel["id"]] = Route(tags, members)
+        return True
+
+    def subset(self, ids, infomont=None):
+        """Return a new CaiRoutesHandler with only the selected routes and
+        their ways
+
+        :param list ids: the ids of the routes to keep
+        :param bool infomont: if the output should follow Infomont format,
+                              by default the value of this instance
+        """
+        if infomont is None:
+            infomont = self.infomont
+        output = CaiRoutesHandler(
+            separator=self.sep, infomont=infomont, debug=self.debug
+        )
+        for rid in ids:
+            route = self.routes[rid]
+            output.routes[rid] = route.copy()
+            output.count += 1
+            for w in route.elems:
+                if w in self.ways:
+                    output.ways[w] = self.ways[w]
+                    output.members[w] = array("q")
+        output.geoms = self.geoms.subset(output.ways.keys())
+        return output
 
     def _create_schema(self, typ):
         """Create the schema for geojson output
@@ -184,131 +294,157 @@ class CaiRoutesHandler(osmium.SimpleHandler):
             print("In create schema")
         if typ == "route":
             for v in self.routes.values():
-                if set(outdict.keys()) != set(v["tags"].keys()):
-                    for t in v["tags"].keys():
+                if set(outdict.keys()) != set(v.tags.keys()):
+                    for t in v.tags.keys():
                         if t not in outdict.keys():
                             outdict[t] = "str"
             self.route_schema["properties"] = outdict
         if typ == "way":
             for v in self.ways.values():
-                if set(outdict.keys()) != set(v["tags"].keys()):
-                    for t in v["tags"].keys():
+                if set(outdict.keys()) != set(v.tags.keys()):
+                    for t in v.tags.keys():
                         if t not in outdict.keys():
                             outdict[t] = "str"
             self.way_schema["properties"] = outdict
 
+    def lengths(self, epsg="EPSG:3035", regions=None):
+        """Function to return with a single pass the length of each route,
+        of each region and the total length of routes, in meters. A way
+        shared by several routes is counted once in the totals
+
+        :param str epsg: the EPSG code string to use
+        :param dict regions: a dictionary with region name as key and the
+                             list of its route ids as value
+        """
+        waylen = self.geoms.way_lengths(epsg)
+        routes = {}
+        for k, v in self.routes.items():
+            routes[k] = sum([waylen.get(w, 0) for w in set(v.elems)])
+        wayids = set()
+        for v in self.routes.values():
+            wayids.update(v.elems)
+        output = {
+            "routes": routes,
+            "total": sum([waylen.get(w, 0) for w in wayids]),
+            "regions": {},
+        }
+        for reg, rids in (regions or {}).items():
+            wayids = set()
+            for rid in rids:
+                wayids.update(self.routes[rid].elems)
+            output["regions"][reg] = sum([waylen.get(w, 0) for w in wayids])
+        return output
+
     def length(self, epsg="EPSG:3035", unit="m"):
         """Function to return the total lenght of routes
 
         :param str epsg: the EPSG code string to use
         """
-        project = partial(
-            pyproj.transform, pyproj.Proj(init="EPSG:4326"), pyproj.Proj(init=epsg)
-        )
-        alreadid = []
-        # for each route
-        total = 0
+        return round_length(self.lengths(epsg)["total"], unit)
+
+    def build_members(self):
+        """Function to build once the index with the routes of each way"""
+        if self.indexed:
+            return self.members
+        for w in self.members.keys():
+            self.members[w] = array("q")
         for k, v in self.routes.items():
-            lines = []
-            # for each member of the route crea a linea and append to the list
-            for w in v["elems"]:
-                if w not in alreadid:
-                    lines.append(wktlib.loads(self.ways[w]["geom"]))
-                    alreadid.append(w)
-            # create the geometry
-            geom = MultiLineString(lines)
-            geomm = transform(project, geom)
-            # sum to total
-            total += geomm.length
-        if unit == "km":
-            total = round(round(total) / 1000, 1)
-        elif unit == "m":
-            total = round(total)
-        else:
-            print("Unit not supported, reported in meters")
-        return total
+            for w in v.elems:
+                rels = self.members.setdefault(w, array("q"))
+                if k not in rels:
+                    rels.append(k)
+        self.indexed = True
+        return self.members
 
-    def create_routes_geojson(self):
-        """Function to create GeoJSON geometries for routes"""
-        feats = []
-        for k, v in self.routes.items():
-            lines = []
-            for w in v["elems"]:
-                self.members[w].append(k)
-                lines.append(wktlib.loads(self.ways[w]["geom"]))
-            geom = MultiLineString(lines)
-            self.routes[k]["geom"] = geom
-            tags = self.routes[k]["tags"]
-            tagskey = sorted(tags.keys())
-            # run operations to be compliant with infomont format
-            if self.infomont:
-                outags = OrderedDict()
-                for new, old in ROUTE_FIELD.items():
-                    if old in tagskey:
-                        outags[new] = tags[old]
-                    else:
-                        outags[new] = ""
-                # check the symbol
-                # if one of the tags exists check it/them; otherwise set 001
-                if (
-                    "symbol" in tagskey
-                    or "symbol:it" in tagskey
-                    or "osmc:symbol" in tagskey
-                ):
-                    # check the tags in order
-                    if "osmc:symbol" in tagskey:
-                        if (
-                            "red:red:white_stripe" in tags["osmc:symbol"]
-                            or "red:red:white_bar" in tags["osmc:symbol"]
-                        ):
-                            if ";" in tags["osmc:symbol"]:
-                                outags["segni"] = "004"
-                            else:
-                                outags["segni"] = "002"
+    def _route_properties(self, tags):
+        """Private function to return the properties of a route feature
+
+        :param dict tags: the tags of the route
+        """
+        tagskey = sorted(tags.keys())
+        # run operations to be compliant with infomont format
+        if self.infomont:
+            outags = OrderedDict()
+            for new, old in ROUTE_FIELD.items():
+                if old in tagskey:
+                    outags[new] = tags[old]
+                else:
+                    outags[new] = ""
+            # check the symbol
+            # if one of the tags exists check it/them; otherwise set 001
+            if (
+                "symbol" in tagskey
+                or "symbol:it" in tagskey
+                or "osmc:symbol" in tagskey
+            ):
+                # check the tags in order
+                if "osmc:symbol" in tagskey:
+                    if (
+                        "red:red:white_stripe" in tags["osmc:symbol"]
+                        or "red:red:white_bar" in tags["osmc:symbol"]
+                    ):
+                        if ";" in tags["osmc:symbol"]:
+                            outags["segni"] = "004"
                         else:
-                            outags["segni"] = "003"
-                    elif "symbol" in tagskey:
-                        if "unmarked" in tags["symbol"]:
-                            outags["segni"] = "001"
-                        elif "white red flag" in tags["symbol"]:
-                            if ";" in tags["symbol"]:
-                                outags["segni"] = "004"
-                            else:
-                                outags["segni"] = "002"
+                            outags["segni"] = "002"
+                    else:
+                        outags["segni"] = "003"
+                elif "symbol" in tagskey:
+                    if "unmarked" in tags["symbol"]:
+                        outags["segni"] = "001"
+                    elif "white red flag" in tags["symbol"]:
+                        if ";" in tags["symbol"]:
+                            outags["segni"] = "004"
                         else:
-                            outags["segni"] = "003"
-                    elif "symbol:it" in tagskey:
-                        if "non segnalato" in tags["symbol:it"]:
-                            outags["segni"] = "001"
-                        elif (
-                            "su bandierina bianca e rossa" in tags["symbol:it"]
-                            or "segnavia bianco e rosso" in tags["symbol:it"]
-                        ):
-                            if ";" in tags["symbol:it"]:
-                                outags["segni"] = "004"
-                            else:
-                                outags["segni"] = "002"
+                            outags["segni"] = "002"
+                    else:
+                        outags["segni"] = "003"
+                elif "symbol:it" in tagskey:
+                    if "non segnalato" in tags["symbol:it"]:
+                        outags["segni"] = "001"
+                    elif (
+                        "su bandierina bianca e rossa" in tags["symbol:it"]
+                        or "segnavia bianco e rosso" in tags["symbol:it"]
+                    ):
+                        if ";" in tags["symbol:it"]:
+                            outags["segni"] = "004"
                         else:
-                            outags["segni"] = "003"
-                else:
-                    outags["segni"] = "001"
+                            outags["segni"] = "002"
+                    else:
+                        outags["segni"] = "003"
             else:
-                outags = tags
-            feats.append(geojson.Feature(geometry=mapping(geom), properties=outags))
-            self.gjson = geojson.FeatureCollection(feats)
+                outags["segni"] = "001"
+        else:
+            outags = tags
+        return outags
+
+    def iter_routes_geojson(self):
+        """Function to yield the GeoJSON features of routes one at a time,
+        without keeping them in memory"""
+        self.build_members()
+        for v in self.routes.values():
+            geom = MultiLineString([self.geoms.linestring(w) for w in v.elems])
+            yield geojson.Feature(
+                geometry=mapping(geom), properties=self._route_properties(v.tags)
+            )
+
+    def create_routes_geojson(self):
+        """Function to create the GeoJSON FeatureCollection of routes"""
+        self.gjson = geojson.FeatureCollection(list(self.iter_routes_geojson()))
+        return self.gjson
 
     def create_way_geojson(self, prefix=None):
         """Function to create GeoJSON geometries for ways"""
         features = []
         for k, v in self.ways.items():
-            geom = LineString(wktlib.loads(v["geom"]))
+            geom = self.geoms.linestring(k)
             if self.debug:
                 print(v)
             # run operations to be compliant with infomont format
             if self.infomont:
                 outags = OrderedDict([("osm_id_way", k)])
                 try:
-                    highway = v["tags"]["highway"]
+                    highway = v.tags["highway"]
                 except KeyError:
                     print("way {} without highway tag".format(k))
                     highway = None
@@ -328,8 +464,8 @@ class CaiRoutesHandler(osmium.SimpleHandler):
                         print(highway)
                 # check if the highway has surface tag, if it exist use it
                 # otherwise use highway tag to set the surface
-                if "surface" in v["tags"].keys():
-                    surface = v["tags"]["surface"]
+                if "surface" in v.tags.keys():
+                    surface = v.tags["surface"]
                     if surface in ASPHALT_SURFACE:
                         outags["CARATTER"] = "01"
                     elif surface in OFFROAD_SURFACE:
@@ -346,9 +482,9 @@ class CaiRoutesHandler(osmium.SimpleHandler):
                     if highway == "via_ferrata":
                         outags["CARATTER"] = "00"
                     elif highway == "footway":
-                        if "footway" in v["tags"].keys():
+                        if "footway" in v.tags.keys():
                             outags["CARATTER"] = "01"
-                        elif "sidewalk" in v["tags"].keys():
+                        elif "sidewalk" in v.tags.keys():
                             outags["CARATTER"] = "01"
                         else:
                             outags["CARATTER"] = "02"
@@ -362,7 +498,7 @@ class CaiRoutesHandler(osmium.SimpleHandler):
                         outags["CARATTER"] = ""
                 outags
             else:
-                outags = v["tags"]
+                outags = v.tags
 
             feat = geojson.Feature(geometry=mapping(geom), properties=outags)
             features.append(feat)
@@ -436,14 +572,19 @@ class CaiRoutesHandler(osmium.SimpleHandler):
             if typ == "route":
                 if self.debug:
                     print("In route")
-                if not self.gjson:
-                    self.create_routes_geojson()
-                if not self.gjson or len(self.gjson["features"]) == 0:
+                # features are created while they are written
+                if self.gjson:
+                    feats = self.gjson["features"]
+                else:
+                    feats = self.iter_routes_geojson()
+                count = 0
+                for feat in feats:
+                    self._write_feature(f, feat, epsg, project, schema)
+                    count += 1
+                if count == 0:
                     raise Exception("No routes found")
                 if self.debug:
-                    print("Number of route {}".format(len(self.gjson["features"])))
-                for feat in self.gjson["features"]:
-                    self._write_feature(f, feat, epsg, project, schema)
+                    print("Number of route {}".format(count))
             elif typ == "way":
                 if self.debug:
                     print("In way")
@@ -474,6 +615,7 @@ class CaiRoutesHandler(osmium.SimpleHandler):
         :param str out: the path to the output CSV file
         """
         outext = "IDPerc{}IDtrat\n".format(self.sep)
+        self.build_members()
         for feat in self.wjson["features"]:
             osmid = feat["properties"]["osm_id_way"]
             newid = feat["properties"]["IDTrat"]
@@ -489,6 +631,7 @@ class CaiRoutesHandler(osmium.SimpleHandler):
         members as comma separated values
         """
         features = []
+        self.build_members()
         for feat in self.wjson["features"]:
             osmid = feat["properties"]["osm_id_way"]
             newid = feat["properties"]["IDTrat"]
@@ -508,6 +651,19 @@ class CaiRoutesHandler(osmium.SimpleHandler):
         WriteDictToCSV(out, ROUTE_COLUMNS, self.routes)
 
 
+def infomont_handler(infomont=False):
+    """Return a CaiRoutesHandler, with Infomont format only the tags of
+    routes and ways used by the Infomont outputs are copied
+
+    :param bool infomont: if the output should follow Infomont format
+    """
+    if infomont:
+        return CaiRoutesHandler(
+            infomont=True, reltags=INFOMONT_TAGS, waytags=INFOMONT_WAY_TAGS
+        )
+    return CaiRoutesHandler()
+
+
 class CaiStatsHandler(osmium.SimpleHandler):
     """Class to parse stats about CAI routes"""
 
@@ -563,6 +719,6 @@ class CaiStatsHandler(osmium.SimpleHandler):
                 if mem.type == "w":
                     members.append(mem.ref)
             tags["id"] = rel.id
-            self.routes[rel.id] = {"tags": tags, "elems": members}
+            self.routes[rel.id] = Route(tags, members)
         else:
             return
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:02:37 2026
+
+@author: lucadelu
+"""
+
+# the geometry needed by an output, from the cheapest to the most expensive
+# - None: no geometry, only the relations
+# - members: the members of the relations without their geometry
+# - geom: the geometry of the ways, downloaded with 'out geom'
+# - full: the ways and their nodes, required to write OSM data
+GEOMETRY_LEVELS = [None, "members", "geom", "full"]
+
+# Overpass output statements of each mode
+OUT_STATEMENTS = {
+    "ids": "out ids;",
+    "csv": "out;",
+    "tags": "out tags;",
+    "skel": "out skel;",
+    "body": "out;",
+    "geom": "out;\nway(r);\nout geom;",
+    "full": "out;\n>;\nout qt;",
+}
+
+# the csv column with the id of the elements
+ID_COLUMN = "::id"
+
+
+def parse_columns(tags):
+    """Return the list of columns of an Overpass csv declaration like
+    '::id,"name","ref"'
+
+    :param str tags: the csv columns separated by comma
+    """
+    return [col.strip().strip('"') for col in tags.split(",") if col.strip()]
+
+
+class QueryPlan:
+    """Class to collect the fields and the geometry needed by one or more
+    outputs and to choose the cheapest Overpass output mode satisfying all
+    of them"""
+
+    def __init__(self, fields=None, geometry=None):
+        """Inizialize
+
+        :param list fields: the keys of the relation tags needed, '::id' for
+                            the id of the relation, True for all the tags
+        :param str geometry: the geometry needed, one of GEOMETRY_LEVELS
+        """
+        self.fields = []
+        self.alltags = False
+        self.geometry = None
+        self.require(fields, geometry)
+
+    def __repr__(self):
+        return "QueryPlan(mode={}, fields={})".format(self.mode(), self.tags())
+
+    def require(self, fields=None, geometry=None):
+        """Add the requirements of an output to the plan
+
+        :param list fields: the keys of the relation tags needed, '::id' for
+                            the id of the relation, True for all the tags
+        :param str geometry: the geometry needed, one of GEOMETRY_LEVELS
+        """
+        if geometry not in GEOMETRY_LEVELS:
+            raise ValueError(
+                "Geometry must be one of {}".format(
+                    ", ".join([str(lev) for lev in GEOMETRY_LEVELS])
+                )
+            )
+        if fields is True:
+            self.alltags = True
+        elif fields:
+            for field in fields:
+                if field not in self.fields:
+                    self.fields.append(field)
+        if GEOMETRY_LEVELS.index(geometry) > GEOMETRY_LEVELS.index(self.geometry):
+            self.geometry = geometry
+        return self
+
+    def merge(self, other):
+        """Add the requirements of another plan, the plan is returned to
+        chain several merges
+
+        :param obj other: the QueryPlan to merge
+        """
+        self.require(True if other.alltags else other.fields, other.geometry)
+        return self
+
+    def covers(self, other):
+        """Return True if the data downloaded with this plan satisfy also the
+        other plan
+
+        :param obj other: the QueryPlan to check
+        """
+        if GEOMETRY_LEVELS.index(other.geometry) > GEOMETRY_LEVELS.index(
+            self.geometry
+        ):
+            return False
+        if self.mode() in ["geom", "full", "body", "tags"]:
+            # all the tags are downloaded
+            return True
+        if other.alltags:
+            return False
+        return all([field in self.fields for field in other.fields])
+
+    def tags(self):
+        """Return the keys of the tags needed, None when all the tags are
+        needed"""
+        if self.alltags:
+            return None
+        return [field for field in self.fields if field != ID_COLUMN]
+
+    def mode(self):
+        """Return the cheapest Overpass output mode for the plan, one of
+        the keys of OUT_STATEMENTS"""
+        if self.geometry in ["geom", "full"]:
+            return self.geometry
+        if self.geometry == "members":
+            if self.alltags or self.tags():
+                return "body"
+            return "skel"
+        if self.alltags:
+            return "tags"
+        if self.tags():
+            return "csv"
+        return "ids"
+
+    def csv(self):
+        """Return True if the plan is satisfied by the csv output, only
+        fields of relations are needed"""
+        return bool(self.fields) and self.mode() in ["csv", "ids"]
+
+    def columns(self):
+        """Return the csv columns declaration for Overpass"""
+        return ",".join(
+            [
+                field if field.startswith("::") else '"{}"'.format(field)
+                for field in self.fields
+            ]
+        )
+
+    def output(self):
+        """Return the Overpass output statements for the plan"""
+        return OUT_STATEMENTS[self.mode()]
+
+    def settings(self, header=False, separator="|", out_format="json"):
+        """Return the Overpass output setting for the plan
+
+        :param bool header: show the csv header
+        :param str separator: the csv separator
+        :param str out_format: the format used when csv is not possible,
+                               json or xml
+        """
+        if self.csv():
+            return '[out:csv({cols};{head};"{sep}")]'.format(
+                cols=self.columns(), head=str(header).lower(), sep=separator
+            )
+        return "[out:{}]".format(out_format)
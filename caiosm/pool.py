@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:36:02 2026
+
+@author: lucadelu
+"""
+import time
+import threading
+import requests
+from .connection import request
+from .connection import write_response
+from .connection import CHUNK_SIZE
+from .scheduler import OverpassScheduler
+
+# HTTP status codes that move the query to another endpoint
+FAILOVER_CODES = [429, 500, 502, 503, 504]
+# weight of the last request in the latency moving average
+LATENCY_WEIGHT = 0.3
+
+
+class OverpassEndpoint:
+    """Class to keep the statistics of an Overpass endpoint"""
+
+    def __init__(self, url, scheduler=None, slots=2, debug=False):
+        """Inizialize
+
+        :param str url: the url of the Overpass interpreter
+        :param obj scheduler: an OverpassScheduler instance for the endpoint
+        :param int slots: the maximum number of parallel queries
+        :param bool debug: print debug information
+        """
+        self.url = url
+        if scheduler is None:
+            scheduler = OverpassScheduler(url=url, debug=debug)
+        self.scheduler = scheduler
+        self.slots = slots
+        self.running = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.latency = None
+        self.disabled_until = 0
+
+    def score(self):
+        """Return the score of the endpoint, lower is better"""
+        latency = self.latency if self.latency is not None else 1.0
+        return latency * (1 + self.failures) * (1 + self.running)
+
+    def available(self, now=None):
+        """Return True if the endpoint could receive a new query
+
+        :param float now: the current time
+        """
+        if now is None:
+            now = time.time()
+        return self.running < self.slots and now >= self.disabled_until
+
+    def success(self, elapsed):
+        """Register a successful request
+
+        :param float elapsed: the seconds to get the response
+        """
+        self.requests += 1
+        self.failures = 0
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = (
+                LATENCY_WEIGHT * elapsed + (1 - LATENCY_WEIGHT) * self.latency
+            )
+
+    def failure(self, cooldown, maxwait=600):
+        """Register a failed request, the endpoint is not used for a time
+        growing with the consecutive failures
+
+        :param int cooldown: the seconds to disable the endpoint after the
+                             first failure
+        :param int maxwait: the maximum seconds to disable the endpoint
+        """
+        self.requests += 1
+        self.errors += 1
+        self.failures += 1
+        wait = min(cooldown * 2 ** (self.failures - 1), maxwait)
+        self.disabled_until = time.time() + wait
+
+    def stats(self):
+        """Return a dictionary with the statistics of the endpoint"""
+        return {
+            "url": self.url,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency": self.latency,
+            "waited": self.scheduler.waited,
+        }
+
+
+class PooledResponse:
+    """Class wrapping the response of an endpoint, the slot of the endpoint
+    is held until the body is read or the response is closed, so the limit
+    of parallel queries and the latency include the download of the data"""
+
+    def __init__(self, pool, end, resp, start):
+        """Inizialize
+
+        :param obj pool: the OverpassPool instance
+        :param obj end: the OverpassEndpoint instance
+        :param obj resp: the requests response object
+        :param float start: the time when the query was sent
+        """
+        self.pool = pool
+        self.endpoint = end
+        self.resp = resp
+        self.start = start
+        self.released = False
+
+    def __getattr__(self, name):
+        return getattr(self.resp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        """Yield the chunks of the body, a failed read is registered as an
+        error of the endpoint
+
+        :param int chunk_size: the size of the chunks
+        """
+        try:
+            for data in self.resp.iter_content(chunk_size=chunk_size):
+                yield data
+        except requests.RequestException as e:
+            self.close(error=e)
+            raise
+        self.close(done=True)
+
+    @property
+    def content(self):
+        """The body of the response as bytes"""
+        return b"".join(self.iter_content())
+
+    @property
+    def text(self):
+        """The body of the response decoded"""
+        content = self.content
+        return content.decode(self.resp.encoding or "utf-8", errors="ignore")
+
+    def close(self, done=False, error=None):
+        """Close the response and release the slot of the endpoint
+
+        :param bool done: True if the whole body was read
+        :param obj error: the exception raised reading the body
+        """
+        self.resp.close()
+        if self.released:
+            return
+        self.released = True
+        if error is not None:
+            self.pool._release(self.endpoint, error=error)
+        elif done:
+            self.pool._release(self.endpoint, time.time() - self.start)
+        else:
+            # the body was not read, the endpoint result is unknown
+            self.pool._release(self.endpoint)
+
+
+class OverpassPool:
+    """Class to send queries to a pool of Overpass endpoints, the queries
+    are routed to the healthiest endpoint and moved to another one when
+    an endpoint fails"""
+
+    def __init__(
+        self,
+        urls=("http://overpass-api.de/api/interpreter?",),
+        scheduler=None,
+        slots=2,
+        maxretries=5,
+        cooldown=60,
+        maxwait=600,
+        debug=False,
+    ):
+        """Inizialize
+
+        :param list urls: the urls of the Overpass interpreters
+        :param obj scheduler: an OverpassScheduler instance, used only with a
+                              single url
+        :param int slots: the maximum number of parallel queries for each
+                          endpoint
+        :param int maxretries: the number of retries for a query
+        :param int cooldown: the seconds to disable an endpoint after a
+                             failure
+        :param int maxwait: the maximum seconds of a single wait
+        :param bool debug: print debug information
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        if not urls:
+            raise ValueError("At least one Overpass url is required")
+        if scheduler and len(urls) > 1:
+            raise ValueError("scheduler is supported only with a single url")
+        self.endpoints = []
+        for url in urls:
+            if scheduler is None:
+                sched = OverpassScheduler(url=url, maxwait=maxwait, debug=debug)
+            else:
+                sched = scheduler
+            self.endpoints.append(
+                OverpassEndpoint(url, scheduler=sched, slots=slots, debug=debug)
+            )
+        self.maxretries = maxretries
+        self.cooldown = cooldown
+        self.maxwait = maxwait
+        self.debug = debug
+        self.idle = 0
+        self.condition = threading.Condition()
+
+    @property
+    def url(self):
+        """The url of the first endpoint"""
+        return self.endpoints[0].url
+
+    @property
+    def waited(self):
+        """The total seconds waited for free slots and healthy endpoints"""
+        return self.idle + sum(end.scheduler.waited for end in self.endpoints)
+
+    def stats(self):
+        """Return a list of dictionary with the statistics of each endpoint"""
+        return [end.stats() for end in self.endpoints]
+
+    def _acquire(self):
+        """Wait for an available endpoint and return the healthiest one"""
+        with self.condition:
+            while True:
+                now = time.time()
+                ends = [end for end in self.endpoints if end.available(now)]
+                if ends:
+                    end = min(ends, key=lambda end: end.score())
+                    end.running += 1
+                    return end
+                # all the endpoints are busy or disabled
+                wakeup = [
+                    end.disabled_until
+                    for end in self.endpoints
+                    if end.running < end.slots
+                ]
+                timeout = max(min(wakeup) - now, 0.1) if wakeup else None
+                self.condition.wait(timeout)
+                self.idle += time.time() - now
+
+    def _release(self, end, elapsed=None, error=None):
+        """Release an endpoint and register the result of the request
+
+        :param obj end: the OverpassEndpoint instance
+        :param float elapsed: the seconds of the successful request
+        :param obj error: the exception raised by the failed request
+        """
+        with self.condition:
+            end.running -= 1
+            if error is not None:
+                # a single endpoint is never disabled, the scheduler backoff
+                # is used instead
+                if len(self.endpoints) > 1:
+                    end.failure(self.cooldown, self.maxwait)
+                else:
+                    end.failure(0)
+            elif elapsed is not None:
+                end.success(elapsed)
+            self.condition.notify_all()
+
+    def _failover(self, error):
+        """Return True if the error should move the query to another endpoint
+
+        :param obj error: the requests exception raised by the query
+        """
+        if isinstance(error, requests.HTTPError):
+            return error.response.status_code in FAILOVER_CODES
+        # a connection reset while the body is read raises
+        # ChunkedEncodingError
+        return isinstance(
+            error,
+            (
+                requests.Timeout,
+                requests.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+            ),
+        )
+
+    def _retry(self, end, error, attempt):
+        """Private function to check if a failed query is sent again, with a
+        single endpoint it waits the backoff of the scheduler
+
+        :param obj end: the OverpassEndpoint instance that failed
+        :param obj error: the requests exception raised by the query
+        :param int attempt: the number of the failed attempt
+        """
+        if not self._failover(error) or attempt >= self.maxretries:
+            return False
+        if self.debug:
+            print("Error from {}: {}".format(end.url, error))
+        if len(self.endpoints) == 1:
+            end.scheduler.backoff(attempt)
+        return True
+
+    def _send(self, instr, connect_timeout=None, read_timeout=None, attempt=0):
+        """Private function to send the query to the best endpoint, it
+        returns a tuple with the PooledResponse and the number of attempts
+
+        :param str instr: the string with the overpass syntax
+        :param int connect_timeout: seconds to wait for the connection
+        :param int read_timeout: seconds to wait for data from the server
+        :param int attempt: the number of attempts already done
+        """
+        while True:
+            end = self._acquire()
+            if self.debug:
+                print("Query to {}".format(end.url))
+            try:
+                end.scheduler.wait_slot()
+                start = time.time()
+                resp = request(
+                    end.url,
+                    data={"data": instr},
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                )
+            except requests.RequestException as e:
+                self._release(end, error=e)
+                if not self._retry(end, e, attempt):
+                    raise
+                attempt += 1
+                continue
+            return PooledResponse(self, end, resp, start), attempt
+
+    def open(self, instr, connect_timeout=None, read_timeout=None):
+        """Send the query to the best endpoint and return a PooledResponse,
+        the slot of the endpoint is released when the body is read or the
+        response is closed
+
+        :param str instr: the string with the overpass syntax
+        :param int connect_timeout: seconds to wait for the connection
+        :param int read_timeout: seconds to wait for data from the server
+        """
+        return self._send(instr, connect_timeout, read_timeout)[0]
+
+    def download(self, instr, fileobj, connect_timeout=None, read_timeout=None):
+        """Send the query and write the body into a file object, if the body
+        could not be read the file is emptied and the query is sent to
+        another endpoint. It returns the size of the data
+
+        :param str instr: the string with the overpass syntax
+        :param obj fileobj: a seekable file object opened in binary mode
+        :param int connect_timeout: seconds to wait for the connection
+        :param int read_timeout: seconds to wait for data from the server
+        """
+        attempt = 0
+        while True:
+            resp, attempt = self._send(instr, connect_timeout, read_timeout, attempt)
+            try:
+                return write_response(resp, fileobj, CHUNK_SIZE)
+            except requests.RequestException as e:
+                if not self._retry(resp.endpoint, e, attempt):
+                    raise
+                fileobj.seek(0)
+                fileobj.truncate()
+                attempt += 1
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:31:48 2026
+
+@author: lucadelu
+"""
+import sys
+from array import array
+
+# values longer than this are not interned, like names and descriptions
+INTERN_SIZE = 32
+
+
+def intern_tags(tags):
+    """Return a dictionary of tags with interned keys and short values, the
+    same strings repeated in thousands of objects are stored once
+
+    :param dict tags: the tags to intern
+    """
+    output = {}
+    for k, v in tags.items():
+        if isinstance(v, str) and len(v) <= INTERN_SIZE:
+            v = sys.intern(v)
+        output[sys.intern(k)] = v
+    return output
+
+
+class Record:
+    """Base class of the OSM records, the attributes are also available as
+    dictionary items like the dictionaries used before"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            ", ".join(["{}={!r}".format(k, getattr(self, k)) for k in self.__slots__]),
+        )
+
+
+class Route(Record):
+    """Class to store a route: its tags and the ids of its member ways"""
+
+    __slots__ = ("tags", "elems")
+
+    def __init__(self, tags, elems=()):
+        """Inizialize
+
+        :param dict tags: the tags of the route, with its id
+        :param list elems: the ids of the member ways
+        """
+        self.tags = intern_tags(tags)
+        self.elems = array("q", elems)
+
+    def __setattr__(self, key, value):
+        # member ways are always stored as int64 array
+        if key == "elems" and not isinstance(value, array):
+            value = array("q", value)
+        super(Route, self).__setattr__(key, value)
+
+    def copy(self):
+        """Return a copy of the route"""
+        return Route(self.tags, self.elems)
+
+
+class Way(Record):
+    """Class to store the tags of a way, the geometry is stored in
+    WayGeometries"""
+
+    __slots__ = ("tags",)
+
+    def __init__(self, tags):
+        """Inizialize
+
+        :param dict tags: the tags of the way, with its id
+        """
+        self.tags = intern_tags(tags)
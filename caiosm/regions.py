@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:20:44 2026
+
+@author: lucadelu
+"""
+import json
+from shapely.geometry import LineString
+from shapely.ops import transform
+from shapely.prepared import prep
+from .data_from_overpass import CaiOsmBase
+from .data_from_overpass import CaiOsmRoute
+from .data_from_overpass import CaiOsmRouteDate
+from .functions import REGIONI
+from .functions import polygon_from_lines
+from .functions import strtree_index
+from .functions import strtree_query
+from .functions import round_length
+from .geometries import transformer
+
+
+def boundary_polygon(members):
+    """Return a shapely polygon from the members of a boundary relation
+    downloaded with 'out geom'
+
+    :param list members: the list of members of the relation
+    """
+    outers = []
+    inners = []
+    for mem in members:
+        if mem["type"] != "way" or "geometry" not in mem.keys():
+            continue
+        coords = [(pt["lon"], pt["lat"]) for pt in mem["geometry"] if pt]
+        if len(coords) < 2:
+            continue
+        if mem["role"] == "inner":
+            inners.append(LineString(coords))
+        else:
+            outers.append(LineString(coords))
+    return polygon_from_lines(outers, inners)
+
+
+class CaiOsmRegions(CaiOsmBase):
+    """Class to download with a single query the CAI routes of a country
+    and split them by region locally"""
+
+    def __init__(
+        self, regions=REGIONI.keys(), area="Italia", startdate=None, **kwargs
+    ):
+        """Inizialize
+
+        :param list regions: a list of region to process, by default all
+                             Italian regions
+        :param str area: the name of the area containing all the regions
+        :param str startdate: a date in format YYYY-MM-DD to get the data at
+                              that date, by default the current data
+        :param kwargs: the parameters of CaiOsmBase, like cache and pool
+        """
+        super(CaiOsmRegions, self).__init__(area=area, **kwargs)
+        self.regions = list(regions)
+        kwargs["pool"] = self.pool
+        if startdate:
+            self.cor = CaiOsmRouteDate(startdate=startdate, area=area, **kwargs)
+        else:
+            self.cor = CaiOsmRoute(area=area, **kwargs)
+        self.cch = None
+        self.boundaries = None
+        self.assigned = None
+
+    def get_boundaries(self, adminlevel=4):
+        """Download the boundaries of the regions and return a dictionary
+        with region name and shapely polygon
+
+        :param int adminlevel: the admin_level of the regions
+        """
+        if self.boundaries:
+            return self.boundaries
+        instr = """[timeout:{time}][out:json]
+;
+{area}
+relation
+  ["boundary"="administrative"]
+  ["admin_level"="{lev}"]
+  (area.a);
+out geom;""".format(
+            time=self.timeout, area=self._area(), lev=adminlevel
+        )
+        data = json.loads(self._get_data(instr))
+        self.boundaries = {}
+        for elem in data["elements"]:
+            name = elem.get("tags", {}).get("name")
+            if name in self.regions:
+                self.boundaries[name] = boundary_polygon(elem["members"])
+        missing = set(self.regions) - set(self.boundaries.keys())
+        if missing:
+            raise ValueError(
+                "Boundaries not found for regions: {}".format(", ".join(missing))
+            )
+        return self.boundaries
+
+    def get_cairoutehandler(self, network="lwn"):
+        """Function to download osm data of the whole area and create
+        CaiRoutesHandler instance
+
+        :param str network: the network level to query, default 'lwn'
+        """
+        self.cor.get_cairoutehandler(network=network)
+        self.cch = self.cor.cch
+        return True
+
+    def assign(self, network="lwn", epsg="EPSG:3035"):
+        """Assign ways and routes to the regions and compute the length of
+        ways clipped with regional boundaries. It returns a dictionary with
+        region name as key and a dictionary with routes ids and ways lengths
+        as value
+
+        :param str network: the network level to query, default 'lwn'
+        :param str epsg: the EPSG code string to use for lengths
+        """
+        if self.assigned:
+            return self.assigned
+        if self.cch is None:
+            self.get_cairoutehandler(network=network)
+        self.get_boundaries()
+        # the ways are reprojected all together by the geometries store
+        project = transformer(epsg).transform
+        wayids = [w for w in self.cch.ways.keys() if w in self.cch.geoms]
+        geoms = [self.cch.geoms.linestring(w, epsg) for w in wayids]
+        tree, index = strtree_index(geoms)
+        self.assigned = {}
+        for reg in self.regions:
+            poly = transform(project, self.boundaries[reg])
+            prepoly = prep(poly)
+            lengths = {}
+            for i in strtree_query(tree, index, poly):
+                geom = geoms[i]
+                if prepoly.contains(geom):
+                    lengths[wayids[i]] = geom.length
+                elif prepoly.intersects(geom):
+                    lengths[wayids[i]] = geom.intersection(poly).length
+            routes = []
+            for rid, route in self.cch.routes.items():
+                for w in route.elems:
+                    if w in lengths.keys():
+                        routes.append(rid)
+                        break
+            self.assigned[reg] = {"routes": routes, "ways": lengths}
+            if self.debug:
+                print("{}: {} routes".format(reg, len(routes)))
+        return self.assigned
+
+    def get_region_handler(self, region, infomont=False, network="lwn"):
+        """Return a CaiRoutesHandler with the routes of a region
+
+        :param str region: the name of the region
+        :param bool infomont: if the output should follow Infomont format
+        :param str network: the network level to query, default 'lwn'
+        """
+        assigned = self.assign(network=network)
+        return self.cch.subset(assigned[region]["routes"], infomont=infomont)
+
+    def lengths(self, unit="km", network="lwn"):
+        """Return a dictionary with region name as key and a tuple with the
+        length of the routes inside the region and the number of routes
+
+        :param str unit: the unit of the length, km or m
+        :param str network: the network level to query, default 'lwn'
+        """
+        output = {}
+        for reg, values in self.assign(network=network).items():
+            total = round_length(sum(values["ways"].values()), unit)
+            output[reg] = (total, len(values["routes"]))
+        return output
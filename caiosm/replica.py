@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:05:31 2026
+
+@author: lucadelu
+"""
+import os
+import json
+import sqlite3
+from datetime import datetime
+import osmium
+from .data_from_pbf import CaiOsmRoutePbf
+from .data_from_pbf import PbfNodesHandler
+from .data_from_pbf import PbfRelationsHandler
+from .data_from_pbf import PbfWaysHandler
+from .data_from_pbf import apply_reader
+from .data_from_pbf import route_filter
+from .geometries import WayGeometries
+from .records import Route
+from .records import Way
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS routes (id INTEGER PRIMARY KEY, tags TEXT, members TEXT);
+CREATE TABLE IF NOT EXISTS ways (id INTEGER PRIMARY KEY, tags TEXT, nodes TEXT);
+CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, lon REAL, lat REAL);
+CREATE TABLE IF NOT EXISTS route_ways (
+    way INTEGER, route INTEGER, PRIMARY KEY (way, route)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS way_nodes (
+    node INTEGER, way INTEGER, PRIMARY KEY (node, way)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (
+    route INTEGER, action TEXT, source TEXT, applied TEXT
+);
+CREATE TABLE IF NOT EXISTS missing (
+    type TEXT, id INTEGER, PRIMARY KEY (type, id)
+) WITHOUT ROWID;
+"""
+# number of nodes inserted together during the import
+NODES_BATCH = 100000
+
+
+class ChangesHandler(osmium.SimpleHandler):
+    """Class to read the last version of the objects of an OSM change file"""
+
+    def __init__(self):
+        """Inizialize"""
+        osmium.SimpleHandler.__init__(self)
+        self.relations = {}
+        self.ways = {}
+        self.nodes = {}
+        self.versions = {}
+
+    def _newer(self, typ, obj):
+        """Return True if the object is newer than the stored one
+
+        :param str typ: the type of the object
+        :param obj obj: the osmium object
+        """
+        key = (typ, obj.id)
+        if self.versions.get(key, -1) > obj.version:
+            return False
+        self.versions[key] = obj.version
+        return True
+
+    def node(self, node):
+        """Function to parse nodes"""
+        if not self._newer("n", node):
+            return
+        if node.deleted or not node.location.valid():
+            self.nodes[node.id] = None
+        else:
+            self.nodes[node.id] = (node.location.lon, node.location.lat)
+
+    def way(self, way):
+        """Function to parse ways"""
+        if not self._newer("w", way):
+            return
+        if way.deleted:
+            self.ways[way.id] = None
+        else:
+            tags = {t.k: t.v for t in way.tags}
+            self.ways[way.id] = (tags, [n.ref for n in way.nodes])
+
+    def relation(self, rel):
+        """Function to parse relations"""
+        if not self._newer("r", rel):
+            return
+        if rel.deleted:
+            self.relations[rel.id] = None
+        else:
+            tags = {t.k: t.v for t in rel.tags}
+            members = [mem.ref for mem in rel.members if mem.type == "w"]
+            self.relations[rel.id] = (tags, members)
+
+
+class NodesWriter:
+    """Class to insert in the replica the locations of nodes, it is used as
+    osmium index by PbfNodesHandler"""
+
+    def __init__(self, conn):
+        """Inizialize
+
+        :param obj conn: the sqlite3 connection
+        """
+        self.conn = conn
+        self.batch = []
+
+    def set(self, nid, location):
+        """Add the location of a node
+
+        :param int nid: the id of the node
+        :param obj location: the osmium location of the node
+        """
+        self.batch.append((nid, location.lon, location.lat))
+        if len(self.batch) >= NODES_BATCH:
+            self.flush()
+
+    def flush(self):
+        """Insert the stored locations"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)", self.batch
+        )
+        self.batch = []
+        return True
+
+
+class CaiOsmReplica:
+    """Class to keep a local replica of CAI routes, their ways and nodes in
+    a SQLite database, it is created from an OSM file and updated with OSM
+    change files touching only the routes affected by the changes"""
+
+    def __init__(self, path, querytype="caiscale", debug=False):
+        """Inizialize
+
+        :param str path: the path to the SQLite database, created if missing
+        :param str querytype: the type of routes to store:
+            - hiking: all hiking routes
+            - caiscale: use the presence of cai_scale tag to filter routes
+            - source: use source=servey:CAI and source=CAI tag to filter routes
+        :param bool debug: print debug information
+        """
+        if querytype not in ["hiking", "caiscale", "source"]:
+            raise ValueError("Only hiking, caiscale, source values are supported")
+        self.path = path
+        self.debug = debug
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        stored = self.get_info("querytype")
+        if stored and stored != querytype:
+            raise ValueError(
+                "The replica {} contains {} routes, not {}".format(
+                    path, stored, querytype
+                )
+            )
+        self.querytype = querytype
+        self.select = route_filter(querytype)
+
+    def close(self):
+        """Close the connection to the database"""
+        self.conn.close()
+        return True
+
+    def get_info(self, key):
+        """Return a value of the info table or None
+
+        :param str key: the name of the value
+        """
+        row = self.conn.execute("SELECT value FROM info WHERE key=?", (key,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def _set_info(self, key, value):
+        """Private function to set a value of the info table
+
+        :param str key: the name of the value
+        :param str value: the value
+        """
+        self.conn.execute("INSERT OR REPLACE INTO info VALUES (?, ?)", (key, value))
+        return True
+
+    def _ids(self, query, value):
+        """Private function to return a list of ids from a query with one
+        parameter
+
+        :param str query: the SQL query
+        :param int value: the parameter of the query
+        """
+        return [row[0] for row in self.conn.execute(query, (value,))]
+
+    def _set_route(self, rid, tags, members, orphans):
+        """Private function to insert or update a route and its members
+
+        :param int rid: the id of the route
+        :param dict tags: the tags of the route
+        :param list members: the ids of the member ways
+        :param set orphans: the ways removed from the route are added here
+        """
+        orphans.update(self._ids("SELECT way FROM route_ways WHERE route=?", rid))
+        self.conn.execute("DELETE FROM route_ways WHERE route=?", (rid,))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO routes VALUES (?, ?, ?)",
+            (rid, json.dumps(tags), json.dumps(members)),
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO route_ways VALUES (?, ?)",
+            [(wid, rid) for wid in members],
+        )
+        return True
+
+    def _delete_route(self, rid, orphans):
+        """Private function to delete a route
+
+        :param int rid: the id of the route
+        :param set orphans: the ways of the route are added here
+        """
+        orphans.update(self._ids("SELECT way FROM route_ways WHERE route=?", rid))
+        self.conn.execute("DELETE FROM route_ways WHERE route=?", (rid,))
+        self.conn.execute("DELETE FROM routes WHERE id=?", (rid,))
+        return True
+
+    def _set_way(self, wid, tags, nodes, orphans):
+        """Private function to insert or update a way and its nodes
+
+        :param int wid: the id of the way
+        :param dict tags: the tags of the way
+        :param list nodes: the ids of the nodes of the way
+        :param set orphans: the nodes removed from the way are added here
+        """
+        orphans.update(self._ids("SELECT node FROM way_nodes WHERE way=?", wid))
+        self.conn.execute("DELETE FROM way_nodes WHERE way=?", (wid,))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ways VALUES (?, ?, ?)",
+            (wid, json.dumps(tags), json.dumps(nodes)),
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO way_nodes VALUES (?, ?)",
+            [(nid, wid) for nid in nodes],
+        )
+        return True
+
+    def _delete_way(self, wid, orphans):
+        """Private function to delete a way
+
+        :param int wid: the id of the way
+        :param set orphans: the nodes of the way are added here
+        """
+        orphans.update(self._ids("SELECT node FROM way_nodes WHERE way=?", wid))
+        self.conn.execute("DELETE FROM way_nodes WHERE way=?", (wid,))
+        self.conn.execute("DELETE FROM ways WHERE id=?", (wid,))
+        return True
+
+    def _clean(self, ways, nodes):
+        """Private function to remove the ways not used by routes and the
+        nodes not used by ways
+
+        :param set ways: the ways to check
+        :param set nodes: the nodes to check
+        """
+        for wid in ways:
+            if not self._ids("SELECT route FROM route_ways WHERE way=?", wid):
+                self._delete_way(wid, nodes)
+        for nid in nodes:
+            if not self._ids("SELECT way FROM way_nodes WHERE node=?", nid):
+                self.conn.execute("DELETE FROM nodes WHERE id=?", (nid,))
+        return True
+
+    def _update_missing(self, ways=(), nodes=()):
+        """Private function to register the ways and nodes used by the routes
+        but not stored, they are existing objects added to a route or a way
+        by a change file, so they are not in it. The objects stored or no
+        more used are removed from the register
+
+        :param list ways: the ids of the ways to check
+        :param list nodes: the ids of the nodes to check
+        """
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO missing SELECT 'w', ? WHERE NOT EXISTS "
+            "(SELECT 1 FROM ways WHERE id=?)",
+            [(wid, wid) for wid in ways],
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO missing SELECT 'n', ? WHERE NOT EXISTS "
+            "(SELECT 1 FROM nodes WHERE id=?)",
+            [(nid, nid) for nid in nodes],
+        )
+        self.conn.execute(
+            "DELETE FROM missing WHERE type='w' AND (id IN (SELECT id FROM ways) "
+            "OR id NOT IN (SELECT way FROM route_ways))"
+        )
+        self.conn.execute(
+            "DELETE FROM missing WHERE type='n' AND (id IN (SELECT id FROM nodes) "
+            "OR id NOT IN (SELECT node FROM way_nodes))"
+        )
+        return True
+
+    def import_file(self, osmfile):
+        """Create the replica from an OSM file, like a PBF extract, the
+        previous data are removed
+
+        :param str osmfile: the path to the OSM file
+        """
+        for table in ["routes", "ways", "nodes", "route_ways", "way_nodes", "missing"]:
+            self.conn.execute("DELETE FROM {}".format(table))
+        rh = PbfRelationsHandler(self.select)
+        apply_reader(osmfile, rh, osmium.osm.osm_entity_bits.RELATION, self.debug)
+        ids = set()
+        for rid, route in rh.routes.items():
+            tags = dict(route.tags)
+            tags.pop("id")
+            self._set_route(rid, tags, list(route.elems), set())
+            ids.update(route.elems)
+        wh = PbfWaysHandler(ids)
+        apply_reader(osmfile, wh, osmium.osm.osm_entity_bits.WAY, self.debug)
+        for wid, way in wh.ways.items():
+            tags = dict(way.tags)
+            tags.pop("id")
+            self._set_way(wid, tags, wh.nodes[wid], set())
+        writer = NodesWriter(self.conn)
+        nh = PbfNodesHandler(wh.node_ids(), writer)
+        apply_reader(osmfile, nh, osmium.osm.osm_entity_bits.NODE, self.debug)
+        writer.flush()
+        self._set_info("querytype", self.querytype)
+        self._set_info("source", os.path.abspath(osmfile))
+        self.conn.commit()
+        if self.debug:
+            print(
+                "Replica {} created with {} routes".format(self.path, len(rh.routes))
+            )
+        return True
+
+    def apply_changes(self, path):
+        """Apply an OSM change file, .osc or .osc.gz, to the replica. Only
+        the routes, ways and nodes already in the replica or used by the
+        changed routes are updated. It returns a dictionary with the id of
+        the changed routes and the action, create, modify or delete
+
+        :param str path: the path to the OSM change file
+        """
+        ch = ChangesHandler()
+        ch.apply_file(path)
+        changed = {}
+        orphanways = set()
+        orphannodes = set()
+        # members of the changed routes and ways, they could be missing
+        newways = set()
+        newnodes = set()
+        for rid, value in ch.relations.items():
+            exists = self._ids("SELECT id FROM routes WHERE id=?", rid)
+            if value and self.select(value[0]):
+                self._set_route(rid, value[0], value[1], orphanways)
+                newways.update(value[1])
+                changed[rid] = "modify" if exists else "create"
+            elif exists:
+                self._delete_route(rid, orphanways)
+                changed[rid] = "delete"
+        # ways and nodes after relations, new members are already known
+        for wid, value in ch.ways.items():
+            routes = self._ids("SELECT route FROM route_ways WHERE way=?", wid)
+            if not routes:
+                continue
+            if value:
+                self._set_way(wid, value[0], value[1], orphannodes)
+                newnodes.update(value[1])
+            else:
+                self._delete_way(wid, orphannodes)
+            for rid in routes:
+                changed.setdefault(rid, "modify")
+        for nid, value in ch.nodes.items():
+            ways = self._ids("SELECT way FROM way_nodes WHERE node=?", nid)
+            if not ways:
+                continue
+            if value:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)",
+                    (nid, value[0], value[1]),
+                )
+            else:
+                self.conn.execute("DELETE FROM nodes WHERE id=?", (nid,))
+            for wid in ways:
+                for rid in self._ids("SELECT route FROM route_ways WHERE way=?", wid):
+                    changed.setdefault(rid, "modify")
+        self._clean(orphanways, orphannodes)
+        self._update_missing(newways, newnodes)
+        applied = datetime.utcnow().isoformat()
+        source = os.path.basename(path)
+        self.conn.executemany(
+            "INSERT INTO changes VALUES (?, ?, ?, ?)",
+            [(rid, act, source, applied) for rid, act in sorted(changed.items())],
+        )
+        self._set_info("changes", source)
+        self.conn.commit()
+        if self.debug:
+            print("{}: {} routes changed".format(source, len(changed)))
+        return changed
+
+    def complete(self, osmfile):
+        """Store the missing ways and nodes reading them from an OSM file,
+        like a newer extract or the Overpass data of the missing objects.
+        It returns the objects still missing, see missing
+
+        :param str osmfile: the path to the OSM file
+        """
+        missing = self.missing()
+        wh = PbfWaysHandler(set(missing["ways"]))
+        apply_reader(osmfile, wh, osmium.osm.osm_entity_bits.WAY, self.debug)
+        for wid, way in wh.ways.items():
+            tags = dict(way.tags)
+            tags.pop("id")
+            self._set_way(wid, tags, wh.nodes[wid], set())
+        nodes = set(missing["nodes"]) | wh.node_ids()
+        writer = NodesWriter(self.conn)
+        nh = PbfNodesHandler(nodes, writer)
+        apply_reader(osmfile, nh, osmium.osm.osm_entity_bits.NODE, self.debug)
+        writer.flush()
+        self._update_missing(nodes=wh.node_ids())
+        self.conn.commit()
+        missing = self.missing()
+        if self.debug:
+            print(
+                "{} ways and {} nodes still missing".format(
+                    len(missing["ways"]), len(missing["nodes"])
+                )
+            )
+        return missing
+
+    def changed_routes(self, source=None):
+        """Return a list of tuples with route id, action, change file and
+        date of the recorded changes
+
+        :param str source: the name of a change file to filter the changes
+        """
+        query = "SELECT route, action, source, applied FROM changes"
+        if source:
+            return self.conn.execute(query + " WHERE source=?", (source,)).fetchall()
+        return self.conn.execute(query).fetchall()
+
+    def missing(self):
+        """Return a dictionary with the ids of ways and nodes used by the
+        routes but not stored, they are existing objects added to a route
+        or a way by a change file and they are stored with complete or with
+        the next import"""
+        output = {"ways": [], "nodes": []}
+        for typ, oid in self.conn.execute("SELECT * FROM missing ORDER BY id"):
+            output["ways" if typ == "w" else "nodes"].append(oid)
+        return output
+
+    def read(self, select=None):
+        """Return a tuple with the routes, the ways, their geometries and the
+        nodes of each way like CaiOsmRoutePbf reads an OSM file. It raises
+        ValueError if some ways or nodes added by change files are missing
+
+        :param obj select: a function to check the tags of routes
+        """
+        missing = self.missing()
+        if missing["ways"] or missing["nodes"]:
+            raise ValueError(
+                "The replica {} is incomplete, {} ways and {} nodes added by "
+                "change files are missing, store them with complete".format(
+                    self.path, len(missing["ways"]), len(missing["nodes"])
+                )
+            )
+        routes = {}
+        ids = set()
+        for rid, tags, members in self.conn.execute("SELECT * FROM routes"):
+            tags = json.loads(tags)
+            if select and not select(tags):
+                continue
+            tags["id"] = rid
+            routes[rid] = Route(tags, json.loads(members))
+            ids.update(routes[rid].elems)
+        locations = {}
+        for nid, lon, lat in self.conn.execute("SELECT * FROM nodes"):
+            locations[nid] = (lon, lat)
+        ways = {}
+        geoms = WayGeometries()
+        waynodes = {}
+        for wid, tags, nodes in self.conn.execute("SELECT * FROM ways ORDER BY id"):
+            if wid not in ids:
+                continue
+            tags = json.loads(tags)
+            tags["id"] = wid
+            ways[wid] = Way(tags)
+            waynodes[wid] = json.loads(nodes)
+            try:
+                geoms.add(wid, [locations[nid] for nid in waynodes[wid]])
+            except Exception:
+                print("Error creating geometry for way {}".format(wid))
+        return routes, ways, geoms, waynodes
+
+
+class CaiOsmRouteReplica(CaiOsmRoutePbf):
+    """Class to get CAI routes from a local replica and convert in different
+    formats"""
+
+    def __init__(self, replica, polygon=None, **kwargs):
+        """Inizialize
+
+        :param obj replica: a CaiOsmReplica instance
+        :param obj polygon: a shapely polygon in WGS84 to select the routes,
+                            it replaces bbox
+        :param str bbox: a string with the bounding box of the area, needed
+                         format is YMIN,XMIN,YMAX,XMAX
+        :param bool bbox_inverted: set True id the bbox format is
+                                    XMIN,YMIN,XMAX,YMAX
+        :param str separator: the separator to use for CSV
+        :param bool debug: print debug information
+        :param str querytype: the type to query to use, it has to be included
+                              in the routes of the replica:
+            - hiking: download all hiking routes
+            - caiscale: use the presence of cai_scale tag to filter routes
+            - source: use source=servey:CAI and source=CAI tag to filter routes
+        """
+        if kwargs.get("area") and polygon is None:
+            raise ValueError("The replica has no boundaries, use polygon or bbox")
+        super(CaiOsmRouteReplica, self).__init__(
+            replica.path, polygon=polygon, **kwargs
+        )
+        self.replica = replica
+
+    def _read_file(self):
+        """Private function to read the routes from the replica"""
+        routes, ways, geoms, nodes = self.replica.read(route_filter(self.querytype))
+        return routes, [], ways, geoms, nodes
+
+    def get_file_osm(self, network="lwn", sort=True, out=None, out_format=None):
+        """OSM format is not available for the replica"""
+        raise ValueError("OSM format is not supported with the replica")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:48:31 2026
+
+@author: lucadelu
+"""
+import re
+import time
+import random
+import threading
+import requests
+from .connection import request
+
+RATE_LIMIT_RE = re.compile(r"^Rate limit: (\d+)", re.MULTILINE)
+SLOTS_NOW_RE = re.compile(r"^(\d+) slots? available now", re.MULTILINE)
+SLOTS_AFTER_RE = re.compile(
+    r"^Slot available after: \S+, in (-?\d+) seconds", re.MULTILINE
+)
+
+
+def status_url(url):
+    """Return the url of the status page from the url of the interpreter
+
+    :param str url: the url of the Overpass interpreter
+    """
+    url = url.rstrip("?")
+    if url.endswith("interpreter"):
+        return url[: -len("interpreter")] + "status"
+    return url.rstrip("/") + "/status"
+
+
+def parse_status(text):
+    """Parse the text of the Overpass status page and return a tuple with the
+    number of slots available now and the list of seconds to wait for the
+    other slots; the number of slots is None when there is no rate limit
+
+    :param str text: the text of the status page
+    """
+    limit = RATE_LIMIT_RE.search(text)
+    if not limit:
+        raise ValueError("Rate limit not found in Overpass status")
+    if int(limit.group(1)) == 0:
+        return None, []
+    now = SLOTS_NOW_RE.search(text)
+    available = int(now.group(1)) if now else 0
+    waits = [max(0, int(sec)) for sec in SLOTS_AFTER_RE.findall(text)]
+    return available, sorted(waits)
+
+
+class OverpassScheduler:
+    """Class to wait for a free Overpass slot before sending a query and
+    before retrying it when the server is overloaded"""
+
+    def __init__(
+        self,
+        url="http://overpass-api.de/api/interpreter?",
+        backoff=15,
+        maxwait=600,
+        debug=False,
+    ):
+        """Inizialize
+
+        :param str url: the url of the Overpass interpreter
+        :param int backoff: the seconds to wait for the first retry, it is
+                            doubled for each retry
+        :param int maxwait: the maximum seconds of a single wait
+        :param bool debug: print debug information
+        """
+        self.url = status_url(url)
+        self.backoff_time = backoff
+        self.maxwait = maxwait
+        self.debug = debug
+        self.waited = 0
+        self.lock = threading.Lock()
+
+    def _sleep(self, seconds):
+        """Sleep and add the seconds to the total waited time
+
+        :param float seconds: the seconds to sleep
+        """
+        if seconds <= 0:
+            return 0
+        if self.debug:
+            print("wait {} s".format(round(seconds, 1)))
+        time.sleep(seconds)
+        with self.lock:
+            self.waited += seconds
+        return seconds
+
+    def status(self):
+        """Return the slots status of the server, see parse_status, or None if
+        the status is not available"""
+        try:
+            resp = request(self.url, connect_timeout=10, read_timeout=30)
+            text = resp.text
+            resp.close()
+            return parse_status(text)
+        except (requests.RequestException, ValueError) as e:
+            if self.debug:
+                print("Overpass status not available: {}".format(e))
+            return None
+
+    def wait_slot(self):
+        """Wait until the server has a free slot for a new query, return the
+        seconds waited"""
+        waited = 0
+        while True:
+            status = self.status()
+            if status is None:
+                return waited
+            available, waits = status
+            if available is None or available > 0:
+                return waited
+            if not waits:
+                # no slot info, the server is busy with our queries
+                waits = [self.backoff_time]
+            waited += self._sleep(min(waits[0] + 1, self.maxwait))
+
+    def backoff(self, attempt):
+        """Wait before retrying a query, the time grows exponentially with the
+        number of attempts and a random jitter avoids synchronized retries
+
+        :param int attempt: the number of the failed attempt, starting from 0
+        """
+        delay = min(self.backoff_time * 2 ** attempt, self.maxwait)
+        return self._sleep(delay / 2 + random.uniform(0, delay / 2))
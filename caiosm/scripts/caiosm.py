@@ -6,24 +6,41 @@ Created on Tue Jan  8 11:53:50 2019
 @author: lucadelu
 """
 import os
-import time
 import argparse
 import shutil
 import faulthandler
 import configparser
+from caiosm.data_from_overpass import CaiOsmBase
 from caiosm.data_from_overpass import CaiOsmRoute
 from caiosm.data_from_overpass import CaiOsmOffice
 from caiosm.data_from_overpass import CaiOsmSourceRef
+from caiosm.data_from_overpass import CSV_FIELDS
+from caiosm.data_from_overpass import WIKI_FIELDS
+from caiosm.data_from_pbf import CaiOsmRoutePbf
+from caiosm.replica import CaiOsmReplica
 from caiosm.data_print import CaiOsmReport
 from caiosm.infomont import CaiOsmInfomont
 from caiosm.functions import REGIONI
 from caiosm.functions import make_safe_filename
 from caiosm.data_diff import ManageChanges
 from caiosm.data_report import CaiOsmHistory
+from caiosm.regions import CaiOsmRegions
+from caiosm.cache import OverpassCache
+from caiosm.cache import CACHE_DIR
+from caiosm.cache import CACHE_MAXSIZE
+from caiosm.areas import AreaIds
+from caiosm.planner import QueryPlan
+from caiosm.connection import configure
+from caiosm.pool import OverpassPool
+from caiosm.fetcher import RegionsFetcher
 
-def get_updates(config):
-    for reg in REGIONI:
-        mc = ManageChanges(area=reg)
+def get_updates(
+    config, cache=None, pool=None, concurrency=2, debug=False, areas=None
+):
+    def fetch(reg):
+        return ManageChanges(area=reg, cache=cache, pool=pool, areas=areas)
+
+    def process(reg, mc):
         if len(mc.changes) > 0:
             print("**{} has changes**".format(reg))
             # TODO find a way to store mail for region
@@ -38,19 +55,42 @@ def get_updates(config):
             )
         else:
             print("--{} has no changes--".format(reg))
-        time.sleep(int(config["MISC"]["overpasstime"]))
-    return True
 
+    fetcher = RegionsFetcher(concurrency=concurrency, debug=debug)
+    fetcher.run(fetch, process)
+    return fetcher.check()
 
-def create_infomont(inarea, inbox, args, prefix=None, out=None):
-    if not out:
-        out = args.out
-    coi = CaiOsmInfomont(bbox=inbox, area=inarea, debug=args.debug, prefix=prefix)
+
+def get_infomont(inarea, inbox, args, prefix=None, handler=None):
+    return CaiOsmInfomont(
+        bbox=inbox,
+        area=inarea,
+        debug=args.debug,
+        prefix=prefix,
+        cache=args.cache,
+        pool=args.pool,
+        handler=handler,
+        outgeom=args.outgeom,
+        tilesize=args.tilesize,
+        pbf=args.pbf,
+        idx=args.index,
+        areas=args.areas,
+    )
+
+
+def write_infomont(coi, args, out):
     coi.write_all_geo(out)
     if args.zip:
         shutil.make_archive(os.path.split(out)[-1], "zip", out)
 
 
+def create_infomont(inarea, inbox, args, prefix=None, out=None, handler=None):
+    if not out:
+        out = args.out
+    coi = get_infomont(inarea, inbox, args, prefix, handler)
+    write_infomont(coi, args, out)
+
+
 def main():
     faulthandler.enable()
     parser = argparse.ArgumentParser(description="Work with CAI OSM data")
@@ -71,6 +111,58 @@ def main():
         dest="config",
     )
     parser.add_argument("--debug", dest="debug", action="store_true", help="set debug")
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=2,
+        help="the number of regions to process at the same time, default 2",
+    )
+    parser.add_argument(
+        "--out-geom",
+        dest="outgeom",
+        action="store_true",
+        help="download the geometry of ways instead of their nodes, faster "
+        "and with less memory for large areas",
+    )
+    parser.add_argument(
+        "--tile-size",
+        dest="tilesize",
+        type=float,
+        help="split the --box query in tiles of this size in degrees, tiles "
+        "are split again when their query fails",
+    )
+    parser.add_argument(
+        "--pbf",
+        dest="pbf",
+        help="a local OSM file, like a PBF extract, to read the routes from "
+        "instead of using Overpass API",
+    )
+    parser.add_argument(
+        "--index",
+        dest="index",
+        help="the osmium index type for node locations, with a file based "
+        "index like sparse_file_array,/path/nodes.idx the index of a --pbf "
+        "file is created once and reused",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="nocache",
+        action="store_true",
+        help="do not use the cache of Overpass responses",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        dest="refreshcache",
+        action="store_true",
+        help="download again the data and update the cache of Overpass " "responses",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cachedir",
+        help="the directory for the cache of Overpass responses, "
+        "default {}".format(CACHE_DIR),
+    )
     subparsers = parser.add_subparsers(help="caiosm sub commands help")
     parser_get = subparsers.add_parser(
         "route", help="Get CAI route data" " in several formats"
@@ -98,6 +190,14 @@ def main():
     parser_get.add_argument(
         "-O", dest="osmwrite", help="name for a file in " "OSM format with CAI routes"
     )
+    parser_get.add_argument(
+        "-F",
+        dest="osmformat",
+        default=None,
+        choices=["osm", "osm.gz", "pbf"],
+        help="the format of the OSM file, by default it is detected by the "
+        "suffix of the file name",
+    )
     parser_get.add_argument(
         "-j",
         dest="json",
@@ -147,6 +247,13 @@ def main():
         "-r", dest="regs", action="store_true", help="create all Italian regions"
     )
     parser_infomont.add_argument("-p", dest="prefix", help="added prefix to the id")
+    parser_infomont.add_argument(
+        "-n",
+        dest="national",
+        action="store_true",
+        help="with -r download all Italy with a single query and split "
+        "it by region locally",
+    )
     parser_infomont.add_argument(
         "-z",
         dest="zip",
@@ -180,6 +287,14 @@ def main():
     parser_office.add_argument(
         "-O", dest="osmwrite", help="name for a file " "in OSM format with CAI offices"
     )
+    parser_office.add_argument(
+        "-F",
+        dest="osmformat",
+        default=None,
+        choices=["osm", "osm.gz", "pbf"],
+        help="the format of the OSM file, by default it is detected by the "
+        "suffix of the file name",
+    )
     parser_office.add_argument(
         "-j",
         dest="json",
@@ -212,12 +327,37 @@ def main():
                              help="End date for statistics")
     parser_stas.add_argument("-d", dest="delta",
                              help="Granule for statistics")
+    parser_stas.add_argument("-n", dest="national", action="store_true",
+                             help="download all Italy with a single query "
+                             "for each date and split it by region locally")
+    parser_replica = subparsers.add_parser(
+        "replica", help="Create or update a local replica of CAI routes"
+    )
+    parser_replica.set_defaults(func="replica")
+    parser_replica.add_argument(
+        "-d", dest="database", required=True, help="the SQLite file of the replica"
+    )
+    parser_replica.add_argument(
+        "-i", dest="importfile", help="create the replica from an OSM file"
+    )
+    parser_replica.add_argument(
+        "-a",
+        dest="changes",
+        nargs="+",
+        help="OSM change files, .osc or .osc.gz, to apply in the given order",
+    )
+    parser_replica.add_argument(
+        "-c",
+        dest="complete",
+        help="an OSM file with the ways and nodes added by the change files "
+        "and missing in the replica, like a newer extract",
+    )
     args = parser.parse_args()
 
     if not args.place and not args.box:
         if args.func == "infomont" and args.regs:
             pass
-        elif args.func in ["updates", "stats"]:
+        elif args.func in ["updates", "stats", "replica"]:
             pass
         else:
             raise ValueError("one between --place or --box options is required")
@@ -234,12 +374,76 @@ def main():
     if args.config:
         config = configparser.ConfigParser()
         config.read(args.config)
+        if config.has_section("MISC"):
+            configure(
+                connect_timeout=config["MISC"].getint("connecttimeout", None),
+                read_timeout=config["MISC"].getint("readtimeout", None),
+            )
+
+    maxwait = 600
+    urls = ["http://overpass-api.de/api/interpreter?"]
+    if config and config.has_section("MISC"):
+        maxwait = config["MISC"].getint("overpasstime", maxwait)
+        overpassurl = config["MISC"].get("overpassurl", "None")
+        if overpassurl and overpassurl != "None":
+            urls = [url.strip() for url in overpassurl.split(",") if url.strip()]
+    args.pool = OverpassPool(urls=urls, maxwait=maxwait, debug=args.debug)
+
+    args.cache = None
+    if not args.nocache:
+        cachedir = args.cachedir
+        cachesize = CACHE_MAXSIZE
+        if config and config.has_section("MISC"):
+            if not cachedir:
+                cachedir = config["MISC"].get("cachedir", None)
+            cachesize = config["MISC"].getint("cachesize", CACHE_MAXSIZE)
+        args.cache = OverpassCache(
+            path=cachedir or CACHE_DIR,
+            maxsize=cachesize,
+            refresh=args.refreshcache,
+            debug=args.debug,
+        )
+
+    # the Overpass ids of the areas are stored with the cache
+    args.areas = None
+    if args.cache:
+        args.areas = AreaIds(
+            os.path.join(args.cache.path, "areas.json"), debug=args.debug
+        )
+        if args.func in ["updates", "stats"] or (
+            args.func == "infomont" and args.regs
+        ):
+            args.areas.resolve(
+                REGIONI.keys(),
+                CaiOsmBase(cache=args.cache, pool=args.pool, debug=args.debug),
+            )
 
     # initialize the right class to use
-    if args.func in ["report", "route"]:
-        cod = CaiOsmRoute(bbox=inbox, area=inarea, debug=args.debug)
+    if args.func in ["report", "route"] and args.pbf:
+        cod = CaiOsmRoutePbf(
+            args.pbf, bbox=inbox, area=inarea, debug=args.debug, idx=args.index
+        )
+    elif args.func in ["report", "route"]:
+        cod = CaiOsmRoute(
+            bbox=inbox,
+            area=inarea,
+            debug=args.debug,
+            cache=args.cache,
+            pool=args.pool,
+            outgeom=args.outgeom,
+            tilesize=args.tilesize,
+            idx=args.index or "flex_mem",
+            areas=args.areas,
+        )
     elif args.func == "office":
-        cod = CaiOsmOffice(bbox=inbox, area=inarea, debug=args.debug)
+        cod = CaiOsmOffice(
+            bbox=inbox,
+            area=inarea,
+            debug=args.debug,
+            cache=args.cache,
+            pool=args.pool,
+            areas=args.areas,
+        )
 
     if args.func == "report":
         if args.geo:
@@ -250,6 +454,32 @@ def main():
         cor = CaiOsmReport(tags, geo=args.geo, debug=args.debug)
         cor.write_book(args.out, True)
     elif args.func in ["route", "office"]:
+        outputs = [
+            args.wiki,
+            args.wikiwrite,
+            args.csv,
+            args.csvwrite,
+            args.osmwrite,
+            args.json,
+            args.jsonwrite,
+            args.geojson,
+            args.geojsonwrite,
+        ]
+        # download the data only once when several outputs are required,
+        # with only the fields and the geometry needed by them
+        if args.func == "route" and len([out for out in outputs if out]) > 1:
+            plan = QueryPlan()
+            if args.wiki or args.wikiwrite:
+                plan.require(WIKI_FIELDS)
+            if args.csv or args.csvwrite:
+                plan.require(CSV_FIELDS)
+            if args.json or args.jsonwrite:
+                plan.require(True)
+            if args.geojson or args.geojsonwrite:
+                plan.require(True, "full")
+            if args.osmwrite:
+                plan.require(True, "full")
+            cod.load_dataset(plan)
         if args.wiki:
             print(cod.wiki_table())
             print("")
@@ -261,7 +491,8 @@ def main():
         if args.csvwrite:
             cod.write(args.csvwrite, "csv")
         if args.osmwrite:
-            cod.write(args.osmwrite, "osm")
+            # without -F the OSM format is detected by the suffix
+            cod.write(args.osmwrite, args.osmformat or "osm")
         if args.json:
             if args.func == "route":
                 print(cod.get_tags_json())
@@ -280,6 +511,8 @@ def main():
             print("")
         if args.geojsonwrite:
             cod.write(args.geojsonwrite, "geojson")
+        if args.func == "route":
+            cod.close()
     elif args.func == "infomont":
         if not args.out:
             raise ValueError("Please set -o options")
@@ -291,22 +524,36 @@ def main():
                 "The directory {} exists, but it is not " "writable".format(args.out)
             )
         if args.regs:
-            for reg, regid in REGIONI.items():
-                if args.debug:
-                    print("-------- Processing : {} --------".format(reg))
+            print(
+                "WARNING: process take long time, please run it in"
+                " a screen session or cronjob"
+            )
+            cors = None
+            if args.national:
+                cors = CaiOsmRegions(
+                    debug=args.debug,
+                    cache=args.cache,
+                    pool=args.pool,
+                    outgeom=args.outgeom,
+                    areas=args.areas,
+                )
+                cors.assign()
+
+            def fetch(reg):
+                handler = None
+                if cors:
+                    handler = cors.get_region_handler(reg, infomont=True)
+                return get_infomont(reg, None, args, REGIONI[reg], handler)
+
+            def process(reg, coi):
                 outpath = os.path.join(args.out, make_safe_filename(reg))
                 if not os.path.isdir(outpath):
                     os.makedirs(outpath)
-                try:
-                    print(
-                        "WARNING: process take long time, please run it in"
-                        " a screen session or cronjob"
-                    )
-                    create_infomont(reg, None, args, regid, outpath)
-                except:
-                    raise ValueError(
-                        "Error creating infomont data for region" " {}".format(reg)
-                    )
+                write_infomont(coi, args, outpath)
+
+            fetcher = RegionsFetcher(concurrency=args.jobs, debug=args.debug)
+            fetcher.run(fetch, process)
+            fetcher.check()
         elif inbox or inarea:
             prefix = None
             if args.prefix:
@@ -326,16 +573,48 @@ def main():
             "WARNING: process take long time, please run it in"
             " a screen session or cronjob"
         )
-        get_updates(config)
+        get_updates(
+            config,
+            cache=args.cache,
+            pool=args.pool,
+            concurrency=args.jobs,
+            debug=args.debug,
+            areas=args.areas,
+        )
     elif args.func == "stats":
         if config is None:
             raise ValueError("--config option is required")
         coh = CaiOsmHistory(args.start, args.end, args.delta,
-                            sleep=int(config["MISC"]["overpasstime"]))
+                            sleep=int(config["MISC"]["overpasstime"]),
+                            cache=args.cache, pool=args.pool,
+                            national=args.national, concurrency=args.jobs,
+                            areas=args.areas)
         print(
             "WARNING: process take long time, please run it in"
             " a screen session or cronjob"
         )
         coh.regions_csv()
+    elif args.func == "replica":
+        rep = CaiOsmReplica(args.database, debug=args.debug)
+        if args.importfile:
+            rep.import_file(args.importfile)
+        for path in args.changes or []:
+            for rid, action in sorted(rep.apply_changes(path).items()):
+                print("{}: {} {}".format(os.path.basename(path), action, rid))
+        if args.complete:
+            rep.complete(args.complete)
+        missing = rep.missing()
+        if missing["ways"] or missing["nodes"]:
+            print(
+                "WARNING: {} ways and {} nodes are missing, the replica could "
+                "not be read until they are added with -c".format(
+                    len(missing["ways"]), len(missing["nodes"])
+                )
+            )
+        rep.close()
     else:
         parser.print_help()
+    if args.debug:
+        print("Waited {} s for Overpass slots".format(round(args.pool.waited)))
+        for stat in args.pool.stats():
+            print(stat)
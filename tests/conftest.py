@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:40:12 2026
+
+@author: lucadelu
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import pytest
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Handler of a local server simulating an Overpass instance, the
+    behaviour is set by the server attributes:
+        - status: the HTTP status code of the answer
+        - delay: seconds to wait before the headers
+        - body: the bytes of the body
+        - stall: seconds to wait in the middle of the body
+        - reset: close the connection in the middle of the body
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # no status page, the scheduler doesn't wait
+        self.send_error(404)
+
+    def do_POST(self):
+        srv = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        srv.queries += 1
+        time.sleep(srv.delay)
+        if srv.status != 200:
+            self.send_error(srv.status)
+            return
+        half = len(srv.body) // 2
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(srv.body)))
+        self.end_headers()
+        self.wfile.write(srv.body[:half])
+        self.wfile.flush()
+        if srv.reset:
+            self.close_connection = True
+            return
+        time.sleep(srv.stall)
+        self.wfile.write(srv.body[half:])
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Class of the stand-in server, the clients closing the connections
+    on timeouts are not reported"""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+@pytest.fixture
+def standin():
+    """Return a function starting a stand-in Overpass server and returning
+    it, the url of the interpreter is in the url attribute"""
+    servers = []
+
+    def start(status=200, delay=0, body=b"<osm></osm>", stall=0, reset=False):
+        srv = StandInServer(("127.0.0.1", 0), StandInHandler)
+        srv.status = status
+        srv.delay = delay
+        srv.body = body
+        srv.stall = stall
+        srv.reset = reset
+        srv.queries = 0
+        srv.url = "http://127.0.0.1:{}/api/interpreter".format(srv.server_port)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        return srv
+
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
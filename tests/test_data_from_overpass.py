@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:58:19 2026
+
+@author: lucadelu
+"""
+import pytest
+from caiosm.cache import OverpassCache
+from caiosm.data_from_overpass import CaiOsmData
+from caiosm.data_from_overpass import CaiOsmRouteDiff
+
+JSON = b"""{
+  "version": 0.6,
+  "elements": [
+{"type": "relation", "id": 1, "tags": {"type": "route", "cai_scale": "T"}},
+{"type": "relation", "id": 2, "tags": {"type": "route", "cai_scale": "E"}}
+  ]%s
+}"""
+TIMEOUT = b""",
+  "remark": "runtime error: Query timed out in \\"query\\" at line 4 after 2 seconds."
+"""
+ADIFF = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<action type="create">
+<relation id="1" version="1" timestamp="2026-10-17T10:00:00Z" changeset="5">
+<tag k="type" v="route"/><tag k="cai_scale" v="T"/>
+</relation>
+</action>
+%s</osm>"""
+ADIFF_TIMEOUT = b"""<remark> runtime error: Query timed out in "query" at line 3 after 2
+seconds. </remark>
+"""
+
+
+def test_tags_json(standin, tmp_path):
+    srv = standin(body=JSON % b"")
+    cache = OverpassCache(path=str(tmp_path))
+    cod = CaiOsmData(bbox="45,10,46,11", url=srv.url, cache=cache)
+    cod.query = 'relation["route"="hiking"]{netw}({bbox});'
+    assert [tags["id"] for tags in cod.get_tags_json()] == [1, 2]
+    assert cache.size() > 0
+    # the second request is read from the cache
+    assert [tags["id"] for tags in cod.get_tags_json()] == [1, 2]
+    assert srv.queries == 1
+
+
+def test_tags_json_error(standin, tmp_path):
+    srv = standin(body=JSON % TIMEOUT)
+    cache = OverpassCache(path=str(tmp_path))
+    cod = CaiOsmData(bbox="45,10,46,11", url=srv.url, cache=cache)
+    cod.query = 'relation["route"="hiking"]{netw}({bbox});'
+    with pytest.raises(ValueError, match="Query timed out"):
+        cod.get_tags_json()
+    # the partial data are not cached
+    assert cache.size() == 0
+    with pytest.raises(ValueError):
+        cod.get_tags_json()
+    assert srv.queries == 2
+
+
+def test_adiff_error(standin, tmp_path):
+    srv = standin(body=ADIFF % ADIFF_TIMEOUT)
+    cache = OverpassCache(path=str(tmp_path))
+    cod = CaiOsmRouteDiff(
+        startdate="2026-10-17T00:00:00Z",
+        enddate="2026-10-18T00:00:00Z",
+        bbox="45,10,46,11",
+        url=srv.url,
+        cache=cache,
+    )
+    with pytest.raises(ValueError, match="Query timed out"):
+        cod.get_changes()
+    assert cache.size() == 0
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:44:36 2026
+
+@author: lucadelu
+"""
+import io
+import time
+import pytest
+import requests
+from caiosm.pool import OverpassPool
+from caiosm.scheduler import OverpassScheduler
+
+BODY = b"<osm>" + b"x" * 100000 + b"</osm>"
+
+
+def make_pool(servers, **kwargs):
+    """Return a pool of the stand-in servers without waits between retries"""
+    urls = [srv.url for srv in servers]
+    if len(urls) == 1:
+        kwargs["scheduler"] = OverpassScheduler(urls[0], backoff=0)
+    return OverpassPool(urls=urls, cooldown=0, **kwargs)
+
+
+def test_failover_status(standin):
+    failing = standin(status=503)
+    good = standin(body=BODY)
+    pool = make_pool([failing, good])
+    resp = pool.open("relation(1);out;")
+    assert resp.content == BODY
+    assert failing.queries == 1
+    assert good.queries == 1
+    assert pool.endpoints[0].errors == 1
+    assert pool.endpoints[1].errors == 0
+
+
+def test_failover_slow(standin):
+    slow = standin(delay=2, body=BODY)
+    good = standin(body=BODY)
+    pool = make_pool([slow, good])
+    resp = pool.open("relation(1);out;", read_timeout=0.5)
+    assert resp.content == BODY
+    assert pool.endpoints[0].errors == 1
+
+
+def test_no_failover_bad_request(standin):
+    bad = standin(status=400)
+    good = standin(body=BODY)
+    pool = make_pool([bad, good])
+    with pytest.raises(requests.HTTPError):
+        pool.open("relation(1);out;")
+    assert good.queries == 0
+
+
+def test_retries_single_endpoint(standin):
+    failing = standin(status=429)
+    pool = make_pool([failing], maxretries=2)
+    with pytest.raises(requests.HTTPError):
+        pool.open("relation(1);out;")
+    assert failing.queries == 3
+    assert pool.endpoints[0].running == 0
+
+
+def test_download_body_reset(standin):
+    broken = standin(body=BODY, reset=True)
+    good = standin(body=BODY)
+    pool = make_pool([broken, good])
+    buf = io.BytesIO()
+    size = pool.download("relation(1);out;", buf)
+    assert size == len(BODY)
+    assert buf.getvalue() == BODY
+    assert pool.endpoints[0].errors == 1
+    assert pool.endpoints[1].requests == 1
+
+
+def test_download_body_timeout(standin):
+    stalled = standin(body=BODY, stall=2)
+    good = standin(body=BODY)
+    pool = make_pool([stalled, good])
+    buf = io.BytesIO()
+    pool.download("relation(1);out;", buf, read_timeout=0.5)
+    assert buf.getvalue() == BODY
+    assert pool.endpoints[0].errors == 1
+
+
+def test_slot_held_until_body_read(standin):
+    slow = standin(body=BODY, stall=0.5)
+    pool = make_pool([slow], slots=1)
+    end = pool.endpoints[0]
+    start = time.time()
+    resp = pool.open("relation(1);out;")
+    assert end.running == 1
+    assert not end.available()
+    assert resp.content == BODY
+    assert end.running == 0
+    # the latency includes the download of the body
+    assert end.latency >= 0.5
+    assert time.time() - start >= end.latency
+
+
+def test_slot_released_on_close(standin):
+    good = standin(body=BODY)
+    pool = make_pool([good], slots=1)
+    resp = pool.open("relation(1);out;")
+    resp.close()
+    end = pool.endpoints[0]
+    assert end.running == 0
+    # an unread body is neither a success nor an error
+    assert end.requests == 0
+    assert end.errors == 0
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:12:53 2026
+
+@author: lucadelu
+"""
+import pytest
+from caiosm.replica import CaiOsmReplica
+
+BASE = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+<node id="1" version="1" lat="46.00" lon="11.00"/>
+<node id="2" version="1" lat="46.01" lon="11.00"/>
+<node id="3" version="1" lat="46.02" lon="11.00"/>
+<node id="4" version="1" lat="46.02" lon="11.01"/>
+<node id="5" version="1" lat="46.02" lon="11.02"/>
+<node id="6" version="1" lat="46.00" lon="11.01"/>
+<way id="1" version="1"><nd ref="1"/><nd ref="2"/><tag k="highway" v="path"/></way>
+<way id="2" version="1"><nd ref="2"/><nd ref="3"/><tag k="highway" v="path"/></way>
+<way id="3" version="1"><nd ref="4"/><nd ref="5"/><tag k="highway" v="track"/></way>
+<relation id="1" version="1">
+<member type="way" ref="1" role=""/><member type="way" ref="2" role=""/>
+<tag k="type" v="route"/><tag k="route" v="hiking"/><tag k="cai_scale" v="T"/>
+</relation>
+<relation id="2" version="1">
+<member type="way" ref="2" role=""/>
+<tag k="type" v="route"/><tag k="route" v="hiking"/><tag k="cai_scale" v="E"/>
+</relation>
+<relation id="3" version="1">
+<member type="way" ref="3" role=""/>
+<tag k="type" v="route"/><tag k="route" v="bicycle"/>
+</relation>
+</osm>
+"""
+CHANGE = """<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+{}
+</osmChange>
+"""
+CREATE = """<create>
+<node id="10" version="1" lat="45.00" lon="10.00"/>
+<node id="11" version="1" lat="45.01" lon="10.00"/>
+<way id="10" version="1"><nd ref="10"/><nd ref="11"/></way>
+<relation id="4" version="1">
+<member type="way" ref="10" role=""/>
+<tag k="type" v="route"/><tag k="route" v="hiking"/><tag k="cai_scale" v="EE"/>
+</relation>
+</create>"""
+MODIFY = """<modify>
+<node id="3" version="2" lat="46.03" lon="11.00"/>
+</modify>"""
+DELETE = """<delete>
+<relation id="2" version="2"/>
+</delete>"""
+DELETE_ALL = """<delete>
+<relation id="1" version="2"/>
+<relation id="2" version="2"/>
+</delete>"""
+ADD_WAY = """<modify>
+<relation id="1" version="2">
+<member type="way" ref="1" role=""/><member type="way" ref="2" role=""/>
+<member type="way" ref="3" role=""/>
+<tag k="type" v="route"/><tag k="route" v="hiking"/><tag k="cai_scale" v="T"/>
+</relation>
+</modify>"""
+ADD_NODE = """<modify>
+<way id="1" version="2">
+<nd ref="6"/><nd ref="1"/><nd ref="2"/><tag k="highway" v="path"/>
+</way>
+</modify>"""
+
+
+def write(path, text):
+    with open(path, "w") as fil:
+        fil.write(text)
+    return str(path)
+
+
+@pytest.fixture
+def replica(tmp_path):
+    """Return a replica created from the BASE data and the path to them"""
+    base = write(tmp_path / "base.osm", BASE)
+    rep = CaiOsmReplica(str(tmp_path / "replica.sqlite"))
+    rep.import_file(base)
+    yield rep, base
+    rep.close()
+
+
+def apply(rep, tmp_path, name, text):
+    return rep.apply_changes(write(tmp_path / name, CHANGE.format(text)))
+
+
+def test_import(replica):
+    rep, base = replica
+    routes, ways, geoms, waynodes = rep.read()
+    assert sorted(routes.keys()) == [1, 2]
+    assert list(routes[1].elems) == [1, 2]
+    assert sorted(ways.keys()) == [1, 2]
+    assert waynodes[2] == [2, 3]
+    assert ways[1]["tags"] == {"highway": "path", "id": 1}
+    assert rep.missing() == {"ways": [], "nodes": []}
+
+
+def test_create(replica, tmp_path):
+    rep, base = replica
+    assert apply(rep, tmp_path, "create.osc", CREATE) == {4: "create"}
+    routes, ways, geoms, waynodes = rep.read()
+    assert sorted(routes.keys()) == [1, 2, 4]
+    assert geoms.coordinates(10).tolist() == [[10.0, 45.0], [10.0, 45.01]]
+    assert rep.changed_routes("create.osc")[0][:3] == (4, "create", "create.osc")
+
+
+def test_modify(replica, tmp_path):
+    rep, base = replica
+    changed = apply(rep, tmp_path, "modify.osc", MODIFY)
+    assert changed == {1: "modify", 2: "modify"}
+    geoms = rep.read()[2]
+    assert geoms.coordinates(2).tolist() == [[11.0, 46.01], [11.0, 46.03]]
+
+
+def test_delete(replica, tmp_path):
+    rep, base = replica
+    assert apply(rep, tmp_path, "delete.osc", DELETE) == {2: "delete"}
+    routes, ways = rep.read()[:2]
+    assert sorted(routes.keys()) == [1]
+    # way 2 is still used by route 1
+    assert sorted(ways.keys()) == [1, 2]
+    assert apply(rep, tmp_path, "delete_all.osc", DELETE_ALL) == {1: "delete"}
+    routes, ways = rep.read()[:2]
+    assert routes == {}
+    assert ways == {}
+    assert rep.conn.execute("SELECT count(*) FROM nodes").fetchone()[0] == 0
+
+
+def test_new_member_way(replica, tmp_path):
+    rep, base = replica
+    assert apply(rep, tmp_path, "add_way.osc", ADD_WAY) == {1: "modify"}
+    # way 3 existed before the change, so it is not in the change file
+    assert rep.missing() == {"ways": [3], "nodes": []}
+    with pytest.raises(ValueError, match="incomplete"):
+        rep.read()
+    assert rep.complete(base) == {"ways": [], "nodes": []}
+    routes, ways, geoms, waynodes = rep.read()
+    assert list(routes[1].elems) == [1, 2, 3]
+    assert waynodes[3] == [4, 5]
+    assert geoms.coordinates(3).tolist() == [[11.01, 46.02], [11.02, 46.02]]
+
+
+def test_new_member_node(replica, tmp_path):
+    rep, base = replica
+    assert apply(rep, tmp_path, "add_node.osc", ADD_NODE) == {1: "modify"}
+    assert rep.missing() == {"ways": [], "nodes": [6]}
+    with pytest.raises(ValueError):
+        rep.read()
+    rep.complete(base)
+    geoms = rep.read()[2]
+    assert geoms.coordinates(1).tolist()[0] == [11.01, 46.0]
+
+
+def test_missing_removed(replica, tmp_path):
+    rep, base = replica
+    apply(rep, tmp_path, "add_way.osc", ADD_WAY)
+    # the route is deleted before the missing way is stored
+    apply(rep, tmp_path, "delete_all.osc", DELETE_ALL)
+    assert rep.missing() == {"ways": [], "nodes": []}
+    assert rep.read()[0] == {}